@@ -1,3 +1,4 @@
+import asyncio
 import copy
 from collections import defaultdict
 import random
@@ -17,7 +18,7 @@ import numpy as np
 import tqdm
 import tiktoken
 
-from llm_client import LLMClient
+from llm_client import LLMClient, AsyncLLMClient
 import nmmo
 from nmmo.core.tile import TileState
 from nmmo.entity.entity import Entity
@@ -34,6 +35,9 @@ from datetime import datetime
 
 from bridge.state_manager import StateManager
 from bridge.action_manager import ActionManager
+from utils.response_cache import get_response_cache
+from utils.cassette import get_cassette
+from utils.admission_control import get_admission_controller
 
 # from strategy_manager import StrategyManager
 
@@ -45,7 +49,9 @@ from agent.modules.planning_module import PlanningModule
 from agent.modules.perception_module import PerceptionModule
 from agent.modules.verify_module import VerifyModule
 from agent.modules.reduction_module import ReductionModule
-from api_key import openai_base_url, openai_api_key, llama_base_url, llama_api_key
+from agent.prompt_budget import MEMORY_HEADER, BudgetedState
+from agent.decision_session import DecisionSession
+from api_key import openai_base_url, openai_api_key, llama_base_urls, llama_api_key
 
 
 def save_ml_action(file_path, tick, ml_action):
@@ -69,12 +75,35 @@ class LLMPlayer:
         allow_give_action=False,
         use_interaction_memory=False,
         max_verify_time=5,
+        incremental_state=False,  # 是否增量提取state
+        use_async_llm=False,  # 是否使用AsyncLLMClient(配合act_async)
+        response_cache_path=None,  # LLM回复缓存的sqlite文件路径，None表示不使用缓存
+        response_cache_max_mb=256,
+        cassette_path=None,  # 录制/回放LLM回复的文件路径
+        cassette_mode=None,  # "record" 或 "replay"，None表示不使用
+        agent_id=None,  # agent编号，cassette按agent分别录制/回放
+        guided_decoding=None,  # 约束解码: guided_json/guided_choice/json_schema，None表示不使用
+        routing_policy="least_outstanding",  # 多个推理服务副本之间的路由方式: least_outstanding/latency_weighted
+        max_concurrent_requests=None,  # 所有agent同时进行的LLM请求数上限，None表示不限制
+        max_tokens_per_sec=None,  # 所有agent估计的token/s上限，None表示不限制
+        stream_responses=False,  # 流式请求LLM，得到合法的json后立即停止生成
+        request_timeout=60.0,  # 单次LLM请求的超时(秒)
+        prompt_layout="default",  # prompt布局: default/prefix_cache(静态规则在前，动态状态在后)
+        prefix_tracker=None,  # 统计各模块prompt公共前缀长度的PrefixTracker，所有player共享
+        serialization="pretty",  # 状态描述的序列化profile: pretty/compact/tabular
+        count_state_tokens=False,  # 是否统计每个prompt中状态各部分的token数
+        prompt_token_budget=None,  # 各模块prompt的token预算，如{"action": 3000, "verify": 3000}，None表示不截断
+        decision_session=False,  # 是否在一个多轮对话中决策，每次只发送状态变化
+        session_max_turns=32,  # 对话达到该轮数后重置，重新发送完整状态
         max_execute_step=10,  # 最大执行步数
         add_action_history=False,
         enable_llm_thinking=False,
         debug=False,
     ):
         ##### 参数 #####
+        prompt_token_budget = prompt_token_budget or {}
+        # session模式发送结构化的状态变化，不能使用压缩后的状态描述
+        assert not (decision_session and use_information_reduction), "decision_session cannot be used with use_information_reduction"
         self.player_role = player_role
         self.use_information_reduction = use_information_reduction
         self.allow_give_action = allow_give_action
@@ -89,11 +118,34 @@ class LLMPlayer:
             base_url = openai_base_url
             api_key = openai_api_key
         elif "llama" in model_name.lower():
-            base_url = llama_base_url
+            base_url = llama_base_urls
             api_key = llama_api_key
         else:
             raise ValueError(f"Invalid model name: {model_name}")
-        self.llm_client = LLMClient(base_url=base_url, api_key=api_key, model=model_name, enable_thinking=enable_llm_thinking)
+        self.use_async_llm = use_async_llm
+        llm_client_class = AsyncLLMClient if use_async_llm else LLMClient
+        if response_cache_path:
+            response_cache = get_response_cache(response_cache_path, max_bytes=response_cache_max_mb * 1024 * 1024)
+        else:
+            response_cache = None
+        cassette = get_cassette(cassette_path, cassette_mode) if cassette_mode else None
+        admission_controller = get_admission_controller(
+            base_url, api_key, max_concurrency=max_concurrent_requests, tokens_per_second=max_tokens_per_sec
+        )
+        self.llm_client = llm_client_class(
+            base_url=base_url,
+            api_key=api_key,
+            model=model_name,
+            enable_thinking=enable_llm_thinking,
+            response_cache=response_cache,
+            cassette=cassette,
+            cassette_agent=agent_id,
+            guided_decoding=guided_decoding,
+            routing_policy=routing_policy,
+            admission_controller=admission_controller,
+            stream=stream_responses,
+            request_timeout=request_timeout,
+        )
 
         self.file_save_path = file_save_path
         self.file_name_full = f"{self.file_save_path}/prompt_{self.model_name}.txt"  # 完整提示文件保存路径
@@ -102,25 +154,67 @@ class LLMPlayer:
         os.makedirs(self.file_save_path, exist_ok=True)
 
         ##### 属性 #####
-        self.state_manager = StateManager(env)
+        self.state_manager = StateManager(env, incremental=incremental_state)
         self.action_manager = ActionManager(env)
         # self.strategy_manager = strategy_manager
         self.game_rule_module = GameRuleModule(config)
         self.memory_module = MemoryModule(max_history=20)
-        self.perceive_module = PerceptionModule(config, self.llm_client, self.file_name_full, debug=debug)
+        self.perceive_module = PerceptionModule(
+            config,
+            self.llm_client,
+            self.file_name_full,
+            serialization=serialization,
+            count_state_tokens=count_state_tokens,
+            debug=debug,
+        )
         self.plan_module = PlanningModule(config, self.llm_client, self.file_name_full, debug=debug)
-        self.action_module = ActionModule(config, self.llm_client, self.file_name_full, debug=debug)
-        self.verify_module = VerifyModule(config, self.llm_client, self.file_name_full, debug=debug)
+        self.action_module = ActionModule(
+            config,
+            self.llm_client,
+            self.file_name_full,
+            prompt_layout=prompt_layout,
+            prefix_tracker=prefix_tracker,
+            token_budget=prompt_token_budget.get("action"),
+            debug=debug,
+        )
+        self.verify_module = VerifyModule(
+            config,
+            self.llm_client,
+            self.file_name_full,
+            prompt_layout=prompt_layout,
+            prefix_tracker=prefix_tracker,
+            token_budget=prompt_token_budget.get("verify"),
+            debug=debug,
+        )
         if self.use_information_reduction:
             self.reduction_module = ReductionModule(
                 config,
                 self.llm_client,
                 self.file_name_full,
                 use_reduction=True,
+                prompt_layout=prompt_layout,
+                prefix_tracker=prefix_tracker,
                 debug=debug,
             )
+        self.prompt_layout = prompt_layout
+        self.use_prompt_budget = any(budget is not None for budget in prompt_token_budget.values())
+        if prompt_layout == "prefix_cache" or decision_session:
+            # 规则和表格只取决于config，整个episode不变
+            self.static_game_rule = (
+                self.game_rule_module.get_game_rule_overview() + "\n" + self.perceive_module.perceive_static()
+            )
+        if decision_session:
+            self.session = DecisionSession(
+                self.static_game_rule,
+                max_turns=session_max_turns,
+                serialization=serialization,
+                measure_full_state=count_state_tokens,
+            )
+        else:
+            self.session = None
         self.state_description = None
         self.action_space = None
+        self.budget_state = None
 
         self.goal = goal
         self.horizon = horizon
@@ -154,36 +248,12 @@ class LLMPlayer:
     def token_usage(self):
         return self.llm_client.get_token_usage()
 
-    def act(self, obs, tick):
-
-        game_mechanics = self.game_rule_module.get_game_rule_overview()
-        # if self.use_information_reduction:
-        #     game_mechanics = self.game_rule_module.get_detail_game_rule(task=self.goal)
-        # else:
-        #     game_mechanics = self.game_rule_module.get_detail_game_rule()
-        state_info = self.state_manager.get_state_info(obs)
-        state_description = self.perceive_module.perceive(state_info, tick, self.horizon)
-
-        self.plan = None
-        if self.use_interaction_memory and tick > 1:
-            recent_event = self.memory_module.get_recent_description(10)
-            if recent_event:
-                state_description = state_description + "\n\n# Interaction Memory\n" + recent_event
-
-        if tick == 1:
-            self.should_get_ml_action = True
-        else:
-            last_record = self.memory_module.get_last_tick_record(tick)
-            self.should_get_ml_action = self.action_module.should_get_ml_action(
-                tick, state_info, self.state_when_act, self.current_action, last_record
-            )
-
-        if self.current_execute_step >= self.max_execute_step:
-            self.should_get_ml_action = True
+    @property
+    def retry_stats(self):
+        return self.llm_client.get_retry_stats()
 
-        self.should_get_use_action = self.action_module.should_get_use_action(state_info)
-        self.should_get_destroy_action = self.action_module.should_get_destroy_action(state_info)
-        self.should_get_give_action = self.allow_give_action and self.action_module.should_get_give_action(state_info)
+    def act(self, obs, tick):
+        game_mechanics, state_info, state_description = self._prepare_act(obs, tick)
 
         # 获取ml action
         if self.should_get_ml_action:
@@ -198,175 +268,242 @@ class LLMPlayer:
                 )
                 if reduced_state_description:
                     state_description = reduced_state_description
+                    # 压缩后的状态描述不再按预算截断
+                    self.budget_state = None
 
-            candidate_action = None
-            feed_back = None
-            verify_time = 0
-            while verify_time <= self.max_verify_time:
-                if candidate_action:
-                    evaluation, feed_back = self.verify_module.verify(
-                        "ml_action",
-                        self.player_role,
-                        tick,
-                        game_mechanics,
-                        state_description,
-                        goal=self.goal,
-                        plan=self.plan,
-                        action_history=self.action_history if self.add_action_history else None,
-                        candidate_action=candidate_action,
-                        verify_time=verify_time,
-                    )
-                    if evaluation == "yes":
-                        break
-                candidate_action = self.action_module.act(
-                    "ml_action",
-                    self.player_role,
-                    tick,
-                    game_mechanics,
-                    state_description,
-                    ml_action_space,
-                    goal=self.goal,
-                    plan=self.plan,
-                    action_history=self.action_history if self.add_action_history else None,
-                    feedback=feed_back,
-                    candidate_action=candidate_action,
-                )
-                verify_time += 1
-            # self.last_action = candidate_action
-            self.ml_action = candidate_action
-            if self.add_action_history:
-                self.action_history.append(candidate_action)
-                if len(self.action_history) > 10:
-                    self.action_history = self.action_history[-10:]  # 写死10条历史记录
-            self.current_execute_step = 0
-            self.state_when_act = state_info
-            self.obs_when_act = obs
+            candidate_action = self._select_action("ml_action", tick, game_mechanics, state_description, ml_action_space)
+            self._update_ml_action(candidate_action, state_info, obs)
         else:
             self.current_execute_step += 1
         # print(f"ML Action at tick {tick}: {self.ml_action}")
         # 获取 use action
         if self.should_get_use_action:
             use_action_space = self.action_module.generate_available_item_use(state_info)
-            candidate_action = None
-            feed_back = None
-            verify_time = 0
-            while verify_time <= self.max_verify_time:
-                if candidate_action:
-                    evaluation, feed_back = self.verify_module.verify(
-                        "use",
-                        self.player_role,
-                        tick,
-                        game_mechanics,
-                        state_description,
-                        goal=self.goal,
-                        plan=self.plan,
-                        action_history=self.action_history if self.add_action_history else None,
-                        candidate_action=candidate_action,
-                        verify_time=verify_time,
-                    )
-                    if evaluation == "yes":
-                        break
-                candidate_action = self.action_module.act(
-                    "use",
-                    self.player_role,
+            use_action = self._select_action("use", tick, game_mechanics, state_description, use_action_space)
+        else:
+            use_action = None
+
+        # 获取 destroy action
+        if self.should_get_destroy_action:
+            destroy_action_space = self.action_module.generate_available_destroy(state_info)
+            destroy_action = self._select_action("destroy", tick, game_mechanics, state_description, destroy_action_space)
+        else:
+            destroy_action = None
+
+        # 获取give action
+        if self.should_get_give_action:
+            give_action_space = self.action_module.generate_available_give(state_info)
+            give_action = self._select_action("give", tick, game_mechanics, state_description, give_action_space)
+        else:
+            give_action = None
+
+        return self._execute_action(obs, tick, use_action, destroy_action, give_action)
+
+    async def act_async(self, obs, tick):
+        """
+        act的异步版本。ml action先决定(use/destroy/give会看到更新后的action_history)，
+        之后use/destroy/give三个相互独立的决策并发请求(session模式下依次请求)
+        """
+        game_mechanics, state_info, state_description = self._prepare_act(obs, tick)
+
+        if self.should_get_ml_action:
+            ml_action_space = self.action_module.generate_available_ml_action(state_info)
+            if self.use_information_reduction:
+                reduced_state_description = await self.reduction_module.reduce_async(
                     tick,
                     game_mechanics,
                     state_description,
-                    use_action_space,
+                    ml_action_space,
                     goal=self.goal,
-                    plan=self.plan,
-                    action_history=self.action_history if self.add_action_history else None,
-                    feedback=feed_back,
-                    candidate_action=candidate_action,
                 )
-                verify_time += 1
+                if reduced_state_description:
+                    state_description = reduced_state_description
+                    # 压缩后的状态描述不再按预算截断
+                    self.budget_state = None
 
-            use_action = candidate_action
+            candidate_action = await self._select_action_async(
+                "ml_action", tick, game_mechanics, state_description, ml_action_space
+            )
+            self._update_ml_action(candidate_action, state_info, obs)
         else:
-            use_action = None
+            self.current_execute_step += 1
 
-        # 获取 destroy action
-        if self.should_get_destroy_action:
-            destroy_action_space = self.action_module.generate_available_destroy(state_info)
-            candidate_action = None
-            feed_back = None
-            verify_time = 0
-            while verify_time <= self.max_verify_time:
-                if candidate_action:
-                    evaluation, feed_back = self.verify_module.verify(
-                        "destroy",
-                        self.player_role,
-                        tick,
-                        game_mechanics,
-                        state_description,
-                        goal=self.goal,
-                        plan=self.plan,
-                        action_history=self.action_history if self.add_action_history else None,
-                        candidate_action=candidate_action,
-                        verify_time=verify_time,
-                    )
-                    if evaluation == "yes":
-                        break
-                candidate_action = self.action_module.act(
-                    "destroy",
+        async def select_item_action(action_type, should_get_action, generate_action_space):
+            if not should_get_action:
+                return None
+            action_space = generate_action_space(state_info)
+            return await self._select_action_async(action_type, tick, game_mechanics, state_description, action_space)
+
+        item_actions = [
+            select_item_action("use", self.should_get_use_action, self.action_module.generate_available_item_use),
+            select_item_action("destroy", self.should_get_destroy_action, self.action_module.generate_available_destroy),
+            select_item_action("give", self.should_get_give_action, self.action_module.generate_available_give),
+        ]
+        if self.session is not None:
+            # 同一个对话中的决策需要依次进行
+            use_action, destroy_action, give_action = [await item_action for item_action in item_actions]
+        else:
+            use_action, destroy_action, give_action = await asyncio.gather(*item_actions)
+
+        return self._execute_action(obs, tick, use_action, destroy_action, give_action)
+
+    def _prepare_act(self, obs, tick):
+        game_mechanics = self.game_rule_module.get_game_rule_overview()
+        # if self.use_information_reduction:
+        #     game_mechanics = self.game_rule_module.get_detail_game_rule(task=self.goal)
+        # else:
+        #     game_mechanics = self.game_rule_module.get_detail_game_rule()
+        state_info = self.state_manager.get_state_info(obs)
+        if self.prompt_layout == "prefix_cache":
+            game_mechanics = self.static_game_rule
+            state_description = self.perceive_module.perceive_dynamic(state_info, tick, self.horizon)
+        else:
+            state_description = self.perceive_module.perceive(state_info, tick, self.horizon)
+
+        self.plan = None
+        recent_entries = []
+        if self.use_interaction_memory and tick > 1:
+            recent_entries = self.memory_module.get_recent_entries(10)
+            if recent_entries:
+                state_description = state_description + MEMORY_HEADER + "".join(recent_entries) + "\n"
+        if self.session is not None:
+            snapshot = self.perceive_module.generate_state_snapshot(state_info, tick)
+            if not self.use_interaction_memory:
+                events = []
+            elif self.session.last_tick is None:
+                events = recent_entries
+            else:
+                events = self.memory_module.get_entries_since(self.session.last_tick)
+            self.session.observe(
+                tick,
+                snapshot,
+                lambda: self.perceive_module.perceive_snapshot(snapshot, tick, self.horizon),
+                events,
+            )
+        if self.use_prompt_budget:
+            # 按token预算截断时由各模块根据自己的预算从state_info重新组装状态描述
+            self.budget_state = BudgetedState(
+                self.perceive_module,
+                state_info,
+                tick,
+                self.horizon,
+                prompt_layout=self.prompt_layout,
+                memory_entries=recent_entries,
+            )
+
+        if tick == 1:
+            self.should_get_ml_action = True
+        else:
+            last_record = self.memory_module.get_last_tick_record(tick)
+            self.should_get_ml_action = self.action_module.should_get_ml_action(
+                tick, state_info, self.state_when_act, self.current_action, last_record
+            )
+
+        if self.current_execute_step >= self.max_execute_step:
+            self.should_get_ml_action = True
+
+        self.should_get_use_action = self.action_module.should_get_use_action(state_info)
+        self.should_get_destroy_action = self.action_module.should_get_destroy_action(state_info)
+        self.should_get_give_action = self.allow_give_action and self.action_module.should_get_give_action(state_info)
+        return game_mechanics, state_info, state_description
+
+    def _select_action(self, action_type, tick, game_mechanics, state_description, action_space):
+        """
+        生成候选动作，并由verify模块检查，不通过时带着反馈重新生成，最多验证max_verify_time次
+        """
+        if self.llm_client.is_shedding():
+            return self.action_module.act_fallback(tick, action_type, action_space)
+        candidate_action = None
+        feed_back = None
+        verify_time = 0
+        while verify_time <= self.max_verify_time:
+            if candidate_action:
+                evaluation, feed_back = self.verify_module.verify(
+                    action_type,
                     self.player_role,
                     tick,
                     game_mechanics,
                     state_description,
-                    destroy_action_space,
                     goal=self.goal,
                     plan=self.plan,
                     action_history=self.action_history if self.add_action_history else None,
-                    feedback=feed_back,
                     candidate_action=candidate_action,
+                    verify_time=verify_time,
+                    budget_state=self.budget_state,
                 )
-                verify_time += 1
-
-            destroy_action = candidate_action
-        else:
-            destroy_action = None
-
-        # 获取give action
-        if self.should_get_give_action:
-            give_action_space = self.action_module.generate_available_give(state_info)
-            candidate_action = None
-            feed_back = None
-            verify_time = 0
-            while verify_time <= self.max_verify_time:
-                if candidate_action:
-                    evaluation, feed_back = self.verify_module.verify(
-                        "give",
-                        self.player_role,
-                        tick,
-                        game_mechanics,
-                        state_description,
-                        goal=self.goal,
-                        plan=self.plan,
-                        action_history=self.action_history if self.add_action_history else None,
-                        candidate_action=candidate_action,
-                        verify_time=verify_time,
-                    )
-                    if evaluation == "yes":
-                        break
-                candidate_action = self.action_module.act(
-                    "give",
+                if evaluation == "yes":
+                    break
+            candidate_action = self.action_module.act(
+                action_type,
+                self.player_role,
+                tick,
+                game_mechanics,
+                state_description,
+                action_space,
+                goal=self.goal,
+                plan=self.plan,
+                action_history=self.action_history if self.add_action_history else None,
+                feedback=feed_back,
+                candidate_action=candidate_action,
+                budget_state=self.budget_state,
+                session=self.session,
+            )
+            verify_time += 1
+        return candidate_action
+
+    async def _select_action_async(self, action_type, tick, game_mechanics, state_description, action_space):
+        if self.llm_client.is_shedding():
+            return self.action_module.act_fallback(tick, action_type, action_space)
+        candidate_action = None
+        feed_back = None
+        verify_time = 0
+        while verify_time <= self.max_verify_time:
+            if candidate_action:
+                evaluation, feed_back = await self.verify_module.verify_async(
+                    action_type,
                     self.player_role,
                     tick,
                     game_mechanics,
                     state_description,
-                    give_action_space,
                     goal=self.goal,
                     plan=self.plan,
                     action_history=self.action_history if self.add_action_history else None,
-                    feedback=feed_back,
                     candidate_action=candidate_action,
+                    verify_time=verify_time,
+                    budget_state=self.budget_state,
                 )
-                verify_time += 1
+                if evaluation == "yes":
+                    break
+            candidate_action = await self.action_module.act_async(
+                action_type,
+                self.player_role,
+                tick,
+                game_mechanics,
+                state_description,
+                action_space,
+                goal=self.goal,
+                plan=self.plan,
+                action_history=self.action_history if self.add_action_history else None,
+                feedback=feed_back,
+                candidate_action=candidate_action,
+                budget_state=self.budget_state,
+                session=self.session,
+            )
+            verify_time += 1
+        return candidate_action
 
-            give_action = candidate_action
-        else:
-            give_action = None
+    def _update_ml_action(self, candidate_action, state_info, obs):
+        # self.last_action = candidate_action
+        self.ml_action = candidate_action
+        if self.add_action_history:
+            self.action_history.append(candidate_action)
+            if len(self.action_history) > 10:
+                self.action_history = self.action_history[-10:]  # 写死10条历史记录
+        self.current_execute_step = 0
+        self.state_when_act = state_info
+        self.obs_when_act = obs
 
+    def _execute_action(self, obs, tick, use_action, destroy_action, give_action):
         # print(self.current_action)
         self.current_action = self.action_module.merge_action(self.ml_action, use_action, destroy_action, give_action)
         save_ml_action(self.file_name_action, tick, self.current_action)
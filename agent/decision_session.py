@@ -0,0 +1,116 @@
+import json
+
+from utils.serialization import serialize
+from utils.state_diff import diff_state
+
+
+class DecisionSession:
+    """
+    一个agent的多轮决策对话。重置后的第一次决策发送完整状态，之后每个tick的第一次决策只发送与上一次发送的状态之间的变化，
+    同一个tick中的后续决策(use/destroy/give、带反馈的重新选择)不再发送状态。
+    assistant消息只保留选择的动作；对话达到max_turns轮后在下一个tick重置，重新发送完整状态
+    """
+
+    def __init__(self, game_mechanics, max_turns=32, serialization="pretty", measure_full_state=False):
+        if max_turns <= 0:
+            raise ValueError("max_turns must be positive")
+        # 放在system message中的规则，整个对话不变
+        self.game_mechanics = game_mechanics
+        self.max_turns = max_turns
+        self.serialization = serialization
+        # 为了统计每次发送状态变化节省的长度，同时生成完整状态描述，只在统计prompt长度时开启
+        self.measure_full_state = measure_full_state
+        self.system_message = None
+        self.history = []
+        self.turns = 0
+        self.last_snapshot = None
+        self.last_tick = None
+        self.pending_update = None
+        self.pending_user_message = None
+
+        self.resets = 0
+        self.total_turns = 0
+        self.state_updates = 0
+        self.full_state_updates = 0
+        self.update_chars = 0
+        self.measured_updates = 0
+        self.full_state_chars = 0
+
+    def reset(self):
+        self.system_message = None
+        self.history = []
+        self.turns = 0
+        self.last_snapshot = None
+        self.last_tick = None
+
+    def observe(self, tick, snapshot, render_full_state, events=None):
+        """
+        记录当前tick的状态，在这个tick的第一次决策时发送。没有决策的tick会被下一个tick覆盖。
+        render_full_state()生成完整的状态描述，只在发送完整状态或measure_full_state开启时调用
+        """
+        self.pending_update = {
+            "tick": tick,
+            "snapshot": snapshot,
+            "render_full_state": render_full_state,
+            "events": events or [],
+        }
+
+    def take_state_update(self):
+        """
+        返回这次决策需要发送的状态: full_state(重置后的完整状态)或changes(状态变化)，同一个tick中已经发送过时返回None
+        """
+        if self.pending_update is None:
+            return None
+        pending_update, self.pending_update = self.pending_update, None
+        if self.turns >= self.max_turns:
+            self.reset()
+            self.resets += 1
+        state_update = {
+            "tick": pending_update["tick"],
+            "since_tick": self.last_tick,
+            "full_state": None,
+            "changes": None,
+            "events": pending_update["events"],
+        }
+        if self.last_snapshot is None:
+            state_update["full_state"] = pending_update["render_full_state"]()
+            self.full_state_updates += 1
+        else:
+            patch = diff_state(self.last_snapshot, pending_update["snapshot"])
+            if patch:
+                state_update["changes"] = serialize(patch, self.serialization)
+            self.update_chars += len(state_update["changes"] or "")
+            self.state_updates += 1
+            if self.measure_full_state:
+                self.full_state_chars += len(pending_update["render_full_state"]())
+                self.measured_updates += 1
+        self.last_snapshot = pending_update["snapshot"]
+        self.last_tick = pending_update["tick"]
+        return state_update
+
+    def build_messages(self, system_prompt, user_prompt):
+        if self.system_message is None:
+            self.system_message = {"role": "system", "content": system_prompt}
+        self.pending_user_message = {"role": "user", "content": user_prompt}
+        return [self.system_message] + self.history + [self.pending_user_message]
+
+    def record_decision(self, action):
+        """
+        把这次决策加入对话。请求失败随机选择的动作也要记录，保证之后的状态变化与对话中的状态一致
+        """
+        self.history.append(self.pending_user_message)
+        self.history.append({"role": "assistant", "content": json.dumps({"choice": action})})
+        self.pending_user_message = None
+        self.turns += 1
+        self.total_turns += 1
+
+    def get_stats(self):
+        return {
+            "turns": self.total_turns,
+            "resets": self.resets,
+            "full_state_updates": self.full_state_updates,
+            "state_updates": self.state_updates,
+            "update_chars": self.update_chars,
+            "measured_updates": self.measured_updates,
+            "full_state_chars": self.full_state_chars,
+        }
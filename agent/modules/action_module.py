@@ -14,13 +14,19 @@ import json
 import copy
 
 from agent.prompt_template import (
+    PROMPT_LAYOUTS,
     generate_action_system_prompt,
     generate_action_user_prompt,
+    generate_session_system_prompt,
+    generate_session_user_prompt,
+    generate_shared_rule_prompt,
 )
 
 from nmmo.lib import utils
+from agent.prompt_budget import create_budget_stats, record_budget_report
 from utils.io_utils import write_to_file
-from constant import AREA_SPACE, DEFAULT_ACTION
+from constant import AREA_SPACE, DEFAULT_ACTION, EQUIPMENT_TYPE
+from bridge.state_manager import check_level
 
 
 action_response_format = {
@@ -30,10 +36,24 @@ action_response_format = {
 
 
 class ActionModule:
-    def __init__(self, config, llm_client, save_path, debug=False):
+    def __init__(
+        self,
+        config,
+        llm_client,
+        save_path,
+        prompt_layout="default",
+        prefix_tracker=None,
+        token_budget=None,
+        debug=False,
+    ):
+        assert prompt_layout in PROMPT_LAYOUTS, f"Invalid prompt layout: {prompt_layout}"
         self.config = config
         self.llm_client = llm_client
         self.save_path = save_path
+        self.prompt_layout = prompt_layout
+        self.prefix_tracker = prefix_tracker
+        self.token_budget = token_budget  # 每个prompt的token预算，配合budget_state截断状态描述，None表示不截断
+        self.budget_stats = create_budget_stats()
         self.debug = debug
 
         self.areas = AREA_SPACE
@@ -58,12 +78,13 @@ class ActionModule:
         action_history=None,
         candidate_action=None,
         feedback=None,
+        budget_state=None,
+        session=None,
     ):
-        assert action_type in ["ml_action", "use", "destroy", "give"], f"Invalid action type: {action_type}"
-
-        input_message = self.generate_input_message(
-            action_type,  # ml_action, use, destroy, give
+        input_message = self._prepare_input_message(
+            action_type,
             player_role,
+            tick,
             game_mechanics,
             state_description,
             action_space,
@@ -72,25 +93,143 @@ class ActionModule:
             action_history=action_history,
             candidate_action=candidate_action,
             feedback=feedback,
+            budget_state=budget_state,
+            session=session,
         )
+        if self.debug:
+            response = self._get_debug_response(action_space)
+        else:
+            response = self.llm_client.generate(input_message, action_response_format, action_space)
+        action = self._parse_action(tick, action_type, action_space, response)
+        if session is not None:
+            session.record_decision(action)
+        return action
 
-        write_to_file(
-            self.save_path,
-            [
-                f"=== tick: {tick} {action_type} action input ===",
-                f"=== system message ===\n{input_message[0]['content']}",
-                f"=== user message ===\n{input_message[1]['content']}",
-            ],
+    async def act_async(
+        self,
+        action_type,  # move, attack, use, destroy, give
+        player_role,
+        tick,
+        game_mechanics,
+        state_description,
+        action_space,
+        goal=None,
+        plan=None,
+        action_history=None,
+        candidate_action=None,
+        feedback=None,
+        budget_state=None,
+        session=None,
+    ):
+        """
+        act的异步版本，llm_client需要是AsyncLLMClient
+        """
+        input_message = self._prepare_input_message(
+            action_type,
+            player_role,
+            tick,
+            game_mechanics,
+            state_description,
+            action_space,
+            goal=goal,
+            plan=plan,
+            action_history=action_history,
+            candidate_action=candidate_action,
+            feedback=feedback,
+            budget_state=budget_state,
+            session=session,
         )
-
         if self.debug:
-            random_choice = random.choice(action_space)
-            response = {
-                "choice": random_choice,
-                "reason": f"Fake reason for choosing {random_choice}.",
-            }
+            response = self._get_debug_response(action_space)
         else:
-            response = self.llm_client.generate(input_message, action_response_format, action_space)
+            response = await self.llm_client.generate(input_message, action_response_format, action_space)
+        action = self._parse_action(tick, action_type, action_space, response)
+        if session is not None:
+            session.record_decision(action)
+        return action
+
+    def _prepare_input_message(
+        self,
+        action_type,
+        player_role,
+        tick,
+        game_mechanics,
+        state_description,
+        action_space,
+        goal=None,
+        plan=None,
+        action_history=None,
+        candidate_action=None,
+        feedback=None,
+        budget_state=None,
+        session=None,
+    ):
+        assert action_type in ["ml_action", "use", "destroy", "give"], f"Invalid action type: {action_type}"
+
+        def build_input_message(state_description):
+            return self.generate_input_message(
+                action_type,  # ml_action, use, destroy, give
+                player_role,
+                game_mechanics,
+                state_description,
+                action_space,
+                goal=goal,
+                plan=plan,
+                action_history=action_history,
+                candidate_action=candidate_action,
+                feedback=feedback,
+            )
+
+        if session is not None:
+            input_message = self.generate_session_input_message(
+                session,
+                action_type,
+                player_role,
+                action_space,
+                goal=goal,
+                candidate_action=candidate_action,
+                feedback=feedback,
+            )
+        elif budget_state is not None and self.token_budget is not None:
+            _, input_message, report = budget_state.fit(build_input_message, self.token_budget)
+            record_budget_report(self.budget_stats, report)
+            write_to_file(
+                self.save_path,
+                [f"=== tick: {tick} {action_type} action prompt budget ===", json.dumps(report)],
+            )
+        else:
+            input_message = build_input_message(state_description)
+        if self.prefix_tracker is not None:
+            self.prefix_tracker.observe("action", input_message)
+
+        if len(input_message) == 2:
+            write_to_file(
+                self.save_path,
+                [
+                    f"=== tick: {tick} {action_type} action input ===",
+                    f"=== system message ===\n{input_message[0]['content']}",
+                    f"=== user message ===\n{input_message[1]['content']}",
+                ],
+            )
+        else:
+            # session中之前的消息已经写入过
+            write_to_file(
+                self.save_path,
+                [
+                    f"=== tick: {tick} {action_type} action input (session turn {len(input_message) // 2}) ===",
+                    f"=== user message ===\n{input_message[-1]['content']}",
+                ],
+            )
+        return input_message
+
+    def _get_debug_response(self, action_space):
+        random_choice = random.choice(action_space)
+        return {
+            "choice": random_choice,
+            "reason": f"Fake reason for choosing {random_choice}.",
+        }
+
+    def _parse_action(self, tick, action_type, action_space, response):
         # print("response in act:", response)
         if response:
             # print("Action Response:", response)
@@ -147,6 +286,9 @@ class ActionModule:
             use_fog=self.config.DEATH_FOG_ONSET,
             feedback=feedback,
         )
+        if self.prompt_layout == "prefix_cache":
+            system_prompt = generate_shared_rule_prompt(game_mechanics) + system_prompt
+            game_mechanics = None
 
         system_message = {
             "role": "system",
@@ -171,9 +313,56 @@ class ActionModule:
 
         return [system_message, user_message]
 
+    def generate_session_input_message(
+        self,
+        session,
+        action_type,
+        player_role,
+        action_space,
+        goal=None,
+        candidate_action=None,
+        feedback=None,
+    ):
+        """
+        session模式: 在agent的对话后追加这次决策，只包含自上次决策以来的状态变化
+        """
+        system_prompt = generate_session_system_prompt(
+            action_response_format,
+            player_role,
+            session.game_mechanics,
+            use_fog=self.config.DEATH_FOG_ONSET,
+        )
+        user_prompt = generate_session_user_prompt(
+            session.take_state_update(),
+            action_type,
+            action_space,
+            goal=goal,
+            candidate_action=candidate_action,
+            feedback=feedback,
+        )
+        return session.build_messages(system_prompt, user_prompt)
+
     def act_randomly(self, action_space):
         return random.choice(action_space)
 
+    def act_fallback(self, tick, action_type, action_space):
+        """
+        LLM后端不健康(熔断)时不请求LLM: ml action随机选择，物品相关的动作选择默认的不操作
+        """
+        default_action = self.default_action.get(action_type.capitalize())
+        if default_action in action_space:
+            action = default_action
+        else:
+            action = self.act_randomly(action_space)
+        write_to_file(
+            self.save_path,
+            [
+                f"=== tick: {tick} {action_type} action output ===",
+                f"LLM backend is unavailable. So fall back to {action}. ",
+            ],
+        )
+        return action
+
     def should_get_ml_action(self, tick, state_info, old_state_info, ml_action, last_record=None):
         # print("last record:", last_record)
         # 与危险entity战斗
@@ -265,101 +454,23 @@ class ActionModule:
         return False
 
     def check_level(self, agent_info, item):
-        melee_level = agent_info["melee_level"]
-        range_level = agent_info["range_level"]
-        mage_level = agent_info["mage_level"]
-        fishing_level = agent_info["fishing_level"]
-        herbalism_level = agent_info["herbalism_level"]
-        prospecting_level = agent_info["prospecting_level"]
-        carving_level = agent_info["carving_level"]
-        alchemy_level = agent_info["alchemy_level"]
-        agent_highest_level = max(
-            melee_level,
-            range_level,
-            mage_level,
-            fishing_level,
-            herbalism_level,
-            prospecting_level,
-            carving_level,
-            alchemy_level,
-        )
-
-        # 检查防具等级
-        if item["type"] == "Armor":
-            return agent_highest_level >= item["level"]
-        # 检查武器和弹药等级
-        elif item["type"] == "Weapon" or item["type"] == "Ammunition":
-            if item["name"] == "Spear" or item["name"] == "Whetstone":
-                return melee_level >= item["level"]
-            elif item["name"] == "Bow" or item["name"] == "Arrow":
-                return range_level >= item["level"]
-            elif item["name"] == "Wand" or item["name"] == "Runes":
-                return mage_level >= item["level"]
-            else:
-                raise ValueError(f"Unknown Weapon or Ammunition: {item['name']}")
-        # 检查工具等级
-        elif item["type"] == "Tool":
-            if item["name"] == "Rod":
-                return fishing_level >= item["level"]
-            elif item["name"] == "Gloves":
-                return herbalism_level >= item["level"]
-            elif item["name"] == "Axe":
-                return carving_level >= item["level"]
-            elif item["name"] == "Chisel":
-                return alchemy_level >= item["level"]
-            elif item["name"] == "Pickaxe":
-                return prospecting_level >= item["level"]
-            else:
-                raise ValueError(f"Unknown tool: {item['name']}")
-        # 检查消耗品等级
-        elif item["type"] == "Consumable":
-            return agent_highest_level >= item["level"]
-        else:
-            return False
+        return check_level(agent_info, item)
 
     def should_get_use_action(self, state_info):
         if not self.config.ITEM_SYSTEM_ENABLED:
             return False
         if state_info["agent"]["agent_in_combat"]:
             return False
+        inventory = state_info["inventory"]
         # 背包有消耗品（若生命值不满）、未穿戴的武器、工具、防具、弹药
         if state_info["agent"]["health"] != 100 or state_info["agent"]["food"] != 100 or state_info["agent"]["water"] != 100:
-            consumable_item_name = [
-                consumable["name"]
-                for consumable in state_info["consumable"]
-                if self.check_level(state_info["agent"], consumable)
-            ]
             if state_info["agent"]["food"] != 100 or state_info["agent"]["water"] != 100:
-                if "Ration" in consumable_item_name:
+                if "Ration" in inventory.usable_consumable_names:
                     return True
             if state_info["agent"]["health"] != 100:
-                if "Potion" in consumable_item_name:
+                if "Potion" in inventory.usable_consumable_names:
                     return True
-        unequipped_weapon = [
-            weapon
-            for weapon in state_info["weapon"]
-            if (not weapon["is_equipped"] and self.check_level(state_info["agent"], weapon))
-        ]
-        if len(unequipped_weapon) > 0:
-            return True
-        unequipped_tool = [
-            tool for tool in state_info["tool"] if (not tool["is_equipped"] and self.check_level(state_info["agent"], tool))
-        ]
-        if len(unequipped_tool) > 0:
-            return True
-        unequipped_armor = [
-            armor
-            for armor in state_info["armor"]
-            if (not armor["is_equipped"] and self.check_level(state_info["agent"], armor))
-        ]
-        if len(unequipped_armor) > 0:
-            return True
-        unequipped_ammunition = [
-            ammunition
-            for ammunition in state_info["ammunition"]
-            if (not ammunition["is_equipped"] and self.check_level(state_info["agent"], ammunition))
-        ]
-        if len(unequipped_ammunition) > 0:
+        if inventory.equippable:
             return True
         return False
 
@@ -395,31 +506,7 @@ class ActionModule:
         if not has_other_player:
             return False
 
-        unequipped_weapon = [
-            weapon
-            for weapon in state_info["weapon"]
-            if (not weapon["is_equipped"] and self.check_level(state_info["agent"], weapon))
-        ]
-        if len(unequipped_weapon) > 0:
-            return True
-        unequipped_tool = [
-            tool for tool in state_info["tool"] if (not tool["is_equipped"] and self.check_level(state_info["agent"], tool))
-        ]
-        if len(unequipped_tool) > 0:
-            return True
-        unequipped_armor = [
-            armor
-            for armor in state_info["armor"]
-            if (not armor["is_equipped"] and self.check_level(state_info["agent"], armor))
-        ]
-        if len(unequipped_armor) > 0:
-            return True
-        unequipped_ammunition = [
-            ammunition
-            for ammunition in state_info["ammunition"]
-            if (not ammunition["is_equipped"] and self.check_level(state_info["agent"], ammunition))
-        ]
-        if len(unequipped_ammunition) > 0:
+        if state_info["inventory"].equippable:
             return True
         return False
 
@@ -488,66 +575,31 @@ class ActionModule:
         return available_attack
 
     def generate_available_item_use(self, state_info):
-        ego_agent_info = state_info["agent"]
-        item_info = (
-            state_info["armor"]
-            + state_info["weapon"]
-            + state_info["tool"]
-            + state_info["ammunition"]
-            + state_info["consumable"]
-        )
-
         available_item_use = [self.default_action["Use"]]
-        for item in item_info:
-            if item["type"] in ["Armor", "Weapon", "Tool", "Ammunition"]:
+        for item in state_info["inventory"].items:
+            if item["type"] in EQUIPMENT_TYPE:
                 if not item["is_equipped"]:
-                    if self.check_level(ego_agent_info, item):
+                    if item["usable"]:
                         available_item_use.append(f"Equip level {item['level']} {item['name']} with id {item['id']}")
                 elif item["is_equipped"]:
                     available_item_use.append(f"Unequip level {item['level']} {item['name']} with id {item['id']}")
-            elif item["type"] == "Consumable":
-                if self.check_level(ego_agent_info, item):
-                    available_item_use.append(f"Use level {item['level']} {item['name']} with id {item['id']}")
-            else:
-                raise ValueError(f"Unknown item type: {item['type']}")
+            elif item["usable"]:
+                available_item_use.append(f"Use level {item['level']} {item['name']} with id {item['id']}")
         available_item_use = sorted(available_item_use)
         return available_item_use
 
     def generate_available_destroy(self, state_info):
-        item_info = (
-            state_info["armor"]
-            + state_info["weapon"]
-            + state_info["tool"]
-            + state_info["ammunition"]
-            + state_info["consumable"]
-        )
-
         available_item_destroy = [self.default_action["Destroy"]]
-        for item in item_info:
-            if item["type"] in ["Armor", "Weapon", "Tool", "Ammunition"]:
-                if not item["is_equipped"]:
-                    available_item_destroy.append(f"Destroy level {item['level']} {item['name']} with id {item['id']}")
-            elif item["type"] == "Consumable":
-                available_item_destroy.append(f"Destroy level {item['level']} {item['name']} with id {item['id']}")
-            else:
-                raise ValueError(f"Unknown item type: {item['type']}")
+        for item in state_info["inventory"].unequipped:
+            available_item_destroy.append(f"Destroy level {item['level']} {item['name']} with id {item['id']}")
         available_item_destroy = sorted(available_item_destroy)
         return available_item_destroy
 
     def generate_available_give(self, state_info):
         ego_agent_info = state_info["agent"]
         entity_info = state_info["entity"]
-        item_info = (
-            state_info["armor"]
-            + state_info["weapon"]
-            + state_info["tool"]
-            + state_info["ammunition"]
-            + state_info["consumable"]
-        )
         available_item_give = [self.default_action["Give"]]
-        for item in item_info:
-            if item["type"] in ["Armor", "Weapon", "Tool", "Ammunition"] and item["is_equipped"]:
-                continue
+        for item in state_info["inventory"].unequipped:
             for entities in entity_info.values():
                 for entity in entities:
                     if entity["id"] != ego_agent_info["id"] and entity["id"] > 0:
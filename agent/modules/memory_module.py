@@ -44,19 +44,32 @@ class MemoryModule:
         return None
 
     def get_recent_description(self, limit=10):
-        if not self._history:
+        recent_entries = self.get_recent_entries(limit)
+        if not recent_entries:
             return None
+        return "".join(recent_entries) + "\n"
+
+    def get_recent_entries(self, limit=10):
+        """
+        最近limit条交互事件的描述，按时间顺序
+        """
         if limit is None or limit >= len(self._history):
             entries = list(self._history)
         else:
             entries = self._history[-limit:]
-        recent_memory = ""
-        for entry in entries:
-            recent_memory += f"Interaction event at tick {entry['tick']}: \n"
-            # recent_memory += f"My food: {entry['food']}, water: {entry['water']}, health: {entry['health']}\n"
-            # recent_memory += f"My action at that time: {entry['executing_action']}\n"
-            recent_memory += f"{entry['description']}"
-        recent_memory += "\n"
+        return [self.format_entry(entry) for entry in entries]
+
+    def get_entries_since(self, tick):
+        """
+        tick之后(不含)的交互事件描述，按时间顺序
+        """
+        return [self.format_entry(entry) for entry in self._history if entry["tick"] > tick]
+
+    def format_entry(self, entry):
+        recent_memory = f"Interaction event at tick {entry['tick']}: \n"
+        # recent_memory += f"My food: {entry['food']}, water: {entry['water']}, health: {entry['health']}\n"
+        # recent_memory += f"My action at that time: {entry['executing_action']}\n"
+        recent_memory += f"{entry['description']}"
         return recent_memory
 
     def generate_individual_event_description(self, record):
@@ -3,6 +3,8 @@ import os
 import re
 import json
 import random
+import threading
+import types
 
 current_dir = os.path.abspath(__file__)
 sys.path.append(current_dir)
@@ -14,16 +16,215 @@ sys.path.append(grandparent_dir)
 from nmmo.lib import utils
 from constant import AREA_SPACE
 from game_rule import RESOURCE_TABLE, NPC_TABLE, COMBAT_TABLE, ITEM_TABLE, SKILL_TABLE
+from utils.io_utils import write_to_file
+from utils.serialization import SERIALIZATION_PROFILES, build_abbreviation_legend, serialize
+from utils.token_counter import count_tokens
+
+HEALTH_HEADER = "Here is my character's current health status:\n"
+POSITION_HEADER = "Here is my character's current position information:\n"
+OBSERVATION_HEADER = "Here is information about the resources, entities, fog, and passability of the nine areas in my charater's observation: \n"
+INVENTORY_HEADER = "Here is my character's current inventory information:\n"
+SKILL_HEADER = "Here is my character's current skill levels:\n"
+
+
+def build_survive_rule(config):
+    return "In this game, each player has Health, Food, and Water, each with a maximum value of 100. Food/Water drop 10 each tick. If Water or Food is 0, the player loses 10 Health per tick; if both are 0, Health loses 20 per tick. Health regenerates 10 per tick if food and water are above 50. "
+
+
+def build_position_rule(config):
+    position_rule = f"The tile is the basic unit that makes up the map. The game map has a total size of {config.MAP_CENTER} × {config.MAP_CENTER} tiles. Each tile corresponds to a coordinate. My character can move only one tile per tick. The entire game map is roughly divided into nine regions: the central region, eastern region, western region, northern region, southern region, northeastern region, southeastern region, northwestern region, and southwestern region. Players are informed of the coordinate and region they are in to clarify their macro-level position on the map. "
+
+    if config.DEATH_FOG_ONSET:
+        position_rule += f"Additionally, there is a death fog mechanism in the game. The fog area appears at time {config.DEATH_FOG_ONSET} and gradually expands from the edges of the map toward the center. The fog can damage player within it. A permanent safety area exists at the center of the map, which is never covered by the fog. The position information includes the distance to the safety zone. "
+    return position_rule
+
+
+def build_resource_rule(config):
+    resource_rule = "There are various types of resources on the map. Players can obtain corresponding items and improve related skills by harvesting resources. Equipping related tools can improve the quality of harvested items. The harvested item level is the related tool's level + 1. Here is the information about different resources and their corresponding output items, skills, and tools.\n"
+    return resource_rule + json.dumps(RESOURCE_TABLE, indent=4)
+
+
+def build_entity_rule(config):
+    entity_rule = "Entities on the map include NPCs and other players. NPCs are divided into passive, neutral, and aggressive types. Here is the information about different NPC types:\n"
+    return entity_rule + json.dumps(NPC_TABLE, indent=4)
+
+
+def build_combat_rule(config):
+    commbat_rule = "Combat may occur between entities. The outcome of combat depends on the entities' attack and defense values. The game has three combat styles: Melee, Range, and Mage. Players can use any combat style, while NPCs can only use one combat style. Equipping specific weapons and ammunition, improving combat skills, and using a combat style that counters the enemy will all increase the attack value of the corresponding style. The weapons, ammunition, skills, and countered combat styles for each combat style are as follows:\n"
+    return commbat_rule + json.dumps(COMBAT_TABLE, indent=4)
+
+
+def build_observation_rule(config):
+    view_size = 15
+    return f"In this game, each player can view {view_size} × {view_size} tiles centered on itself. They are divided into nine areas: center, east, west, north, south, northeast, southeast, northwest, and southwest. Each player automatically harvests the resources at their current location. Additionally, each player can directly move to harvest resources or attack other entities in the center area. Moving to another area makes that area the new center area. Some areas are difficult to traverse because they contain many impassable tiles (such as rock tiles), or their many contained tiles are unreachable from the character's current position (for example, blocked by water or stone tiles). The visited tile count refers to the number of tiles in this area that the player has visited. "
+
+
+def build_item_rule(config):
+    item_rule = "Items are very helpful for player survival and combat. Based on their functions, acquisition methods, and skill requirements, items are divided into weapons, ammunition, armor, tools, and consumables. Armor and tools can only be obtained by killing other NPCs or players as drops. Weapons, ammunition, armor, and tools must be equipped to take effect. High-level items require the corresponding skills to reach the same level in order to be used. The names, functions, acquisition methods, and corresponding skill of all items are listed below:\n"
+    return item_rule + json.dumps(ITEM_TABLE, indent=4)
+
+
+def build_skill_rule(config):
+    skill_rule = "Higher skill levels allow players to obtain better yields when harvesting resources, use higher-level equipment, and deal greater damage. The maximum level of items that a player can harvest or use is equal to the relevant skill level plus one. Below are the resources affected by each skill, the items they enable, and the ways in which the skills are leveled up:\n"
+    return skill_rule + json.dumps(SKILL_TABLE, indent=4)
+
+
+class Slot:
+    """
+    prompt模板中的动态部分，渲染时按名字取值
+    """
+
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+
+class PromptTemplate:
+    """
+    编译后的prompt模板: 相邻的静态文本预先拼接成一段，渲染时只需要把静态段和动态值交替join，
+    开销只与动态部分的长度有关
+    """
+
+    __slots__ = ("statics", "slots")
+
+    def __init__(self, parts):
+        statics = [""]
+        slots = []
+        for part in parts:
+            if isinstance(part, Slot):
+                slots.append(part.name)
+                statics.append("")
+            else:
+                statics[-1] += part
+        self.statics = tuple(statics)
+        self.slots = tuple(slots)
+
+    def render(self, values):
+        parts = [self.statics[0]]
+        for slot, static in zip(self.slots, self.statics[1:]):
+            parts.append(values[slot])
+            parts.append(static)
+        return "".join(parts)
+
+
+class StaticPromptSegments:
+    """
+    只取决于config和序列化profile的规则、表格和prompt模板，编译一次，所有player共享，创建后不再修改
+    """
+
+    __slots__ = ("rules", "static_rules", "templates")
+
+    def __init__(self, config, serialization="pretty"):
+        rules = {
+            "survive": build_survive_rule(config),
+            "position": build_position_rule(config),
+            "resource": build_resource_rule(config),
+        }
+        if config.NPC_SYSTEM_ENABLED:
+            rules["entity"] = build_entity_rule(config)
+        if config.COMBAT_SYSTEM_ENABLED:
+            rules["combat"] = build_combat_rule(config)
+        rules["observation"] = build_observation_rule(config)
+        if config.ITEM_SYSTEM_ENABLED:
+            rules["item"] = build_item_rule(config)
+        if config.PROGRESSION_SYSTEM_ENABLED:
+            rules["skill"] = build_skill_rule(config)
+        if serialization == "tabular":
+            rules["abbreviation"] = build_abbreviation_legend()
+        object.__setattr__(self, "rules", types.MappingProxyType(rules))
+        # prefix_cache布局放在最前面的规则
+        object.__setattr__(self, "static_rules", "\n".join(rules.values()))
+        object.__setattr__(
+            self,
+            "templates",
+            types.MappingProxyType({
+                "default": PromptTemplate(self._default_layout(config, rules)),
+                "prefix_cache": PromptTemplate(self._dynamic_layout(config)),
+            }),
+        )
+
+    def __setattr__(self, name, value):
+        raise AttributeError("StaticPromptSegments is read-only")
+
+    @staticmethod
+    def _default_layout(config, rules):
+        layout = [rules["abbreviation"], "\n"] if "abbreviation" in rules else []
+        layout += [Slot("tick"), "\n", rules["survive"], HEALTH_HEADER, Slot("survive"), "\n"]
+        layout += [rules["position"], POSITION_HEADER, Slot("position"), "\n"]
+        layout += [rules["resource"], "\n"]
+        if config.NPC_SYSTEM_ENABLED:
+            layout += [rules["entity"], "\n"]
+        if config.COMBAT_SYSTEM_ENABLED:
+            layout += [rules["combat"], "\n"]
+        layout += [rules["observation"], OBSERVATION_HEADER, Slot("observation"), "\n"]
+        if config.ITEM_SYSTEM_ENABLED:
+            layout += [rules["item"], "\n", INVENTORY_HEADER, Slot("item"), "\n"]
+        if config.PROGRESSION_SYSTEM_ENABLED:
+            layout += [rules["skill"], "\n", SKILL_HEADER, Slot("skill"), "\n"]
+        return layout
+
+    @staticmethod
+    def _dynamic_layout(config):
+        layout = [Slot("tick"), "\n", HEALTH_HEADER, Slot("survive"), "\n"]
+        layout += [POSITION_HEADER, Slot("position"), "\n", OBSERVATION_HEADER, Slot("observation"), "\n"]
+        if config.ITEM_SYSTEM_ENABLED:
+            layout += [INVENTORY_HEADER, Slot("item"), "\n"]
+        if config.PROGRESSION_SYSTEM_ENABLED:
+            layout += [SKILL_HEADER, Slot("skill"), "\n"]
+        return layout
+
+
+_static_segments_lock = threading.Lock()
+_static_segments = {}
+
+
+def get_static_segments(config, serialization="pretty"):
+    """
+    返回按config中影响prompt的字段和序列化profile共享的StaticPromptSegments
+    """
+    key = (
+        serialization,
+        config.MAP_CENTER,
+        config.DEATH_FOG_ONSET,
+        config.NPC_SYSTEM_ENABLED,
+        config.COMBAT_SYSTEM_ENABLED,
+        config.ITEM_SYSTEM_ENABLED,
+        config.PROGRESSION_SYSTEM_ENABLED,
+    )
+    with _static_segments_lock:
+        segments = _static_segments.get(key)
+        if segments is None:
+            segments = StaticPromptSegments(config, serialization)
+            _static_segments[key] = segments
+    return segments
 
 
 class PerceptionModule:
-    def __init__(self, config, llm_client, save_path, add_tick_info=True, only_use_resource_tile=False, debug=False):
+    def __init__(
+        self,
+        config,
+        llm_client,
+        save_path,
+        add_tick_info=True,
+        only_use_resource_tile=False,
+        serialization="pretty",  # 状态描述的序列化profile: pretty/compact/tabular
+        count_state_tokens=False,  # 是否统计并记录每个prompt各部分的token数
+        debug=False,
+    ):
+        assert serialization in SERIALIZATION_PROFILES, f"Invalid serialization profile: {serialization}"
         self.config = config
         self.llm_client = llm_client
         self.save_path = save_path
         self.add_tick_info = add_tick_info
         self.only_use_resource_tile = only_use_resource_tile
         self.debug = debug
+        self.serialization = serialization
+        self.segments = get_static_segments(config, serialization)
+        self.count_state_tokens = count_state_tokens
+        self.static_tokens = {}
+        self.section_token_totals = {}
+        self.section_token_prompts = 0
         self.attack_range = {
             "melee": self.config.COMBAT_MELEE_REACH,
             "range": self.config.COMBAT_RANGE_REACH,
@@ -42,83 +243,103 @@ class PerceptionModule:
         }
 
     def perceive(self, state_info, tick, horizon):
-        description = ""
-        state_description = {}
+        values = self.generate_dynamic_values(state_info, tick, horizon)
+        self.record_section_tokens(tick, "default", values)
+        return self.segments.templates["default"].render(values)
 
-        if self.add_tick_info:
-            state_description["tick"] = f"{tick}/{horizon}"
-        description += json.dumps(state_description) + "\n"
-        # 添加健康信息
-        meta_description = (
-            "In this game, each player has Health, Food, and Water, each with a maximum value of 100. Food/Water drop 10 each tick. If Water or Food is 0, the player loses 10 Health per tick; if both are 0, Health loses 20 per tick. Health regenerates 10 per tick if food and water are above 50. Here is my character's current health status:\n"
-            + self.generate_survive_description(state_info["agent"])
-        )
-        description += meta_description + "\n"
+    def perceive_static(self):
+        """
+        prefix_cache布局中放在prompt最前面的规则和表格，只取决于config，同一个episode中所有agent完全相同
+        """
+        return self.segments.static_rules
 
-        # 添加宏观位置信息
-        position_description = f"The tile is the basic unit that makes up the map. The game map has a total size of {self.config.MAP_CENTER} × {self.config.MAP_CENTER} tiles. Each tile corresponds to a coordinate. My character can move only one tile per tick. The entire game map is roughly divided into nine regions: the central region, eastern region, western region, northern region, southern region, northeastern region, southeastern region, northwestern region, and southwestern region. Players are informed of the coordinate and region they are in to clarify their macro-level position on the map. "
+    def perceive_dynamic(self, state_info, tick, horizon):
+        """
+        prefix_cache布局中放在prompt最后的当前状态，规则说明由perceive_static提供
+        """
+        values = self.generate_dynamic_values(state_info, tick, horizon)
+        self.record_section_tokens(tick, "prefix_cache", values)
+        return self.segments.templates["prefix_cache"].render(values)
 
-        if self.config.DEATH_FOG_ONSET:
-            position_description += f"Additionally, there is a death fog mechanism in the game. The fog area appears at time {self.config.DEATH_FOG_ONSET} and gradually expands from the edges of the map toward the center. The fog can damage player within it. A permanent safety area exists at the center of the map, which is never covered by the fog. The position information includes the distance to the safety zone. "
-        position_description += "Here is my character's current position information:\n"
+    def perceive_partial(self, state_info, tick, horizon, layout="default", kept_entities=None, kept_resources=None):
+        """
+        只保留kept_entities中的实体和kept_resources中的资源，用于按token预算组装prompt，不统计各部分token数
+        """
+        values = self.generate_dynamic_values(state_info, tick, horizon, kept_entities, kept_resources)
+        return self.segments.templates[layout].render(values)
 
-        position_description += self.generate_position_description(state_info["agent"])
-        description += position_description + "\n"
+    def perceive_snapshot(self, snapshot, tick, horizon, layout="prefix_cache"):
+        """
+        用generate_state_snapshot的结果渲染状态描述，不统计各部分token数
+        """
+        return self.segments.templates[layout].render(self.serialize_snapshot(snapshot, tick, horizon))
 
-        # 添加资源、实体、战斗等观测信息
-        resource_description = "There are various types of resources on the map. Players can obtain corresponding items and improve related skills by harvesting resources. Equipping related tools can improve the quality of harvested items. The harvested item level is the related tool's level + 1. Here is the information about different resources and their corresponding output items, skills, and tools.\n"
-        resource_description += json.dumps(RESOURCE_TABLE, indent=4)
-        description += resource_description + "\n"
-
-        if self.config.NPC_SYSTEM_ENABLED:
-            entity_description = "Entities on the map include NPCs and other players. NPCs are divided into passive, neutral, and aggressive types. Here is the information about different NPC types:\n"
-            entity_description += json.dumps(NPC_TABLE, indent=4)
-            description += entity_description + "\n"
-
-        if self.config.COMBAT_SYSTEM_ENABLED:
-            commbat_description = "Combat may occur between entities. The outcome of combat depends on the entities' attack and defense values. The game has three combat styles: Melee, Range, and Mage. Players can use any combat style, while NPCs can only use one combat style. Equipping specific weapons and ammunition, improving combat skills, and using a combat style that counters the enemy will all increase the attack value of the corresponding style. The weapons, ammunition, skills, and countered combat styles for each combat style are as follows:\n"
-
-            commbat_description += json.dumps(COMBAT_TABLE, indent=4)
+    def record_section_tokens(self, tick, layout, values):
+        """
+        统计静态规则和各个动态部分的token数，写入prompt文件并累计，用于比较不同序列化profile
+        """
+        if not self.count_state_tokens:
+            return
+        if layout not in self.static_tokens:
+            static_text = self.segments.static_rules if layout == "prefix_cache" else "".join(self.segments.templates[layout].statics)
+            self.static_tokens[layout] = count_tokens(static_text)
+        section_tokens = {"static": self.static_tokens[layout]}
+        for section, text in values.items():
+            section_tokens[section] = count_tokens(text)
+        for section, tokens in section_tokens.items():
+            self.section_token_totals[section] = self.section_token_totals.get(section, 0) + tokens
+        self.section_token_prompts += 1
+        write_to_file(
+            self.save_path,
+            [f"=== tick: {tick} state section tokens ({self.serialization}) ===", json.dumps(section_tokens)],
+        )
 
-            description += commbat_description + "\n"
-        view_size = 15
-        description += f"In this game, each player can view {view_size} × {view_size} tiles centered on itself. They are divided into nine areas: center, east, west, north, south, northeast, southeast, northwest, and southwest. Each player automatically harvests the resources at their current location. Additionally, each player can directly move to harvest resources or attack other entities in the center area. Moving to another area makes that area the new center area. Some areas are difficult to traverse because they contain many impassable tiles (such as rock tiles), or their many contained tiles are unreachable from the character's current position (for example, blocked by water or stone tiles). The visited tile count refers to the number of tiles in this area that the player has visited. Here is information about the resources, entities, fog, and passability of the nine areas in my charater's observation: \n"
+    def generate_dynamic_values(self, state_info, tick, horizon, kept_entities=None, kept_resources=None):
+        """
+        生成prompt模板中各个动态部分的文本
+        """
+        snapshot = self.generate_state_snapshot(state_info, tick, kept_entities, kept_resources)
+        return self.serialize_snapshot(snapshot, tick, horizon)
 
-        description += (
-            self.generate_observation_description(
+    def generate_state_snapshot(self, state_info, tick, kept_entities=None, kept_resources=None):
+        """
+        各个动态部分序列化之前的描述(dict)，session模式下用来计算两次决策之间的状态变化
+        """
+        snapshot = {
+            "survive": self.generate_survive_description(state_info["agent"]),
+            "position": self.generate_position_description(state_info["agent"]),
+            "observation": self.generate_observation_description(
                 tick,
                 state_info["agent"],
                 state_info["resource"],
                 state_info["entity"],
                 state_info["passible"],
                 state_info["fog"],
-            )
-            + "\n"
-        )
+                kept_entities=kept_entities,
+                kept_resources=kept_resources,
+            ),
+        }
         if self.config.ITEM_SYSTEM_ENABLED:
-
-            item_description = "Items are very helpful for player survival and combat. Based on their functions, acquisition methods, and skill requirements, items are divided into weapons, ammunition, armor, tools, and consumables. Armor and tools can only be obtained by killing other NPCs or players as drops. Weapons, ammunition, armor, and tools must be equipped to take effect. High-level items require the corresponding skills to reach the same level in order to be used. The names, functions, acquisition methods, and corresponding skill of all items are listed below:\n"
-
-            item_description += json.dumps(ITEM_TABLE, indent=4)
-            description += item_description + "\n" + "Here is my character's current inventory information:\n"
-            description += (
-                self.generate_item_description(
-                    state_info["capacity"],
-                    state_info["armor"],
-                    state_info["weapon"],
-                    state_info["tool"],
-                    state_info["ammunition"],
-                    state_info["consumable"],
-                )
-                + "\n"
+            snapshot["item"] = self.generate_item_description(
+                state_info["capacity"],
+                state_info["armor"],
+                state_info["weapon"],
+                state_info["tool"],
+                state_info["ammunition"],
+                state_info["consumable"],
             )
-
         if self.config.PROGRESSION_SYSTEM_ENABLED:
-            skill_description = "Higher skill levels allow players to obtain better yields when harvesting resources, use higher-level equipment, and deal greater damage. The maximum level of items that a player can harvest or use is equal to the relevant skill level plus one. Below are the resources affected by each skill, the items they enable, and the ways in which the skills are leveled up:\n"
-            skill_description += json.dumps(SKILL_TABLE, indent=4)
-            description += skill_description + "\nHere is my character's current skill levels:\n"
-            description += self.generate_skill_description(state_info["agent"]) + "\n"
-        return description
+            snapshot["skill"] = self.generate_skill_description(state_info["agent"])
+        return snapshot
+
+    def serialize_snapshot(self, snapshot, tick, horizon):
+        state_description = {}
+        if self.add_tick_info:
+            state_description["tick"] = f"{tick}/{horizon}"
+        values = {"tick": json.dumps(state_description)}
+        for section, description in snapshot.items():
+            values[section] = serialize(description, self.serialization)
+        return values
 
     def generate_survive_description(self, ego_agent_info):
 
@@ -132,7 +353,7 @@ class PerceptionModule:
         if ego_agent_info["agent_in_combat"]:
             description["attacked_by"] = ego_agent_info["attacker"]
             description["attack_target"] = ego_agent_info["target_of_attack"]
-        return json.dumps(description, indent=4)
+        return description
 
     def generate_position_description(self, ego_agent_info):
         description = {}
@@ -144,10 +365,22 @@ class PerceptionModule:
             else:
                 description["in_safety_zone"] = False
                 description["dist_to_safety_zone"] = ego_agent_info["dist_to_safety_zone"]
-        return json.dumps(description, indent=4)
-
-    def generate_observation_description(self, tick, ego_agent_info, resource_info, entity_info, passible_info, fog_info):
+        return description
 
+    def generate_observation_description(
+        self,
+        tick,
+        ego_agent_info,
+        resource_info,
+        entity_info,
+        passible_info,
+        fog_info,
+        kept_entities=None,
+        kept_resources=None,
+    ):
+        """
+        kept_entities/kept_resources不为None时只保留其中的实体id和(area, 资源名)，用于按token预算截断
+        """
         description = {area: {} for area in self.areas}
         description["resource_at_current_location"] = ego_agent_info["occupied_resource"]
         ego_player_name = ego_agent_info["name"]
@@ -158,37 +391,22 @@ class PerceptionModule:
                 for resource_name, this_resource_info in resource_info[area].items():
                     if self.only_use_resource_tile and not this_resource_info["is_resource"]:
                         continue
-                    single_resource_info = {
-                        "name": resource_name,
-                        "count": int(this_resource_info["count"]),
-                        "is_resource": bool(this_resource_info["is_resource"]),
-                        "passible": bool(this_resource_info["passible"]),
-                    }
-                    if "original_resource" in this_resource_info:
-                        single_resource_info["original_resource"] = this_resource_info["original_resource"]
-                    description[area]["resources"].append(single_resource_info)
+                    if kept_resources is not None and (area, resource_name) not in kept_resources:
+                        continue
+                    description[area]["resources"].append(self.generate_resource_entry(resource_name, this_resource_info))
                 description[area]["resources"] = sorted(description[area]["resources"], key=lambda x: x["count"], reverse=True)
+                if kept_resources is not None and not description[area]["resources"]:
+                    del description[area]["resources"]
 
             # 补充实体信息
             if self.config.NPC_SYSTEM_ENABLED and entity_info[area]:
                 description[area]["entities"] = []
                 for entity in entity_info[area]:
-                    single_entity_info = {
-                        "name": entity["name"],
-                        "type": entity["type"],
-                        "combat_style": entity["style"],
-                        "health": int(entity["health"]),
-                        "level": int(entity["level"]),
-                        "in_combat": bool(entity["in_combat"]),
-                    }
-                    if entity["in_combat"]:
-                        single_entity_info["attacked_by"] = (
-                            entity["attacker"] if entity["attacker"] != ego_player_name else "me"
-                        )
-                        single_entity_info["attack_target"] = (
-                            entity["target_of_attack"] if entity["target_of_attack"] != ego_player_name else "me"
-                        )
-                    description[area]["entities"].append(single_entity_info)
+                    if kept_entities is not None and entity["id"] not in kept_entities:
+                        continue
+                    description[area]["entities"].append(self.generate_entity_entry(entity, ego_player_name))
+                if kept_entities is not None and not description[area]["entities"]:
+                    del description[area]["entities"]
 
             # 补充迷雾信息
             if self.config.DEATH_FOG_ONSET:
@@ -202,7 +420,77 @@ class PerceptionModule:
             description[area]["visited_tile_count"] = passible_info[area]["visited_tile_count"]
             description[area]["passible_tile_count"] = passible_info[area]["passible_tile_count"]
             description[area]["reachable_tile_count"] = passible_info[area]["reachable_tile_count"]
-        return json.dumps(description, indent=4)
+        return description
+
+    def generate_resource_entry(self, resource_name, this_resource_info):
+        single_resource_info = {
+            "name": resource_name,
+            "count": int(this_resource_info["count"]),
+            "is_resource": bool(this_resource_info["is_resource"]),
+            "passible": bool(this_resource_info["passible"]),
+        }
+        if "original_resource" in this_resource_info:
+            single_resource_info["original_resource"] = this_resource_info["original_resource"]
+        return single_resource_info
+
+    def generate_entity_entry(self, entity, ego_player_name):
+        single_entity_info = {
+            "name": entity["name"],
+            "type": entity["type"],
+            "combat_style": entity["style"],
+            "health": int(entity["health"]),
+            "level": int(entity["level"]),
+            "in_combat": bool(entity["in_combat"]),
+        }
+        if entity["in_combat"]:
+            single_entity_info["attacked_by"] = entity["attacker"] if entity["attacker"] != ego_player_name else "me"
+            single_entity_info["attack_target"] = (
+                entity["target_of_attack"] if entity["target_of_attack"] != ego_player_name else "me"
+            )
+        return single_entity_info
+
+    def list_budget_entities(self, state_info):
+        """
+        按token预算截断时实体的保留顺序: 由近到远，距离相同时按区域和观测顺序。返回[(实体id, 名字, token数)]
+        """
+        if not self.config.NPC_SYSTEM_ENABLED:
+            return []
+        ego_player_name = state_info["agent"]["name"]
+        entities = [
+            (entity["distance"], area_index, entity_index, entity)
+            for area_index, area in enumerate(self.areas)
+            for entity_index, entity in enumerate(state_info["entity"][area])
+        ]
+        entities.sort(key=lambda x: x[:3])
+        return [
+            (
+                entity["id"],
+                entity["name"],
+                count_tokens(serialize(self.generate_entity_entry(entity, ego_player_name), self.serialization)),
+            )
+            for _, _, _, entity in entities
+        ]
+
+    def list_budget_resources(self, state_info):
+        """
+        资源的保留顺序: 中心区域优先，其次数量多的，再按区域和名字。返回[((区域, 资源名), 名字, token数)]
+        """
+        resources = []
+        for area_index, area in enumerate(self.areas):
+            for resource_name, this_resource_info in state_info["resource"][area].items():
+                if self.only_use_resource_tile and not this_resource_info["is_resource"]:
+                    continue
+                priority = (area != "center", -int(this_resource_info["count"]), area_index, resource_name)
+                resources.append((priority, area, resource_name, this_resource_info))
+        resources.sort(key=lambda x: x[0])
+        return [
+            (
+                (area, resource_name),
+                f"{area}/{resource_name}",
+                count_tokens(serialize(self.generate_resource_entry(resource_name, this_resource_info), self.serialization)),
+            )
+            for _, area, resource_name, this_resource_info in resources
+        ]
 
     def generate_item_description(
         self,
@@ -280,7 +568,7 @@ class PerceptionModule:
                     single_item_info["health_restore"] = int(consumable["health_restore"])
                 description["items"].append(single_item_info)
 
-        return json.dumps(description, indent=4)
+        return description
 
     def generate_skill_description(self, ego_agent_info):
         description = {}
@@ -288,4 +576,4 @@ class PerceptionModule:
             if "level" in k and k != "item_level":
                 skill_name = k.split("_level")[0].capitalize()
                 description[skill_name] = int(v)
-        return json.dumps(description, indent=4)
+        return description
@@ -17,8 +17,10 @@ from game_rule import RESOURCE_TABLE, NPC_TABLE, COMBAT_TABLE, ITEM_TABLE, SKILL
 from utils.io_utils import write_to_file
 
 from agent.prompt_template import (
+    PROMPT_LAYOUTS,
     generate_reduction_system_prompt,
     generate_reduction_user_prompt,
+    generate_shared_rule_prompt,
 )
 
 reduction_response_format = {
@@ -27,11 +29,23 @@ reduction_response_format = {
 
 
 class ReductionModule:
-    def __init__(self, config, llm_client, save_path, use_reduction=False, debug=False):
+    def __init__(
+        self,
+        config,
+        llm_client,
+        save_path,
+        use_reduction=False,
+        prompt_layout="default",
+        prefix_tracker=None,
+        debug=False,
+    ):
+        assert prompt_layout in PROMPT_LAYOUTS, f"Invalid prompt layout: {prompt_layout}"
         self.config = config
         self.llm_client = llm_client
         self.save_path = save_path
         self.use_reduction = use_reduction
+        self.prompt_layout = prompt_layout
+        self.prefix_tracker = prefix_tracker
         self.debug = debug
         self.attack_range = {
             "melee": self.config.COMBAT_MELEE_REACH,
@@ -58,6 +72,32 @@ class ReductionModule:
         action_space,
         goal=None,
     ):
+        input_message = self._prepare_input_message(tick, game_mechanics, state_description, action_space, goal=goal)
+        if self.debug:
+            response = self._get_debug_response()
+        else:
+            response = self.llm_client.generate(input_message, reduction_response_format)
+        return self._parse_reduction(tick, response)
+
+    async def reduce_async(
+        self,
+        tick,
+        game_mechanics,
+        state_description,
+        action_space,
+        goal=None,
+    ):
+        """
+        reduce的异步版本，llm_client需要是AsyncLLMClient
+        """
+        input_message = self._prepare_input_message(tick, game_mechanics, state_description, action_space, goal=goal)
+        if self.debug:
+            response = self._get_debug_response()
+        else:
+            response = await self.llm_client.generate(input_message, reduction_response_format)
+        return self._parse_reduction(tick, response)
+
+    def _prepare_input_message(self, tick, game_mechanics, state_description, action_space, goal=None):
 
         input_message = self.generate_input_message(
             game_mechanics,
@@ -65,6 +105,8 @@ class ReductionModule:
             action_space,
             goal=goal,
         )
+        if self.prefix_tracker is not None:
+            self.prefix_tracker.observe("reduction", input_message)
 
         write_to_file(
             self.save_path,
@@ -74,13 +116,14 @@ class ReductionModule:
                 f"=== user message ===\n{input_message[1]['content']}",
             ],
         )
+        return input_message
 
-        if self.debug:
-            response = {
-                "reduced_game_information": "fake reduced game information for testing.",
-            }
-        else:
-            response = self.llm_client.generate(input_message, reduction_response_format)
+    def _get_debug_response(self):
+        return {
+            "reduced_game_information": "fake reduced game information for testing.",
+        }
+
+    def _parse_reduction(self, tick, response):
         # print("response in act:", response)
         if response:
             write_to_file(
@@ -113,6 +156,9 @@ class ReductionModule:
         system_prompt = generate_reduction_system_prompt(
             reduction_response_format,
         )
+        if self.prompt_layout == "prefix_cache":
+            system_prompt = generate_shared_rule_prompt(game_mechanics) + system_prompt
+            game_mechanics = None
 
         system_message = {
             "role": "system",
@@ -12,9 +12,12 @@ grandparent_dir = os.path.dirname(parent_dir)
 sys.path.append(grandparent_dir)
 
 from agent.prompt_template import (
+    PROMPT_LAYOUTS,
     generate_action_verify_system_prompt,
     generate_action_verify_user_prompt,
+    generate_shared_rule_prompt,
 )
+from agent.prompt_budget import create_budget_stats, record_budget_report
 from utils.io_utils import write_to_file
 
 verifier_response_format = {
@@ -24,10 +27,24 @@ verifier_response_format = {
 
 
 class VerifyModule:
-    def __init__(self, config, llm_client, save_path, debug=False):
+    def __init__(
+        self,
+        config,
+        llm_client,
+        save_path,
+        prompt_layout="default",
+        prefix_tracker=None,
+        token_budget=None,
+        debug=False,
+    ):
+        assert prompt_layout in PROMPT_LAYOUTS, f"Invalid prompt layout: {prompt_layout}"
         self.config = config
         self.llm_client = llm_client
         self.save_path = save_path
+        self.prompt_layout = prompt_layout
+        self.prefix_tracker = prefix_tracker
+        self.token_budget = token_budget  # 每个prompt的token预算，配合budget_state截断状态描述，None表示不截断
+        self.budget_stats = create_budget_stats()
         self.debug = debug
 
     def verify(
@@ -42,10 +59,93 @@ class VerifyModule:
         action_history=None,
         candidate_action=None,
         verify_time=None,
+        budget_state=None,
     ):
-        input_message = self.generate_input_message(
-            verify_type, player_role, goal, game_mechanics, state_description, candidate_action, plan=plan, strategies=action_history
+        input_message = self._prepare_input_message(
+            verify_type,
+            player_role,
+            tick,
+            game_mechanics,
+            state_description,
+            goal=goal,
+            plan=plan,
+            action_history=action_history,
+            candidate_action=candidate_action,
+            verify_time=verify_time,
+            budget_state=budget_state,
+        )
+        if self.debug:
+            response = self._get_debug_response()
+        else:
+            response = self.llm_client.generate(input_message, verifier_response_format)
+        return self._parse_evaluation(tick, verify_time, response)
+
+    async def verify_async(
+        self,
+        verify_type,
+        player_role,
+        tick,
+        game_mechanics,
+        state_description,
+        goal=None,
+        plan=None,
+        action_history=None,
+        candidate_action=None,
+        verify_time=None,
+        budget_state=None,
+    ):
+        """
+        verify的异步版本，llm_client需要是AsyncLLMClient
+        """
+        input_message = self._prepare_input_message(
+            verify_type,
+            player_role,
+            tick,
+            game_mechanics,
+            state_description,
+            goal=goal,
+            plan=plan,
+            action_history=action_history,
+            candidate_action=candidate_action,
+            verify_time=verify_time,
+            budget_state=budget_state,
         )
+        if self.debug:
+            response = self._get_debug_response()
+        else:
+            response = await self.llm_client.generate(input_message, verifier_response_format)
+        return self._parse_evaluation(tick, verify_time, response)
+
+    def _prepare_input_message(
+        self,
+        verify_type,
+        player_role,
+        tick,
+        game_mechanics,
+        state_description,
+        goal=None,
+        plan=None,
+        action_history=None,
+        candidate_action=None,
+        verify_time=None,
+        budget_state=None,
+    ):
+        def build_input_message(state_description):
+            return self.generate_input_message(
+                verify_type, player_role, goal, game_mechanics, state_description, candidate_action, plan=plan, strategies=action_history
+            )
+
+        if budget_state is not None and self.token_budget is not None:
+            _, input_message, report = budget_state.fit(build_input_message, self.token_budget)
+            record_budget_report(self.budget_stats, report)
+            write_to_file(
+                self.save_path,
+                [f"=== tick: {tick} {verify_type} verify prompt budget verify_time:{verify_time} ===", json.dumps(report)],
+            )
+        else:
+            input_message = build_input_message(state_description)
+        if self.prefix_tracker is not None:
+            self.prefix_tracker.observe("verify", input_message)
         write_to_file(
             self.save_path,
             [
@@ -54,14 +154,16 @@ class VerifyModule:
                 f"=== user message ===\n{input_message[1]['content']}",
             ],
         )
-        if self.debug:
-            np.random.seed()
-            response = {
-                "reason": "Fake reason",
-                "evaluation": np.random.choice(["yes", "no"]),
-            }
-        else:
-            response = self.llm_client.generate(input_message, verifier_response_format)
+        return input_message
+
+    def _get_debug_response(self):
+        np.random.seed()
+        return {
+            "reason": "Fake reason",
+            "evaluation": np.random.choice(["yes", "no"]),
+        }
+
+    def _parse_evaluation(self, tick, verify_time, response):
         if response:
             write_to_file(
                 self.save_path,
@@ -78,6 +180,8 @@ class VerifyModule:
                     "Fail to get action response.",
                 ],
             )
+            # 没有得到验证结果时接受候选动作，不再为验证重复请求
+            return "yes", None
         return response["evaluation"].lower(), response["reason"]
 
     def generate_input_message(
@@ -97,6 +201,9 @@ class VerifyModule:
         system_prompt = generate_action_verify_system_prompt(
             verifier_response_format, verify_type, player_role, action_history=action_history, strategies=strategies
         )
+        if self.prompt_layout == "prefix_cache":
+            system_prompt = generate_shared_rule_prompt(game_mechanics) + system_prompt
+            game_mechanics = None
 
         system_message = {
             "role": "system",
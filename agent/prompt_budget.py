@@ -0,0 +1,120 @@
+from utils.token_counter import count_tokens
+
+MEMORY_HEADER = "\n\n# Interaction Memory\n"
+
+
+def count_message_tokens(messages):
+    return sum(count_tokens(message["content"]) for message in messages)
+
+
+class BudgetedState:
+    """
+    一个tick中按token预算组装的状态描述。
+    生存状态、位置、物品等和动作空间始终保留(core)，剩余的预算依次分配给: 由近到远的实体、资源、由新到旧的交互记忆。
+    按优先级顺序放入，第一个放不下的条目及其之后的条目全部丢弃，保证同样的状态截断结果相同
+    """
+
+    def __init__(self, perceive_module, state_info, tick, horizon, prompt_layout="default", memory_entries=None):
+        self.perceive_module = perceive_module
+        self.state_info = state_info
+        self.tick = tick
+        self.horizon = horizon
+        self.prompt_layout = prompt_layout
+        self.memory_entries = memory_entries or []
+
+        # [(类别, key, 名字, token数)]，按保留的优先级排列
+        self.items = [
+            ("entities", key, name, tokens) for key, name, tokens in perceive_module.list_budget_entities(state_info)
+        ]
+        self.items += [
+            ("resources", key, name, tokens) for key, name, tokens in perceive_module.list_budget_resources(state_info)
+        ]
+        for index in range(len(self.memory_entries) - 1, -1, -1):
+            entry = self.memory_entries[index]
+            self.items.append(("memory", index, entry.split(":", 1)[0], count_tokens(entry)))
+
+    def render(self, kept_count):
+        """
+        保留前kept_count个条目时的状态描述
+        """
+        kept_entities = set()
+        kept_resources = set()
+        kept_memory = []
+        for category, key, _, _ in self.items[:kept_count]:
+            if category == "entities":
+                kept_entities.add(key)
+            elif category == "resources":
+                kept_resources.add(key)
+            else:
+                kept_memory.append(key)
+        state_description = self.perceive_module.perceive_partial(
+            self.state_info,
+            self.tick,
+            self.horizon,
+            layout=self.prompt_layout,
+            kept_entities=kept_entities,
+            kept_resources=kept_resources,
+        )
+        if kept_memory:
+            state_description += (
+                MEMORY_HEADER + "".join(self.memory_entries[index] for index in sorted(kept_memory)) + "\n"
+            )
+        return state_description
+
+    def fit(self, build_messages, budget):
+        """
+        build_messages(state_description)生成完整的messages。返回(state_description, messages, report)
+        """
+        core_state_description = self.render(0)
+        core_messages = build_messages(core_state_description)
+        core_tokens = count_message_tokens(core_messages)
+        # 按每个条目单独的token数估计能放入的数量，再用完整prompt的token数修正(条目之间的分隔和表头等)
+        remaining = budget - core_tokens
+        kept_count = 0
+        for _, _, _, tokens in self.items:
+            if tokens > remaining:
+                break
+            remaining -= tokens
+            kept_count += 1
+        while kept_count > 0:
+            state_description = self.render(kept_count)
+            messages = build_messages(state_description)
+            total_tokens = count_message_tokens(messages)
+            if total_tokens <= budget:
+                break
+            kept_count -= 1
+        if kept_count == 0:
+            state_description, messages, total_tokens = core_state_description, core_messages, core_tokens
+
+        dropped = {"entities": [], "resources": [], "memory": []}
+        for category, _, name, _ in self.items[kept_count:]:
+            dropped[category].append(name)
+        report = {
+            "budget": budget,
+            "tokens": total_tokens,
+            "core_tokens": core_tokens,
+            "over_budget": total_tokens > budget,
+            "dropped": dropped,
+        }
+        return state_description, messages, report
+
+
+def create_budget_stats():
+    return {
+        "prompts": 0,
+        "truncated": 0,
+        "over_budget": 0,
+        "dropped_entities": 0,
+        "dropped_resources": 0,
+        "dropped_memory": 0,
+    }
+
+
+def record_budget_report(budget_stats, report):
+    budget_stats["prompts"] += 1
+    if any(report["dropped"].values()):
+        budget_stats["truncated"] += 1
+    if report["over_budget"]:
+        budget_stats["over_budget"] += 1
+    for category, names in report["dropped"].items():
+        budget_stats[f"dropped_{category}"] += len(names)
@@ -1,5 +1,16 @@
 import json
 
+# default: 规则和表格穿插在状态描述中; prefix_cache: 所有agent相同的规则和表格放在system message最前面，
+# 动态状态放在最后，使推理服务的前缀缓存可以在agent和tick之间复用
+PROMPT_LAYOUTS = ("default", "prefix_cache")
+
+
+def generate_shared_rule_prompt(game_mechanics):
+    """
+    prefix_cache布局的公共前缀，只包含与agent和tick无关的规则
+    """
+    return f"# Game Introduction\n{game_mechanics}\n\n# Instructions\n"
+
 
 ##### system prompt template #####
 # def generate_reduction_system_prompt(reduction_response_format, player_role):
@@ -45,9 +56,8 @@ def generate_task_system_prompt(task_response_format, strategies=None, previous_
     return prompt_template
 
 
-def generate_action_system_prompt(action_response_format, action_type, player_role, use_fog=False, feedback=None):
+def generate_player_role_prompt(player_role, use_fog=False):
     # player_role包括任务型(task)、生存型(individual)、竞争型(competitive)、合作型(cooperative)
-    action_response_format = json.dumps(action_response_format, indent=4)
     if use_fog:
         prompt_template = "You are an AI assistant in an open-world survival game. In this game, players' survival is challenged by a lack of food or water, expanding toxic fog, aggressive NPCs, and even other hostile players. "
     else:
@@ -64,31 +74,59 @@ def generate_action_system_prompt(action_response_format, action_type, player_ro
         prompt_template += "I need you help me select an action from a set of available actions for my game character to ensure my character's survival. I believe that players can only overcome the survival challenges mentioned above by working together. Therefore, I hope the game character can help other players as much as possible. "
     else:
         raise ValueError(f"Unsupported player role: {player_role}")
+    return prompt_template
 
-    # if plan:
-    #     prompt_template += "I will provide my long-term goal, my plan for achieving the long-term goal, descriptions of the game mechanics, the current game state, and the available actions. "
-    # else:
-    prompt_template += "I will provide the information needed for decision-making, including descriptions of the game mechanics and the current game state (provided as JSON). "
 
-    # prompt_template += "The game state includes my region on the map, information about the resources and entities (NPCs or other players) within my field of view, and my inventory and skill levels. The field of view is divided into nine areas: center, north, northeast, east, southeast, south, southwest, west, and northwest. This division indicates the precise location of observed objects and assists players in determining the direction of exploration. "
+FOG_PROMPT = "Additionally, there is an expanding toxic fog in the game that poses a significant threat to my character's survival. Staying within the fog will gradually deplete my character's health, so it is crucial to avoid it and plan movements accordingly. "
 
-    if use_fog:
-        prompt_template += "Additionally, there is an expanding toxic fog in the game that poses a significant threat to my character's survival. Staying within the fog will gradually deplete my character's health, so it is crucial to avoid it and plan movements accordingly. "
+FEEDBACK_PROMPT = "In this step, I have already selected a candidate action (not yet executed). My verifier thinks it is not optimal and provides me with feedback. When you select action, take that feedback into consideration.\n"
 
-    if action_type == "ml_action":
-        prompt_template += "In this tick, you need to select an action from the available actions to harvest resources, combat or explore the game map. Available actions include harvesting resources, which allows the character to harvest resources located in the center area; attacking an entity, which lets the character move close and attack targets within the center area; and moving to a specific area, which enables the character to approach resources in other areas, get closer to or farther from certain entities, and explore the map. "
 
+def generate_action_type_prompt(action_type):
+    if action_type == "ml_action":
+        return "In this tick, you need to select an action from the available actions to harvest resources, combat or explore the game map. Available actions include harvesting resources, which allows the character to harvest resources located in the center area; attacking an entity, which lets the character move close and attack targets within the center area; and moving to a specific area, which enables the character to approach resources in other areas, get closer to or farther from certain entities, and explore the map. "
     elif action_type == "use":
-        prompt_template += "In this tick, I have some items that can be equipped or used or unequipped. Choose an action from the action space to decide which items my character should use or equip or unequip. If you don't think there is anything worth using or equipping or unequipping right now, you can choose 'Use Nothing'. "
+        return "In this tick, I have some items that can be equipped or used or unequipped. Choose an action from the action space to decide which items my character should use or equip or unequip. If you don't think there is anything worth using or equipping or unequipping right now, you can choose 'Use Nothing'. "
     elif action_type == "destroy":
-        prompt_template += "In this tick, my inventory is full, which means I can't obtain any new items. Choose an action from the action space to destroy specific items and free up some space. If you don't think there is anything need to be destroyed right now, you can choose 'Destroy Nothing'. "
+        return "In this tick, my inventory is full, which means I can't obtain any new items. Choose an action from the action space to destroy specific items and free up some space. If you don't think there is anything need to be destroyed right now, you can choose 'Destroy Nothing'. "
     elif action_type == "give":
-        prompt_template += "In this tick, I have some unused or unequipped items in my inventory. You may consider whether to give them to nearby players, though this may not bring you any benefits. If you don't want to give anything to others right now, you can choose 'Give nothing to anyone'. "
+        return "In this tick, I have some unused or unequipped items in my inventory. You may consider whether to give them to nearby players, though this may not bring you any benefits. If you don't want to give anything to others right now, you can choose 'Give nothing to anyone'. "
     else:
         raise ValueError(f"Unsupported action type: {action_type}")
 
+
+def generate_action_system_prompt(action_response_format, action_type, player_role, use_fog=False, feedback=None):
+    action_response_format = json.dumps(action_response_format, indent=4)
+    prompt_template = generate_player_role_prompt(player_role, use_fog=use_fog)
+
+    # if plan:
+    #     prompt_template += "I will provide my long-term goal, my plan for achieving the long-term goal, descriptions of the game mechanics, the current game state, and the available actions. "
+    # else:
+    prompt_template += "I will provide the information needed for decision-making, including descriptions of the game mechanics and the current game state (provided as JSON). "
+
+    # prompt_template += "The game state includes my region on the map, information about the resources and entities (NPCs or other players) within my field of view, and my inventory and skill levels. The field of view is divided into nine areas: center, north, northeast, east, southeast, south, southwest, west, and northwest. This division indicates the precise location of observed objects and assists players in determining the direction of exploration. "
+
+    if use_fog:
+        prompt_template += FOG_PROMPT
+
+    prompt_template += generate_action_type_prompt(action_type)
+
     if feedback:
-        prompt_template += "In this step, I have already selected a candidate action (not yet executed). My verifier thinks it is not optimal and provides me with feedback. When you select action, take that feedback into consideration.\n"
+        prompt_template += FEEDBACK_PROMPT
+    prompt_template += f"Your entire response must be a single valid JSON object in the following format:\n{action_response_format}\nDo not include any text outside of the JSON object. "
+    return prompt_template
+
+
+def generate_session_system_prompt(action_response_format, player_role, game_mechanics, use_fog=False):
+    """
+    session模式的system prompt: 一个agent的所有决策在同一个对话中进行，只取决于角色和规则，同类agent完全相同
+    """
+    action_response_format = json.dumps(action_response_format, indent=4)
+    prompt_template = generate_shared_rule_prompt(game_mechanics) + generate_player_role_prompt(player_role, use_fog=use_fog)
+    prompt_template += "We will make all decisions for my game character in one continuing conversation. My first message provides the current game state (provided as JSON). To save space, each later message only provides the changes to the game state since my previous message: only changed fields are listed, every field that is not listed is unchanged, and null means the field has been removed. A list of objects (such as the resources and entities of an area, or my items) is given as an object keyed by each element's name (or id for items) that lists only the elements that changed: a new element appears in full, a changed element lists only its changed fields, and a removed element is null. Any other list that changed is given in full. A message without game state changes asks for another decision in the same tick. "
+    if use_fog:
+        prompt_template += FOG_PROMPT
+    prompt_template += "Each message ends with the decision to make and the available actions. Always choose from the available actions in the latest message. "
     prompt_template += f"Your entire response must be a single valid JSON object in the following format:\n{action_response_format}\nDo not include any text outside of the JSON object. "
     return prompt_template
 
@@ -144,7 +182,8 @@ def generate_reduction_user_prompt(
     prompt_template = ""
     if goal:
         prompt_template += f"# My Long-term Goal\n{goal}\n\n"
-    prompt_template += f"# Game Introduction\n{game_mechanics}\n\n"
+    if game_mechanics:
+        prompt_template += f"# Game Introduction\n{game_mechanics}\n\n"
     prompt_template += f"# Game Rule and Related Game State\n{game_state}\n\n"
     prompt_template += f"# Available Actions\n{action_space}\n\n"
     return prompt_template
@@ -183,7 +222,8 @@ def generate_action_user_prompt(
     prompt_template = ""
     if goal:
         prompt_template += f"# My Long-term Goal\n{goal}\n\n"
-    prompt_template += f"# Game Introduction\n{game_mechanics}\n\n"
+    if game_mechanics:
+        prompt_template += f"# Game Introduction\n{game_mechanics}\n\n"
     if plan:
         prompt_template += f"# Plan\n{plan}\n\n"
     prompt_template += f"# Game Rule and Related Game State\n{game_state}\n\n"
@@ -201,11 +241,46 @@ def generate_action_user_prompt(
     return prompt_template
 
 
+def generate_session_user_prompt(
+    state_update,
+    action_type,
+    action_space,
+    goal=None,
+    candidate_action=None,
+    feedback=None,
+):
+    """
+    session模式中一次决策的user message。state_update为None表示同一个tick中的后续决策
+    """
+    action_space = json.dumps(action_space, indent=4)
+    prompt_template = ""
+    if state_update and state_update["full_state"]:
+        if goal:
+            prompt_template += f"# My Long-term Goal\n{goal}\n\n"
+        prompt_template += f"# Current Game State\n{state_update['full_state']}\n\n"
+    elif state_update:
+        changes = state_update["changes"] or "No changes."
+        prompt_template += f"# Game State Changes (tick {state_update['since_tick']} -> {state_update['tick']})\n{changes}\n\n"
+    if state_update and state_update["events"]:
+        events = "".join(state_update["events"])
+        prompt_template += f"# New Interaction Events\n{events}\n\n"
+    prompt_template += f"# Decision\n{generate_action_type_prompt(action_type)}\n\n"
+    if candidate_action:
+        candidate_action = json.dumps(candidate_action, indent=4)
+        prompt_template += f"# Candidate Action\n{candidate_action}\n\n"
+    if feedback:
+        prompt_template += f"# Action Feedback\n{FEEDBACK_PROMPT}{feedback}\n\n"
+    prompt_template += f"# Available Actions\n{action_space}\n\n"
+    return prompt_template
+
+
 def generate_action_verify_user_prompt(
     goal, game_mechanics, game_state, candidate_action, plan=None, action_history=None, strategies=None
 ):
     candidate_action = json.dumps(candidate_action, indent=4)
-    prompt_template = f"# My Long-term Goal\n{goal}\n\n# Game Introduction\n{game_mechanics}\n\n"
+    prompt_template = f"# My Long-term Goal\n{goal}\n\n"
+    if game_mechanics:
+        prompt_template += f"# Game Introduction\n{game_mechanics}\n\n"
     if plan:
         prompt_template += f"# Plan\n{plan}\n\n"
     # if strategies:
@@ -3,5 +3,7 @@ openai_api_key="sk-rlliqqv0laPsXkxE64nmGZdorhw23FcaLKpGHkgHp45GVijS"
 
 llama_base_url="http://localhost:8000/v1"
 llama_api_key="llama"
+# 多个vLLM副本时在这里列出所有副本的url, LLMClient会在它们之间负载均衡
+llama_base_urls=[llama_base_url]
 # llama_base_url="https://sd091vg1lef3ta500u690.apigateway-cn-beijing.volceapi.com/mlp/s-20250430210359-hgdn9/v1"
 # llama_api_key="llama"
\ No newline at end of file
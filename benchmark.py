@@ -0,0 +1,142 @@
+import argparse
+import difflib
+import random
+import time
+
+import numpy as np
+import nmmo
+
+from main import build_map_config
+from agent.modules.perception_module import PerceptionModule
+from perception_baseline import PerceptionModule as BaselinePerceptionModule
+from bridge.state_manager import StateManager
+from utils.path_utils import a_star_bounded, a_star_grid, get_bounds
+from utils.terrain_utils import build_terrain_index
+
+
+def build_env(map_size, player_num, seed):
+    config = build_map_config(map_size, 1024, player_num, 0, None, 0, 16, False)
+    env = nmmo.Env(config=config)
+    env.reset(seed=seed)
+    return env
+
+
+def time_queries(search_fn, realm_map, queries, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        for start, goal, bounds in queries:
+            search_fn(realm_map, start, goal, bounds=bounds)
+        best = min(best, time.perf_counter() - start_time)
+    return best
+
+
+def benchmark_path(args):
+    env = build_env(args.map_size, args.player_num, args.seed)
+    realm_map = env.realm.map
+    rng = random.Random(args.seed)
+
+    # 15×15 view: every agent queries every tile in its own observation
+    view_queries = []
+    for agent_id in env.agents:
+        obs = env.obs[agent_id]
+        bounds = get_bounds(obs.tiles)
+        start = (obs.agent.row, obs.agent.col)
+        for tile in obs.tiles:
+            view_queries.append((start, (tile[0], tile[1]), bounds))
+
+    # full map: random pairs of habitable tiles without bounds
+    habitable = np.argwhere(realm_map.habitable_tiles != 0)
+    full_queries = []
+    for _ in range(args.full_map_queries):
+        start = tuple(int(v) for v in habitable[rng.randrange(len(habitable))])
+        goal = tuple(int(v) for v in habitable[rng.randrange(len(habitable))])
+        full_queries.append((start, goal, None))
+
+    for name, queries in [("15x15 view", view_queries), ("full map", full_queries)]:
+        mismatch = sum(
+            a_star_bounded(realm_map, start, goal, bounds) != a_star_grid(realm_map, start, goal, bounds)
+            for start, goal, bounds in queries
+        )
+        baseline = time_queries(a_star_bounded, realm_map, queries, args.repeat)
+        grid = time_queries(a_star_grid, realm_map, queries, args.repeat)
+        print(
+            f"{name}: {len(queries)} queries, a_star_bounded {baseline:.4f}s, a_star_grid {grid:.4f}s, "
+            f"speedup {baseline / grid:.2f}x, mismatches {mismatch}"
+        )
+
+
+def time_calls(fn, items, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        for item in items:
+            fn(item)
+        best = min(best, time.perf_counter() - start_time)
+    return best
+
+
+def report_first_diff(name, expected, actual):
+    diff = difflib.unified_diff(expected.splitlines(), actual.splitlines(), "baseline", "compiled", n=2, lineterm="")
+    print(f"{name}: first mismatch\n" + "\n".join(diff))
+
+
+def benchmark_prompt(args):
+    env = build_env(args.map_size, args.player_num, args.seed)
+    build_terrain_index(env.realm)
+    horizon = 1024
+    tick = 1
+    state_infos = [StateManager(env).get_state_info(env.obs[agent_id]) for agent_id in env.agents]
+    perceive_module = PerceptionModule(env.config, None, None)
+    # 优化前的PerceptionModule的冻结副本: 每次调用都重新生成规则文本和json表格，作为输出和耗时的基准
+    baseline_module = BaselinePerceptionModule(env.config, None, None)
+
+    if baseline_module.perceive_static() != perceive_module.perceive_static():
+        report_first_diff("static rules", baseline_module.perceive_static(), perceive_module.perceive_static())
+    layouts = {
+        "default": (baseline_module.perceive, perceive_module.perceive),
+        "prefix_cache": (baseline_module.perceive_dynamic, perceive_module.perceive_dynamic),
+    }
+    calls = len(state_infos)
+    for layout, (baseline_fn, compiled_fn) in layouts.items():
+        mismatch = 0
+        for state_info in state_infos:
+            expected = baseline_fn(state_info, tick, horizon)
+            actual = compiled_fn(state_info, tick, horizon)
+            if expected != actual:
+                if mismatch == 0:
+                    report_first_diff(layout, expected, actual)
+                mismatch += 1
+        baseline = time_calls(lambda state_info: baseline_fn(state_info, tick, horizon), state_infos, args.repeat)
+        compiled = time_calls(lambda state_info: compiled_fn(state_info, tick, horizon), state_infos, args.repeat)
+        print(
+            f"perceive ({layout}): {calls} agents, baseline {baseline / calls * 1e6:.1f}us/call, "
+            f"compiled {compiled / calls * 1e6:.1f}us/call, speedup {baseline / compiled:.2f}x, mismatches {mismatch}"
+        )
+    dynamic = time_calls(
+        lambda state_info: perceive_module.generate_dynamic_values(state_info, tick, horizon), state_infos, args.repeat
+    )
+    print(f"dynamic values only: {dynamic / calls * 1e6:.1f}us/call")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="target", required=True)
+
+    path_parser = subparsers.add_parser("path")
+    path_parser.add_argument("--map_size", type=int, default=128)
+    path_parser.add_argument("--player_num", type=int, default=32)
+    path_parser.add_argument("--full_map_queries", type=int, default=50)
+    path_parser.add_argument("--repeat", type=int, default=3)
+    path_parser.add_argument("--seed", type=int, default=1)
+    path_parser.set_defaults(func=benchmark_path)
+
+    prompt_parser = subparsers.add_parser("prompt")
+    prompt_parser.add_argument("--map_size", type=int, default=128)
+    prompt_parser.add_argument("--player_num", type=int, default=32)
+    prompt_parser.add_argument("--repeat", type=int, default=20)
+    prompt_parser.add_argument("--seed", type=int, default=1)
+    prompt_parser.set_defaults(func=benchmark_prompt)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -15,7 +15,8 @@ from constant import (
     IMPASSIBLE_TILE,
 )
 
-from utils.path_utils import a_star_bounded as aStar, get_bounds, get_area, get_center_bounds
+from utils.terrain_utils import get_terrain_index
+from utils.path_utils import get_pathfinding_cache, nearest_target_step, get_bounds, get_center_bounds, AreaPartition
 
 
 # pylint: disable=invalid-name
@@ -82,6 +83,10 @@ class ActionManager:
         }
         self.area_index = {v: k for k, v in self.area_table.items()}
 
+    def find_path(self, start_pos, target_pos, bounds):
+        # 同一tick内同一起点的搜索结果共享，后续查询直接命中缓存
+        return get_pathfinding_cache(self.env.realm).query(start_pos, target_pos, bounds=bounds)
+
     def execute(self, obs, obs_when_act, ml_action):
         action = {}
 
@@ -107,55 +112,42 @@ class ActionManager:
         tiles = obs.tiles
         bounds = get_bounds(tiles)
         min_r, max_r, min_c, max_c = bounds
-        resource_dis = []
+        target_pos_list = []
         start_pos = (obs.agent.row, obs.agent.col)
-        for tile in obs.tiles:
+        terrain_index = get_terrain_index(self.env.realm)
+        area_partition = AreaPartition(tiles)
+        for tile, area in zip(obs.tiles, area_partition.areas):
             # 跳过不在center位置的tile
             if tile[0] < min_r or tile[0] > max_r or tile[1] < min_c or tile[1] > max_c:
                 continue
             if (tile[0], tile[1]) == start_pos:
                 continue
-            if get_area(tiles, tile[0], tile[1]) != "center":
+            if area != "center":
                 continue
             if self.material_id_to_name[tile[2]] == resource_name:
                 if resource_name not in self.impassible_tile:
-                    target_pos = (tile[0], tile[1])
-                    min_direction, min_distance = aStar(self.env.realm.map, start_pos, target_pos, bounds=bounds)
-                    if min_distance == 1:  # 不可能比这更近了，直接返回
-                        return self.direction_to_index[min_direction]
-                    elif min_distance != float("inf"):
-                        resource_dis.append((min_direction, min_distance))
+                    target_pos_list.append((tile[0], tile[1]))
                 else:
-                    # 处理水和鱼等不可接近的资源
+                    # 处理水和鱼等不可接近的资源, 目标为其周围可通行的tile
                     four_direction = [(0, 1), (0, -1), (1, 0), (-1, 0)]
-                    target_pos_list = [
+                    target_pos_list.extend(
                         (tile[0] + direction[0], tile[1] + direction[1])
                         for direction in four_direction
                         if self.env.realm.map.is_valid_pos(tile[0] + direction[0], tile[1] + direction[1])
-                        and not self.env.realm.map.tiles[tile[0] + direction[0], tile[1] + direction[1]].impassible
-                    ]
-                    if target_pos_list:
-                        one_resource_dis = []
-                        for target_pos in target_pos_list:
-                            if target_pos == start_pos:
-                                continue
-                            direction, distance = aStar(self.env.realm.map, start_pos, target_pos, bounds=bounds)
-                            if distance == 1:  # 不可能比这更近了，直接返回
-                                return self.direction_to_index[direction]
-                            elif distance != float("inf"):
-                                one_resource_dis.append((direction, distance))
-                        if one_resource_dis:
-                            one_resource_dis.sort(key=lambda x: x[1])
-                            min_direction = one_resource_dis[0][0]
-                            min_distance = one_resource_dis[0][1]
-                            resource_dis.append((min_direction, min_distance))
-        if resource_dis:
-            resource_dis.sort(key=lambda x: x[1])
-            direction = resource_dis[0][0]
-            min_distance = resource_dis[0][1]
-        else:
-            direction = (0, 0)
-        # assert min_distance != float("inf")
+                        and not terrain_index.is_impassable((tile[0] + direction[0], tile[1] + direction[1]))
+                    )
+        # 与起点不在同一连通区域的目标无论如何都到达不了，全部不可达时不必搜索
+        target_pos_list = [target_pos for target_pos in target_pos_list if terrain_index.can_connect(start_pos, target_pos)]
+        if not target_pos_list:
+            return self.direction_to_index[(0, 0)]
+        # 从所有目标同时出发做一次多源BFS, 得到通往最近目标的第一步; 距离相同时按DIRECTION_TO_INDEX的顺序选择方向
+        direction, _ = nearest_target_step(
+            self.env.realm.map,
+            start_pos,
+            target_pos_list,
+            bounds=bounds,
+            directions=[direction for direction in self.direction_to_index if direction != (0, 0)],
+        )
         return self.direction_to_index[direction]
 
     def move_to_area(self, obs, target_area):
@@ -172,6 +164,7 @@ class ActionManager:
         target_y = int(range_midpoints(min_map_y, max_map_y)[y_index])
 
         strat_pos = (obs.agent.row, obs.agent.col)
+        terrain_index = get_terrain_index(self.env.realm)
 
         eight_direction = [(0, 1), (0, -1), (1, 0), (-1, 0), (1, 1), (1, -1), (-1, 1), (-1, -1)]
 
@@ -182,18 +175,19 @@ class ActionManager:
         for target_pos in target_pos_list:
             if (
                 self.env.realm.map.is_valid_pos(target_pos[0], target_pos[1])
-                and not self.env.realm.map.tiles[target_pos[0], target_pos[1]].impassible
+                and not terrain_index.is_impassable(target_pos)
+                and terrain_index.can_connect(strat_pos, target_pos)
             ):
-                direction, distance = aStar(self.env.realm.map, strat_pos, target_pos, bounds=bounds)
+                direction, distance = self.find_path(strat_pos, target_pos, bounds=bounds)
                 if distance != float("inf"):
                     return self.direction_to_index[direction]
 
         # 最后尝试区域所有位置
         for tile in obs.tiles:
             if min_map_x <= tile[0] <= max_map_x and min_map_y <= tile[1] <= max_map_y:
-                if not self.env.realm.map.tiles[tile[0], tile[1]].impassible:
-                    target_pos = (tile[0], tile[1])
-                    direction, distance = aStar(self.env.realm.map, strat_pos, target_pos, bounds=bounds)
+                target_pos = (tile[0], tile[1])
+                if not terrain_index.is_impassable(target_pos) and terrain_index.can_connect(strat_pos, target_pos):
+                    direction, distance = self.find_path(strat_pos, target_pos, bounds=bounds)
                     if distance != float("inf"):
                         return self.direction_to_index[direction]
         return self.direction_to_index[(0, 0)]
@@ -210,7 +204,9 @@ class ActionManager:
         )
         if start_pos == target_pos:
             return self.direction_to_index[(0, 0)]
-        direction, distance = aStar(self.env.realm.map, start_pos, target_pos, bounds=bounds)
+        if not get_terrain_index(self.env.realm).can_connect(start_pos, target_pos):
+            return self.direction_to_index[(0, 0)]
+        direction, distance = self.find_path(start_pos, target_pos, bounds=bounds)
         if distance == float("inf"):
             return self.direction_to_index[(0, 0)]
         else:
@@ -11,13 +11,110 @@ from constant import (
     HARVESTED_NAME_TO_RESOURCE_NAME,
     RESOURCE_TILE,
     IMPASSIBLE_TILE,
+    ITEM_NAME_TO_TYPE,
+    EQUIPMENT_TYPE,
 )
-from utils.path_utils import a_star_bounded as aStar, l1, get_bounds, which_part, AREA_TABLE, get_area
+
+from utils.terrain_utils import get_terrain_index
+from utils.path_utils import get_pathfinding_cache, l1, get_bounds, which_part, AREA_TABLE, AREA_NAMES, AreaPartition
+
+SKILL_NAMES = ["melee", "range", "mage", "fishing", "herbalism", "prospecting", "carving", "alchemy"]
+
+
+def check_level(agent_info, item):
+    """
+    检查agent的技能等级是否满足使用该物品的要求
+    """
+    melee_level = agent_info["melee_level"]
+    range_level = agent_info["range_level"]
+    mage_level = agent_info["mage_level"]
+    fishing_level = agent_info["fishing_level"]
+    herbalism_level = agent_info["herbalism_level"]
+    prospecting_level = agent_info["prospecting_level"]
+    carving_level = agent_info["carving_level"]
+    alchemy_level = agent_info["alchemy_level"]
+    agent_highest_level = max(
+        melee_level,
+        range_level,
+        mage_level,
+        fishing_level,
+        herbalism_level,
+        prospecting_level,
+        carving_level,
+        alchemy_level,
+    )
+
+    # 检查防具等级
+    if item["type"] == "Armor":
+        return agent_highest_level >= item["level"]
+    # 检查武器和弹药等级
+    elif item["type"] == "Weapon" or item["type"] == "Ammunition":
+        if item["name"] == "Spear" or item["name"] == "Whetstone":
+            return melee_level >= item["level"]
+        elif item["name"] == "Bow" or item["name"] == "Arrow":
+            return range_level >= item["level"]
+        elif item["name"] == "Wand" or item["name"] == "Runes":
+            return mage_level >= item["level"]
+        else:
+            raise ValueError(f"Unknown Weapon or Ammunition: {item['name']}")
+    # 检查工具等级
+    elif item["type"] == "Tool":
+        if item["name"] == "Rod":
+            return fishing_level >= item["level"]
+        elif item["name"] == "Gloves":
+            return herbalism_level >= item["level"]
+        elif item["name"] == "Axe":
+            return carving_level >= item["level"]
+        elif item["name"] == "Chisel":
+            return alchemy_level >= item["level"]
+        elif item["name"] == "Pickaxe":
+            return prospecting_level >= item["level"]
+        else:
+            raise ValueError(f"Unknown tool: {item['name']}")
+    # 检查消耗品等级
+    elif item["type"] == "Consumable":
+        return agent_highest_level >= item["level"]
+    else:
+        return False
+
+
+class InventoryView:
+    """
+    每个tick由StateManager.get_inventory_info解码一次的背包视图。
+    物品按类别分组，每个物品的usable字段为预先计算的check_level结果，
+    ActionModule直接查询这里的列表，不再重复过滤。
+    """
+
+    item_types = ("Armor", "Weapon", "Tool", "Ammunition", "Consumable")
+
+    def __init__(self, categories, capacity):
+        self.armor = categories["Armor"]
+        self.weapon = categories["Weapon"]
+        self.tool = categories["Tool"]
+        self.ammunition = categories["Ammunition"]
+        self.consumable = categories["Consumable"]
+        self.capacity = capacity
+        # 与原来各处拼接的顺序一致
+        self.items = self.armor + self.weapon + self.tool + self.ammunition + self.consumable
+        # 满足等级要求且未装备的装备
+        self.equippable = [
+            item for item in self.items if item["type"] in EQUIPMENT_TYPE and not item["is_equipped"] and item["usable"]
+        ]
+        # 满足等级要求的消耗品名称
+        self.usable_consumable_names = {item["name"] for item in self.consumable if item["usable"]}
+        # 已装备的物品不能丢弃或给予
+        self.unequipped = [
+            item for item in self.items if not (item["type"] in EQUIPMENT_TYPE and item["is_equipped"])
+        ]
 
 
 class StateManager:
-    def __init__(self, env):
+    sections = ["agent", "fog", "resource", "passible", "entity", "inventory"]
+
+    def __init__(self, env, incremental=False):
         self.env = env
+        # 增量模式: 保留上一次的state_info，只重新计算输入发生变化的section
+        self.incremental = incremental
         self.add_tick_info = True
         self.config = env.config
         self.material_name_to_id = MATERIAL_NAME_TO_ID
@@ -40,9 +137,62 @@ class StateManager:
         self.area_table = AREA_TABLE
         self.areas = AREA_SPACE
         # self.entity_id_to_index = None
+        self._observation_key = None
+        self._observation_cache = {}
+
+        self._last_state_sections = None
+        self._section_fingerprints = {}
+        self.recomputed_sections = []
+        self.section_stats = {section: {"recomputed": 0, "reused": 0} for section in self.sections}
 
     def reset(self):
         self.visited_positions = set()
+        self._observation_key = None
+        self._observation_cache = {}
+        self._last_state_sections = None
+        self._section_fingerprints = {}
+        self.recomputed_sections = []
+
+    def _get_observation_cache(self, obs):
+        # 同一个观测(同一tick、同一位置)上派生出的结构只计算一次
+        key = (obs.current_tick, obs.agent.row, obs.agent.col)
+        if key != self._observation_key:
+            self._observation_key = key
+            self._observation_cache = {}
+        return self._observation_cache
+
+    def get_area_partition(self, obs):
+        """
+        每个观测只计算一次视野的3×3区域划分，各个get_*_info直接读取区域标签
+        """
+        cache = self._get_observation_cache(obs)
+        if "area_partition" not in cache:
+            cache["area_partition"] = AreaPartition(obs.tiles)
+        return cache["area_partition"]
+
+    def get_combat_index(self, obs):
+        """
+        一次遍历实体数组的第8列(attacker_id)，建立 攻击者id -> 被其攻击的实体行号 的索引，
+        get_entity_info和get_ego_agent_info据此填写战斗关系，不再两两比较实体
+        """
+        cache = self._get_observation_cache(obs)
+        if "combat_index" not in cache:
+            combat_index = defaultdict(list)
+            if obs.entities:
+                for i, attacker_id in enumerate(obs.entities.values[:, 8].tolist()):
+                    if attacker_id != 0:
+                        combat_index[attacker_id].append(i)
+            cache["combat_index"] = combat_index
+        return cache["combat_index"]
+
+    def get_distance_field(self, obs):
+        """
+        以agent位置为起点在视野范围内做一次有界BFS，得到到每个可达tile的距离。
+        结果存放在按tick清空的共享缓存中，同一tick内StateManager和ActionManager的查询都直接命中。
+        """
+        bounds = get_bounds(obs.tiles)
+        start_pos = (obs.agent.row, obs.agent.col)
+        return get_pathfinding_cache(self.env.realm).get_distance_field(start_pos, bounds=bounds)
 
     def get_map_region(self, obs):
         """
@@ -122,6 +272,11 @@ class StateManager:
         ego_agent_info["fish_around"] = False
         self.visited_positions.add((ego_agent_info["row"], ego_agent_info["col"]))
         four_directions = [(0, 1), (0, -1), (1, 0), (-1, 0)]
+        # 静态地形索引中周围没有水和鱼(初始位置)的tile无需逐个检查邻居
+        if not get_terrain_index(self.env.realm).may_have_water_or_fish_around(
+            (ego_agent_info["row"], ego_agent_info["col"])
+        ):
+            four_directions = []
         for direction in four_directions:
             neighbor_pos = (ego_agent_info["row"] + direction[0], ego_agent_info["col"] + direction[1])
             if self.env.realm.map.is_valid_pos(neighbor_pos[0], neighbor_pos[1]):
@@ -156,43 +311,57 @@ class StateManager:
                     f"NPC {-obs.agent.attacker_id}" if obs.agent.attacker_id < 0 else f"Player {obs.agent.attacker_id}"
                 )
                 ego_agent_info["attacker_damage"] = obs.agent.damage
-            for entity in obs.entities.values:
-                if entity[8] == ego_agent_info["id"]:  # 攻击者为ego agent
-                    ego_agent_info["target_of_attack"] = f"NPC {-entity[0]}" if entity[0] < 0 else f"Player {entity[0]}"
-                    ego_agent_info["ego_damage"] = entity[4]
+            targets = self.get_combat_index(obs).get(ego_agent_info["id"])
+            if targets:  # 攻击者为ego agent
+                entity = obs.entities.values[targets[-1]]
+                ego_agent_info["target_of_attack"] = f"NPC {-entity[0]}" if entity[0] < 0 else f"Player {entity[0]}"
+                ego_agent_info["ego_damage"] = entity[4]
         return ego_agent_info
 
     def get_fog_info(self, obs):
         assert self.config.DEATH_FOG_ONSET
+        area_partition = self.get_area_partition(obs)
+        min_r, max_r, min_c, max_c = area_partition.bounds
+        # 一次性切出视野范围的迷雾值，用掩码分类后按区域标签聚合
+        fog_window = self.env.realm.fog_map[min_r : max_r + 1, min_c : max_c + 1]
+        fog_values = fog_window[obs.tiles[:, 0] - min_r, obs.tiles[:, 1] - min_c].astype(np.float64)
+        below_zero = fog_values < 0
+        # 与math.isclose的默认容差一致
+        in_safety = below_zero & (
+            np.abs(fog_values + self.config.MAP_SIZE) <= 1e-9 * np.maximum(np.abs(fog_values), self.config.MAP_SIZE)
+        )
+        fog_masks = {
+            "in_fog_count": fog_values > 0.5,
+            "on_the_edge_count": fog_values == 0.0,
+            "in_safety_count": in_safety,
+            "out_of_fog_count": below_zero & ~in_safety,
+        }
+        labels = area_partition.labels
+        area_counts = {
+            key: np.bincount(labels[mask], minlength=len(AREA_NAMES)).tolist() for key, mask in fog_masks.items()
+        }
+        label_of_area = {area: label for label, area in enumerate(AREA_NAMES)}
         fog_info = {
-            area: {"out_of_fog_count": 0, "on_the_edge_count": 0, "in_fog_count": 0, "in_safety_count": 0}
+            area: {
+                key: area_counts[key][label_of_area[area]]
+                for key in ["out_of_fog_count", "on_the_edge_count", "in_fog_count", "in_safety_count"]
+            }
             for area in self.areas
         }
-        for tile in obs.tiles:
-            area = get_area(obs.tiles, tile[0], tile[1])
-            fog_value = float(self.env.realm.fog_map[tile[0], tile[1]])
-            if fog_value > 0.5:
-                fog_info[area]["in_fog_count"] += 1
-            elif math.isclose(fog_value, 0.0):
-                fog_info[area]["on_the_edge_count"] += 1
-            elif fog_value < 0:
-                if math.isclose(fog_value, -self.config.MAP_SIZE):
-                    fog_info[area]["in_safety_count"] += 1
-                else:
-                    fog_info[area]["out_of_fog_count"] += 1
         return fog_info
 
     def get_resource_info(self, obs):
         # 信息：各个资源的名称和数量
         # 资源属性：名称、数量、是否是资源、原始资源、是否可通行
         resource_info = {area: {} for area in self.areas}
-        bounds = get_bounds(obs.tiles)
+        distance_field = self.get_distance_field(obs)
+        terrain_index = get_terrain_index(self.env.realm)
         start_pos = (obs.agent.row, obs.agent.col)
 
-        for tile in obs.tiles: 
+        area_partition = self.get_area_partition(obs)
+        for tile, area in zip(obs.tiles, area_partition.areas):
             if (tile[0], tile[1]) == start_pos: # 自己位置的不统计
                 continue
-            area = get_area(obs.tiles, tile[0], tile[1])
             material_name = self.material_id_to_name[tile[2]]
 
             # 统计资源是否可达
@@ -207,15 +376,11 @@ class StateManager:
                     candidate_pos = (tile[0] + direction[0], tile[1] + direction[1])
                     if (
                         self.env.realm.map.is_valid_pos(*candidate_pos)
-                        and not self.env.realm.map.tiles[candidate_pos].impassible
+                        and not terrain_index.is_impassable(candidate_pos)
                     ):
                         target_pos_list.append(candidate_pos)
             if target_pos_list:
-                distances = []
-                for target_pos in target_pos_list:
-                    _, distance = aStar(self.env.realm.map, start_pos, target_pos, bounds=bounds)
-                    distances.append(distance)
-                min_distance = min(distances)
+                min_distance = min(distance_field.get_distance(target_pos) for target_pos in target_pos_list)
                 if min_distance != float("inf"):
                     reachable = True
             if reachable:
@@ -246,23 +411,21 @@ class StateManager:
         return resource_info
 
     def get_passible_info(self, obs):
-        bounds = get_bounds(obs.tiles)
+        distance_field = self.get_distance_field(obs)
+        terrain_index = get_terrain_index(self.env.realm)
         area_reachable_tile_count = {area: 0 for area in self.areas}
         area_passible_tile_count = {area: 0 for area in self.areas}
         area_visited_tile_count = {area: 0 for area in self.areas}
-        start_pos = (obs.agent.row, obs.agent.col)
-        for tile in obs.tiles:
-            area = get_area(obs.tiles, tile[0], tile[1])
+        area_partition = self.get_area_partition(obs)
+        for tile, area in zip(obs.tiles, area_partition.areas):
             # 统计是否可通行
             if (
                 self.env.realm.map.is_valid_pos(tile[0], tile[1])
-                and not self.env.realm.map.tiles[(tile[0], tile[1])].impassible
+                and not terrain_index.is_impassable(tile)
             ):
                 area_passible_tile_count[area] += 1
             # 统计是否可到达
-            target_pos = (tile[0], tile[1])
-            _, distance = aStar(self.env.realm.map, start_pos, target_pos, bounds=bounds)
-            if distance != float("inf"):
+            if (tile[0], tile[1]) in distance_field:
                 area_reachable_tile_count[area] += 1
             if (tile[0], tile[1]) in self.visited_positions:
                 area_visited_tile_count[area] += 1
@@ -280,6 +443,8 @@ class StateManager:
     def get_entity_info(self, obs):
         entity_info = {area: [] for area in self.areas}
         ego_pos = (obs.agent.row, obs.agent.col)
+        area_partition = self.get_area_partition(obs)
+        combat_index = self.get_combat_index(obs)
 
         if obs.entities:
             for i, entity in enumerate(obs.entities.values):
@@ -308,13 +473,14 @@ class StateManager:
                 if entity[8] != 0:
                     in_combat = True
                     attacker = f"NPC {-entity[8]}" if entity[8] < 0 else f"Player {entity[8]}"
-                for other_entity in obs.entities.values:
-                    if other_entity[0] != entity[0] and other_entity[8] == entity[0]:
-                        in_combat = True
-                        target_of_attack = f"NPC {-other_entity[0]}" if other_entity[0] < 0 else f"Player {other_entity[0]}"
+                targets = [j for j in combat_index.get(entity[0], []) if j != i]
+                if targets:
+                    other_entity = obs.entities.values[targets[-1]]
+                    in_combat = True
+                    target_of_attack = f"NPC {-other_entity[0]}" if other_entity[0] < 0 else f"Player {other_entity[0]}"
 
                 entity_pos = (entity[2], entity[3])
-                entity_area = get_area(obs.tiles, entity_pos[0], entity_pos[1])
+                entity_area = area_partition.area_of(entity_pos[0], entity_pos[1])
 
                 entity_attackable = False
                 player_attackable = False
@@ -346,151 +512,117 @@ class StateManager:
                 )
         return entity_info
 
-    def get_armor_info(self, obs):
-        armor_info = []
-        item_type = "Armor"
-        if obs.inventory:
-            for item in obs.inventory.values:
-                item_id = item[0]
-                item_name = self.item_index_to_name[item[1]]
-                item_level = item[3]
-                if item_name in ["Hat", "Top", "Bottom"]:
-                    is_equipped = bool(item[14])
-                    melee_defense = item[9]
-                    range_defense = item[10]
-                    mage_defense = item[11]
-                    armor = {
-                        "id": item_id,
-                        "name": item_name,
-                        "type": item_type,
-                        "level": item_level,
-                        "is_equipped": is_equipped,
-                        "melee_defense": melee_defense,
-                        "range_defense": range_defense,
-                        "mage_defense": mage_defense,
-                    }
-                    armor_info.append(armor)
-        return armor_info
-
-    def get_weapon_info(self, obs):
-        weapon_info = []
-        item_type = "Weapon"
-        if obs.inventory:
-            for item in obs.inventory.values:
-                item_id = item[0]
-                item_name = self.item_index_to_name[item[1]]
-                item_level = item[3]
-                if item_name in ["Spear", "Bow", "Wand"]:
-                    is_equipped = bool(item[14])
-                    melee_attack = item[6]
-                    range_attack = item[7]
-                    mage_attack = item[8]
-                    weapon = {
-                        "id": item_id,
-                        "name": item_name,
-                        "type": item_type,
-                        "level": item_level,
-                        "is_equipped": is_equipped,
-                        "melee_attack": melee_attack,
-                        "range_attack": range_attack,
-                        "mage_attack": mage_attack,
-                    }
-                    weapon_info.append(weapon)
-        return weapon_info
-
-    def get_tool_info(self, obs):
-        tool_info = []
-        item_type = "Tool"
-        if obs.inventory:
-            for item in obs.inventory.values:
-                item_id = item[0]
-                item_name = self.item_index_to_name[item[1]]
-                item_level = item[3]
-
-                if item_name in ["Rod", "Gloves", "Pickaxe", "Axe", "Chisel"]:
-                    is_equipped = bool(item[14])
-                    melee_defense = item[9]
-                    range_defense = item[10]
-                    mage_defense = item[11]
-                    tool = {
-                        "id": item_id,
-                        "name": item_name,
-                        "type": item_type,
-                        "level": item_level,
-                        "is_equipped": is_equipped,
-                        "melee_defense": melee_defense,
-                        "range_defense": range_defense,
-                        "mage_defense": mage_defense,
-                    }
-                    tool_info.append(tool)
-        return tool_info
-
-    def get_ammunition_info(self, obs):
-        ammunition_info = []
-        item_type = "Ammunition"
+    def get_inventory_info(self, obs, ego_agent_info):
+        """
+        一次遍历背包，按类别解码所有物品，并为每个物品预先计算check_level的结果(usable)
+        """
+        categories = {item_type: [] for item_type in InventoryView.item_types}
         if obs.inventory:
             for item in obs.inventory.values:
-                item_id = item[0]
                 item_name = self.item_index_to_name[item[1]]
-                item_level = item[3]
-                if item_name in ["Whetstone", "Arrow", "Runes"]:
-                    is_equipped = bool(item[14])
-                    quantity = item[5]
-                    melee_attack = item[6]
-                    range_attack = item[7]
-                    mage_attack = item[8]
-                    ammunition = {
-                        "id": item_id,
-                        "name": item_name,
-                        "type": item_type,
-                        "level": item_level,
-                        "is_equipped": is_equipped,
-                        "quantity": quantity,
-                        "range_attack": range_attack,
-                        "melee_attack": melee_attack,
-                        "mage_attack": mage_attack,
-                    }
-                    ammunition_info.append(ammunition)
-        return ammunition_info
+                item_type = ITEM_NAME_TO_TYPE.get(item_name)
+                if item_type is None:
+                    continue
+                decoded_item = {
+                    "id": item[0],
+                    "name": item_name,
+                    "type": item_type,
+                    "level": item[3],
+                }
+                if item_type in ("Armor", "Tool"):
+                    decoded_item["is_equipped"] = bool(item[14])
+                    decoded_item["melee_defense"] = item[9]
+                    decoded_item["range_defense"] = item[10]
+                    decoded_item["mage_defense"] = item[11]
+                elif item_type == "Weapon":
+                    decoded_item["is_equipped"] = bool(item[14])
+                    decoded_item["melee_attack"] = item[6]
+                    decoded_item["range_attack"] = item[7]
+                    decoded_item["mage_attack"] = item[8]
+                elif item_type == "Ammunition":
+                    decoded_item["is_equipped"] = bool(item[14])
+                    decoded_item["quantity"] = item[5]
+                    decoded_item["range_attack"] = item[7]
+                    decoded_item["melee_attack"] = item[6]
+                    decoded_item["mage_attack"] = item[8]
+                elif item_name == "Ration":
+                    decoded_item["resource_restore"] = 50 + 5 * item[3]
+                else:
+                    decoded_item["health_restore"] = 50 + 5 * item[3]
+                decoded_item["usable"] = check_level(ego_agent_info, decoded_item)
+                categories[item_type].append(decoded_item)
+        return InventoryView(categories, len(obs.inventory.values))
 
-    def get_consumable_info(self, obs):
-        consumable_info = []
-        item_type = "Consumable"
-        if obs.inventory:
-            for item in obs.inventory.values:
-                item_id = item[0]
-                item_name = self.item_index_to_name[item[1]]
-                item_level = item[3]
-
-                if item_name in ["Ration", "Potion"]:
-                    consumable = {
-                        "id": item_id,
-                        "name": item_name,
-                        "type": item_type,
-                        "level": item_level,
-                    }
-                    if item_name == "Ration":
-                        consumable["resource_restore"] = 50 + 5 * item_level
-                    elif item_name == "Potion":
-                        consumable["health_restore"] = 50 + 5 * item_level
-                    consumable_info.append(consumable)
-        return consumable_info
+    def _get_section_fingerprints(self, obs, ego_agent_info, use_fog):
+        """
+        每个section依赖的输入。输入不变时section的结果也不变，增量模式下直接复用上一次的结果
+        """
+        position = (obs.agent.row, obs.agent.col)
+        fingerprints = {
+            # 资源数量只在agent移动或视野内tile被采集/刷新时变化
+            "resource": (position, obs.tiles.tobytes()),
+            # 可通行/可到达数只与位置有关(地形在episode内不变)，已访问数只在走到新tile时变化
+            "passible": (position, len(self.visited_positions)),
+            "entity": (position, obs.entities.values.tobytes() if obs.entities else b""),
+            # 物品集合或技能等级(影响usable)变化时才重新解码背包
+            "inventory": (
+                obs.inventory.values.tobytes() if obs.inventory else b"",
+                tuple(ego_agent_info[f"{skill}_level"] for skill in SKILL_NAMES),
+            ),
+        }
+        if use_fog:
+            min_r, max_r, min_c, max_c = self.get_area_partition(obs).bounds
+            fog_window = self.env.realm.fog_map[min_r : max_r + 1, min_c : max_c + 1]
+            fingerprints["fog"] = (position, fog_window.tobytes())
+        else:
+            fingerprints["fog"] = None
+        return fingerprints
+
+    def _get_section(self, section, fingerprints, compute):
+        if (
+            self.incremental
+            and self._last_state_sections is not None
+            and fingerprints[section] == self._section_fingerprints.get(section)
+        ):
+            self.section_stats[section]["reused"] += 1
+            return self._last_state_sections[section]
+        self.recomputed_sections.append(section)
+        self.section_stats[section]["recomputed"] += 1
+        if self.incremental:
+            self._section_fingerprints[section] = fingerprints[section]
+        return compute()
 
     def get_state_info(self, obs):
         state_info = {}
         state_info["agent"] = self.get_ego_agent_info(obs)
-        if self.config.DEATH_FOG_ONSET and obs.current_tick >= int(self.config.DEATH_FOG_ONSET):
-            state_info["fog"] = self.get_fog_info(obs)
-        else:
-            state_info["fog"] = None
-        state_info["resource"] = self.get_resource_info(obs)
-        state_info["passible"] = self.get_passible_info(obs)
-        state_info["entity"] = self.get_entity_info(obs)
-        state_info["armor"] = self.get_armor_info(obs)
-        state_info["weapon"] = self.get_weapon_info(obs)
-        state_info["tool"] = self.get_tool_info(obs)
-        state_info["ammunition"] = self.get_ammunition_info(obs)
-        state_info["consumable"] = self.get_consumable_info(obs)
-        state_info["capacity"] = len(obs.inventory.values)
+        use_fog = bool(self.config.DEATH_FOG_ONSET and obs.current_tick >= int(self.config.DEATH_FOG_ONSET))
+
+        self.recomputed_sections = ["agent"]
+        self.section_stats["agent"]["recomputed"] += 1
+        fingerprints = self._get_section_fingerprints(obs, state_info["agent"], use_fog) if self.incremental else {}
+        sections = {
+            "fog": self._get_section("fog", fingerprints, lambda: self.get_fog_info(obs) if use_fog else None),
+            "resource": self._get_section("resource", fingerprints, lambda: self.get_resource_info(obs)),
+            "passible": self._get_section("passible", fingerprints, lambda: self.get_passible_info(obs)),
+            "entity": self._get_section("entity", fingerprints, lambda: self.get_entity_info(obs)),
+            "inventory": self._get_section(
+                "inventory", fingerprints, lambda: self.get_inventory_info(obs, state_info["agent"])
+            ),
+        }
+        if self.incremental:
+            self._last_state_sections = sections
+
+        state_info["fog"] = sections["fog"]
+        state_info["resource"] = sections["resource"]
+        state_info["passible"] = sections["passible"]
+        state_info["entity"] = sections["entity"]
+        inventory = sections["inventory"]
+        state_info["inventory"] = inventory
+        state_info["armor"] = inventory.armor
+        state_info["weapon"] = inventory.weapon
+        state_info["tool"] = inventory.tool
+        state_info["ammunition"] = inventory.ammunition
+        state_info["consumable"] = inventory.consumable
+        state_info["capacity"] = inventory.capacity
 
         return state_info
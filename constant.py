@@ -41,6 +41,27 @@ ITEM_NAME_TO_ID = {
     "Potion": 17,
 }
 
+ITEM_NAME_TO_TYPE = {
+    "Hat": "Armor",
+    "Top": "Armor",
+    "Bottom": "Armor",
+    "Spear": "Weapon",
+    "Bow": "Weapon",
+    "Wand": "Weapon",
+    "Rod": "Tool",
+    "Gloves": "Tool",
+    "Pickaxe": "Tool",
+    "Axe": "Tool",
+    "Chisel": "Tool",
+    "Whetstone": "Ammunition",
+    "Arrow": "Ammunition",
+    "Runes": "Ammunition",
+    "Ration": "Consumable",
+    "Potion": "Consumable",
+}
+
+EQUIPMENT_TYPE = ("Armor", "Weapon", "Tool", "Ammunition")
+
 
 IMPASSIBLE_TILE = (
     "Water",
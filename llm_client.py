@@ -1,7 +1,97 @@
+import asyncio
 import json
 import re
+import threading
+import time
+import weakref
+
+import httpx
 import openai
 
+from utils.response_cache import build_cache_key
+from utils.retry_utils import RETRYABLE_ERRORS, RetryPolicy, classify_error, get_circuit_breaker, get_retry_after
+from utils.endpoint_pool import get_endpoint_pool, normalize_base_urls
+from utils.admission_control import estimate_prompt_tokens, estimate_request_tokens
+
+# 所有LLMClient共享的连接池参数。32个agent并发请求同一个vLLM server时，
+# 保持足够多的keep-alive连接，避免每次请求重新建立TCP连接
+HTTP_MAX_CONNECTIONS = 512
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 128
+HTTP_KEEPALIVE_EXPIRY = 120
+# 单次请求的超时(秒)。后端卡住时尽快按超时错误重试或计入熔断器，而不是等待SDK默认的600秒
+DEFAULT_REQUEST_TIMEOUT = 60.0
+HTTP_CONNECT_TIMEOUT = 5.0
+
+_client_registry_lock = threading.Lock()
+_sync_clients = {}
+# AsyncOpenAI的连接池绑定在event loop上，因此按loop分别缓存，loop被回收时自动清理
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _build_http_timeout(request_timeout):
+    return httpx.Timeout(request_timeout, connect=min(HTTP_CONNECT_TIMEOUT, request_timeout))
+
+
+def _build_http_limits():
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_shared_client(base_url, api_key, request_timeout=DEFAULT_REQUEST_TIMEOUT):
+    """
+    返回进程内按(base_url, api_key, request_timeout)共享的openai.OpenAI，所有LLMClient复用同一个连接池
+    """
+    key = (base_url, api_key, request_timeout)
+    with _client_registry_lock:
+        client = _sync_clients.get(key)
+        if client is None:
+            client = openai.OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                # 重试由BaseLLMClient按RetryPolicy和CircuitBreaker统一处理
+                max_retries=0,
+                timeout=_build_http_timeout(request_timeout),
+                http_client=openai.DefaultHttpxClient(limits=_build_http_limits()),
+            )
+            _sync_clients[key] = client
+    return client
+
+
+def get_shared_async_client(base_url, api_key, request_timeout=DEFAULT_REQUEST_TIMEOUT):
+    """
+    返回当前event loop中按(base_url, api_key, request_timeout)共享的openai.AsyncOpenAI，必须在event loop内调用
+    """
+    loop = asyncio.get_running_loop()
+    key = (base_url, api_key, request_timeout)
+    with _client_registry_lock:
+        loop_clients = _async_clients.setdefault(loop, {})
+        client = loop_clients.get(key)
+        if client is None:
+            client = openai.AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                # 重试由BaseLLMClient按RetryPolicy和CircuitBreaker统一处理
+                max_retries=0,
+                timeout=_build_http_timeout(request_timeout),
+                http_client=openai.DefaultAsyncHttpxClient(limits=_build_http_limits()),
+            )
+            loop_clients[key] = client
+    return client
+
+
+async def close_shared_async_clients():
+    """
+    关闭当前event loop中创建的所有AsyncOpenAI，在loop.close()之前调用
+    """
+    loop = asyncio.get_running_loop()
+    with _client_registry_lock:
+        loop_clients = _async_clients.pop(loop, {})
+    for client in loop_clients.values():
+        await client.close()
+
 
 def compare_dict_keys(d1, d2, ignore_case=True):
     def flatten_keys(d, parent_key="", ignore_case=True):
@@ -20,82 +110,694 @@ def compare_dict_keys(d1, d2, ignore_case=True):
     return keys1 == keys2
 
 
-class LLMClient:
+GUIDED_DECODING_MODES = ("guided_json", "guided_choice", "json_schema")
+
+# 4xx错误信息中出现这些参数名时，认为是server不支持约束解码
+GUIDED_DECODING_PARAMETERS = ("guided_json", "guided_choice", "response_format", "json_schema")
+# 错误信息没有指明参数、去掉约束后的重试也没有结果时，连续这么多次约束解码请求被4xx拒绝才关闭约束解码
+GUIDED_DECODING_MAX_FAILURES = 3
+
+_guided_decoding_lock = threading.Lock()
+# 不支持约束解码的后端(base_url, api_key, mode)，之后的请求退回普通解码
+_guided_decoding_unsupported = set()
+# 各后端连续被4xx拒绝的约束解码请求数，约束解码请求成功时清零
+_guided_decoding_failures = {}
+
+
+def build_json_schema(response_format, choice_space=None):
+    """
+    根据response_format生成json schema，choice字段限定为choice_space中的动作
+    """
+    properties = {}
+    for key, value in response_format.items():
+        if isinstance(value, dict):
+            properties[key] = build_json_schema(value)
+        elif key == "choice" and choice_space:
+            properties[key] = {"type": "string", "enum": list(choice_space)}
+        else:
+            properties[key] = {"type": "string"}
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(response_format.keys()),
+        "additionalProperties": False,
+    }
+
+
+def parse_response(response, response_format=None, choice_space=None):
+    """
+    从LLM的原始回复中解析出json，检查字段和choice是否合法，不合法时返回None
+    """
+    try:
+        json_part = re.search(r"\{\s*[\s\S]*?\s*\}", response)
+        json_str = json_part.group(0)
+        response = json.loads(json_str)
+        if response_format:
+            assert compare_dict_keys(response, response_format)
+        if choice_space:
+            assert response["choice"] in choice_space
+    except Exception:
+        return None
+    return response
+
+
+class JSONStreamParser:
+    """
+    增量扫描流式回复，第一次出现满足response_format和choice_space的完整json对象时返回True。
+    只跟踪花括号深度和字符串状态，每个字符只扫描一次
+    """
+
+    def __init__(self, response_format=None, choice_space=None):
+        self.response_format = response_format
+        self.choice_space = choice_space
+        self.text = ""
+        # 第一个合法json对象在text中的范围[start, end)
+        self.start = None
+        self.end = None
+        self._pos = 0
+        self._depth = 0
+        self._start = None
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, delta):
+        self.text += delta
+        text = self.text
+        for i in range(self._pos, len(text)):
+            char = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"' and self._depth > 0:
+                self._in_string = True
+            elif char == "{":
+                if self._depth == 0:
+                    self._start = i
+                self._depth += 1
+            elif char == "}" and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0 and parse_response(text[self._start : i + 1], self.response_format, self.choice_space):
+                    self.start = self._start
+                    self.end = i + 1
+                    self._pos = i + 1
+                    return True
+        self._pos = len(text)
+        return False
+
+
+class StreamCollector:
+    """
+    累积一次流式请求的回复、token用量和耗时。
+    time_to_first_token: 发出请求到收到第一段内容; time_to_json: 发出请求到出现合法的json(之后立即停止生成)
+    """
+
+    def __init__(self, response_format=None, choice_space=None):
+        self.start_time = time.time()
+        self.parser = JSONStreamParser(response_format, choice_space) if response_format else None
+        self.pieces = []
+        self.usage = None
+        self.completion_chunks = 0
+        self.time_to_first_token = None
+        self.time_to_json = None
+
+    def add(self, chunk):
+        """
+        处理一个chunk，返回True表示已经得到合法的json，应停止接收
+        """
+        if getattr(chunk, "usage", None) is not None:
+            self.usage = chunk.usage
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            return False
+        delta = chunk.choices[0].delta.content
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.time() - self.start_time
+        self.completion_chunks += 1
+        self.pieces.append(delta)
+        if self.parser is not None and self.parser.feed(delta):
+            self.time_to_json = time.time() - self.start_time
+            return True
+        return False
+
+    def get_content(self):
+        if self.time_to_json is not None:
+            # 只返回校验过的json对象，之前不合法的对象和说明文字不返回
+            return self.parser.text[self.parser.start : self.parser.end]
+        return "".join(self.pieces).strip()
+
+    def get_usage(self, request):
+        """
+        提前停止时server不会发送最后的usage，vLLM的continuous_usage_stats会在每个chunk中附带累计用量；
+        都没有时按prompt长度和收到的chunk数估计
+        """
+        if self.usage is not None:
+            prompt_tokens = int(self.usage.prompt_tokens)
+            completion_tokens = int(self.usage.completion_tokens)
+        else:
+            prompt_tokens = estimate_prompt_tokens(request)
+            completion_tokens = self.completion_chunks
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def get_timing(self):
+        return {
+            "time_to_first_token": self.time_to_first_token,
+            "time_to_json": self.time_to_json,
+            "early_stop": self.time_to_json is not None,
+        }
+
+
+class BaseLLMClient:
+    """
+    同步和异步client共享的请求参数、token统计和解析逻辑。
+    每个agent持有一个轻量的client用于统计自己的token，底层的连接池由同一进程内的所有client共享
+    """
 
     def __init__(
         self,
-        # base_url="http://100.98.11.145:8000/v1",
         base_url="http://localhost:8000/v1",
         api_key="llama",
         model="llama",
         enable_thinking=False,
         max_try_time=3,
+        response_cache=None,
+        cassette=None,
+        cassette_agent=None,
+        retry_policy=None,
+        guided_decoding=None,
+        routing_policy="least_outstanding",
+        admission_controller=None,
+        stream=False,
+        request_timeout=DEFAULT_REQUEST_TIMEOUT,
     ):
+        assert guided_decoding is None or guided_decoding in GUIDED_DECODING_MODES, f"Invalid guided decoding: {guided_decoding}"
+        # base_url可以是多个推理服务副本的url列表，请求由EndpointPool在副本之间负载均衡
+        self.base_url = normalize_base_urls(base_url)
+        self.api_key = api_key
         self.model = model
-        self.client = openai.OpenAI(
-            api_key=api_key,
-            base_url=base_url,
-        )
         self.enable_thinking = enable_thinking
         self.max_try_time = max_try_time
+        # 可选的ResponseCache(utils/response_cache.py)，命中时generate不再请求server
+        self.response_cache = response_cache
+        # 可选的Cassette(utils/cassette.py)，record模式录制每次请求的原始回复，replay模式不连接server直接回放
+        self.cassette = cassette
+        # cassette中这个client所属agent的标识。不同agent的相同请求分别录制，回放时不受agent之间请求先后顺序的影响
+        self.cassette_agent = cassette_agent
+        # 请求失败(429/5xx/超时/连接错误)时按retry_policy退避重试，连续失败过多时共享的熔断器打开，直接拒绝请求
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.circuit_breaker = get_circuit_breaker(self.base_url, api_key)
+        self.endpoint_pool = get_endpoint_pool(self.base_url, api_key, policy=routing_policy)
+        # 约束解码: guided_json/guided_choice通过extra_body传给vLLM，json_schema使用OpenAI标准的response_format
+        self.guided_decoding = guided_decoding
+        # 可选的AdmissionController(utils/admission_control.py)，所有agent共享，限制并发请求数和估计的token/s
+        self.admission_controller = admission_controller
+        # 流式请求: 出现合法的json后立即停止生成，并记录每次请求的首token时间和得到json的时间
+        self.stream = stream
+        self.stream_timings = []
+        self.request_timeout = request_timeout
+        self.transport_retries = 0
+        self.request_failures = 0
+        self.parse_failures = 0
+        self.shed_requests = 0
         self.prompt_tokens = 0
         self.completion_tokens = 0
         self.total_tokens = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
 
     def reset_token_count(self):
         self.prompt_tokens = 0
         self.completion_tokens = 0
         self.total_tokens = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.stream_timings = []
 
     def get_token_usage(self):
         return {
             "prompt_tokens": self.prompt_tokens,
             "completion_tokens": self.completion_tokens,
             "total_tokens": self.total_tokens,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
         }
 
-    def get_response(self, message):
-        # return
-        try:
-            if "gpt" in self.model:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=message,
-                    temperature=0.1,
-                )
+    def get_retry_stats(self):
+        return {
+            "transport_retries": self.transport_retries,
+            "request_failures": self.request_failures,
+            "parse_failures": self.parse_failures,
+            "shed_requests": self.shed_requests,
+        }
+
+    def is_shedding(self):
+        """
+        熔断器打开时返回True，调用方应直接退回随机/默认动作而不是等待请求失败
+        """
+        return not self.is_replaying and self.circuit_breaker.is_open()
+
+    def lookup_cache(self, message, response_format=None, choice_space=None):
+        """
+        返回(cache_key, 缓存的回复)。未开启缓存时cache_key为None
+        """
+        if self.response_cache is None:
+            return None, None
+        cache_key = build_cache_key(self.build_request(message), response_format, choice_space)
+        response = self.response_cache.get(cache_key)
+        if response is None:
+            self.cache_misses += 1
+        else:
+            self.cache_hits += 1
+        return cache_key, response
+
+    def store_cache(self, cache_key, response):
+        if cache_key is not None:
+            self.response_cache.put(cache_key, response)
+
+    def use_guided_decoding(self, response_format):
+        if self.guided_decoding is None or not response_format:
+            return False
+        with _guided_decoding_lock:
+            return (self.base_url, self.api_key, self.guided_decoding) not in _guided_decoding_unsupported
+
+    def build_request(self, message, response_format=None, choice_space=None):
+        request = {
+            "model": self.model,
+            "messages": message,
+            "temperature": 0.1,
+        }
+        if "gpt" not in self.model:
+            request["extra_body"] = {"chat_template_kwargs": {"enable_thinking": self.enable_thinking}}
+        if self.use_guided_decoding(response_format):
+            if self.guided_decoding == "json_schema":
+                request["response_format"] = {
+                    "type": "json_schema",
+                    "json_schema": {"name": "response", "schema": build_json_schema(response_format, choice_space)},
+                }
+            elif self.guided_decoding == "guided_choice" and choice_space:
+                request.setdefault("extra_body", {})["guided_choice"] = list(choice_space)
             else:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=message,
-                    temperature=0.1,
-                    extra_body={"chat_template_kwargs": {"enable_thinking": self.enable_thinking}},
+                request.setdefault("extra_body", {})["guided_json"] = build_json_schema(response_format, choice_space)
+        return request
+
+    def is_guided_request(self, request):
+        extra_body = request.get("extra_body", {})
+        return "response_format" in request or "guided_json" in extra_body or "guided_choice" in extra_body
+
+    def is_guided_client_error(self, request, error):
+        return self.is_guided_request(request) and classify_error(error) == "client_error"
+
+    def disable_guided_decoding(self, reason):
+        print(f"{', '.join(self.base_url)}: {reason}, fall back to unconstrained decoding")
+        key = (self.base_url, self.api_key, self.guided_decoding)
+        with _guided_decoding_lock:
+            _guided_decoding_unsupported.add(key)
+            _guided_decoding_failures.pop(key, None)
+
+    def record_guided_error(self, error):
+        """
+        约束解码请求被4xx拒绝。错误信息指明了约束解码的参数时直接关闭约束解码，否则记一次失败，
+        连续失败达到GUIDED_DECODING_MAX_FAILURES次时关闭。之后都以普通请求重试这一次请求，结果交给record_guided_retry
+        """
+        self.circuit_breaker.record_success()
+        message = str(error).lower()
+        for parameter in GUIDED_DECODING_PARAMETERS:
+            if parameter in message:
+                self.disable_guided_decoding(f"server rejected {parameter} ({error})")
+                return
+        key = (self.base_url, self.api_key, self.guided_decoding)
+        with _guided_decoding_lock:
+            failures = _guided_decoding_failures[key] = _guided_decoding_failures.get(key, 0) + 1
+        if failures >= GUIDED_DECODING_MAX_FAILURES:
+            self.disable_guided_decoding(f"{failures} consecutive {self.guided_decoding} requests rejected ({error})")
+        else:
+            print(f"{self.model} {self.guided_decoding} request rejected ({error}), retry without it")
+
+    def record_guided_retry(self, guided_error, error=None):
+        """
+        约束解码被拒绝后普通请求重试的结果: 成功说明server不支持约束解码，关闭约束解码；
+        同样被4xx拒绝说明是请求本身的问题，之前的失败不计入
+        """
+        key = (self.base_url, self.api_key, self.guided_decoding)
+        if error is None:
+            with _guided_decoding_lock:
+                disabled = key in _guided_decoding_unsupported
+            if not disabled:
+                self.disable_guided_decoding(
+                    f"request rejected with {self.guided_decoding} succeeded without it ({guided_error})"
                 )
+        elif classify_error(error) == "client_error":
+            with _guided_decoding_lock:
+                if _guided_decoding_failures.get(key):
+                    _guided_decoding_failures[key] -= 1
+
+    def record_guided_success(self):
+        key = (self.base_url, self.api_key, self.guided_decoding)
+        with _guided_decoding_lock:
+            _guided_decoding_failures.pop(key, None)
 
-            usage = response.usage
-            self.prompt_tokens += int(usage.prompt_tokens)
-            self.completion_tokens += int(usage.completion_tokens)
-            self.total_tokens += int(usage.total_tokens)
-            return response.choices[0].message.content.strip()
-        except Exception as e:
-            print(f"{self.model} API call failed: {e}")
+    @property
+    def is_replaying(self):
+        return self.cassette is not None and self.cassette.mode == "replay"
+
+    def add_usage(self, usage):
+        self.prompt_tokens += usage["prompt_tokens"]
+        self.completion_tokens += usage["completion_tokens"]
+        self.total_tokens += usage["total_tokens"]
+
+    def read_response(self, response):
+        """
+        返回非流式回复的(content, usage)
+        """
+        usage = {
+            "prompt_tokens": int(response.usage.prompt_tokens),
+            "completion_tokens": int(response.usage.completion_tokens),
+            "total_tokens": int(response.usage.total_tokens),
+        }
+        return response.choices[0].message.content.strip(), usage
+
+    def get_stream_kwargs(self):
+        stream_options = {"include_usage": True}
+        if "gpt" not in self.model:
+            # vLLM在每个chunk中附带累计的token用量，提前停止时也能得到准确的用量
+            stream_options["continuous_usage_stats"] = True
+        return {"stream": True, "stream_options": stream_options}
+
+    def read_stream(self, request, collector):
+        """
+        返回流式回复的(content, usage)，并记录这次请求的耗时
+        """
+        self.stream_timings.append(collector.get_timing())
+        return collector.get_content(), collector.get_usage(request)
+
+    def record_response(self, request, content, usage):
+        self.add_usage(usage)
+        if self.cassette is not None:
+            self.cassette.record(request, content, usage, agent=self.cassette_agent)
+        return content
+
+    def record_failed_request(self, request):
+        self.request_failures += 1
+        if self.cassette is not None:
+            self.cassette.record(request, None, agent=self.cassette_agent)
+
+    def shed_request(self, request):
+        self.shed_requests += 1
+        self.record_failed_request(request)
+        return None
+
+    def handle_error(self, request, error, attempt):
+        """
+        处理一次请求异常，返回重试前需要等待的秒数；不应重试时返回None
+        """
+        error_type = classify_error(error)
+        print(f"{self.model} API call failed ({error_type}): {error}")
+        if error_type == "client_error":
+            # 4xx说明server能正常回复，是请求本身的问题，重试没有意义
+            self.circuit_breaker.record_success()
+        else:
+            self.circuit_breaker.record_failure()
+        if error_type not in RETRYABLE_ERRORS or attempt >= self.retry_policy.max_retries:
+            self.record_failed_request(request)
+            return None
+        self.transport_retries += 1
+        return self.retry_policy.get_delay(attempt, get_retry_after(error))
+
+    def admit(self, request):
+        """
+        等待准入控制放行，返回的ticket在请求结束后交给release_admission；未开启准入控制时返回None
+        """
+        if self.admission_controller is None:
+            return None
+        # 按client区分agent，每个agent持有自己的client
+        return self.admission_controller.acquire(id(self), estimate_request_tokens(request))
+
+    async def admit_async(self, request):
+        if self.admission_controller is None:
+            return None
+        return await self.admission_controller.acquire_async(id(self), estimate_request_tokens(request))
+
+    def release_admission(self, ticket, used_tokens=None):
+        if ticket is not None:
+            self.admission_controller.release(ticket, used_tokens)
+
+    def parse_or_count(self, raw_response, response_format=None, choice_space=None):
+        if (
+            self.guided_decoding == "guided_choice"
+            and choice_space
+            and response_format
+            and raw_response.strip() in choice_space
+        ):
+            # guided_choice只生成动作本身，补全成response_format的结构
+            response = {key: "" for key in response_format}
+            response["choice"] = raw_response.strip()
+            return response
+        response = parse_response(raw_response, response_format, choice_space)
+        if response is None:
+            self.parse_failures += 1
+        return response
+
+    def replay_response(self, request):
+        entry = self.cassette.play(request, agent=self.cassette_agent)
+        if entry is None or entry["content"] is None:
             return None
+        self.add_usage(entry["usage"])
+        return entry["content"]
+
+
+class LLMClient(BaseLLMClient):
+
+    def __init__(
+        self,
+        # base_url="http://100.98.11.145:8000/v1",
+        base_url="http://localhost:8000/v1",
+        api_key="llama",
+        model="llama",
+        enable_thinking=False,
+        max_try_time=3,
+        response_cache=None,
+        cassette=None,
+        cassette_agent=None,
+        retry_policy=None,
+        guided_decoding=None,
+        routing_policy="least_outstanding",
+        admission_controller=None,
+        stream=False,
+        request_timeout=DEFAULT_REQUEST_TIMEOUT,
+    ):
+        super().__init__(
+            base_url=base_url,
+            api_key=api_key,
+            model=model,
+            enable_thinking=enable_thinking,
+            max_try_time=max_try_time,
+            response_cache=response_cache,
+            cassette=cassette,
+            cassette_agent=cassette_agent,
+            retry_policy=retry_policy,
+            guided_decoding=guided_decoding,
+            routing_policy=routing_policy,
+            admission_controller=admission_controller,
+            stream=stream,
+            request_timeout=request_timeout,
+        )
+
+    def get_response(self, message, response_format=None, choice_space=None):
+        # return
+        request = self.build_request(message, response_format, choice_space)
+        if self.is_replaying:
+            return self.replay_response(request)
+        attempt = 0
+        # 约束解码请求被4xx拒绝时的异常，之后以普通请求重试
+        guided_error = None
+        while True:
+            if not self.circuit_breaker.allow_request():
+                return self.shed_request(request)
+            ticket = self.admit(request)
+            endpoint = self.endpoint_pool.acquire()
+            start_time = time.time()
+            try:
+                client = get_shared_client(endpoint.base_url, self.api_key, self.request_timeout)
+                if self.stream:
+                    content, usage = self.stream_response(client, request, response_format, choice_space)
+                else:
+                    content, usage = self.read_response(client.chat.completions.create(**request))
+            except Exception as e:
+                self.endpoint_pool.release(endpoint, time.time() - start_time, classify_error(e))
+                self.release_admission(ticket)
+                if guided_error is None and self.is_guided_client_error(request, e):
+                    guided_error = e
+                    self.record_guided_error(e)
+                    request = self.build_request(message)
+                    continue
+                if guided_error is not None:
+                    self.record_guided_retry(guided_error, e)
+                    guided_error = None
+                delay = self.handle_error(request, e, attempt)
+                if delay is None:
+                    return None
+                time.sleep(delay)
+                attempt += 1
+            else:
+                self.endpoint_pool.release(endpoint, time.time() - start_time)
+                self.release_admission(ticket, usage["total_tokens"])
+                self.circuit_breaker.record_success()
+                if guided_error is not None:
+                    self.record_guided_retry(guided_error)
+                elif self.is_guided_request(request):
+                    self.record_guided_success()
+                return self.record_response(request, content, usage)
+
+    def stream_response(self, client, request, response_format=None, choice_space=None):
+        collector = StreamCollector(response_format, choice_space)
+        stream = client.chat.completions.create(**request, **self.get_stream_kwargs())
+        try:
+            for chunk in stream:
+                if collector.add(chunk):
+                    break
+        finally:
+            # 提前停止时关闭连接，server随之中止生成
+            stream.close()
+        return self.read_stream(request, collector)
 
     def generate(self, message, response_format=None, choice_space=None):
+        cache_key, response = self.lookup_cache(message, response_format, choice_space)
+        if response is not None:
+            return response
         try_time = 0
         while try_time <= self.max_try_time:
-            response = self.get_response(message)
+            raw_response = self.get_response(message, response_format, choice_space)
             # print("Raw response:", response)
+            if raw_response is None:
+                # 请求失败已经在get_response里退避重试过，或者被熔断，不再重新生成
+                return None
+            response = self.parse_or_count(raw_response, response_format, choice_space)
+            if response is None:
+                try_time += 1
+            else:
+                self.store_cache(cache_key, response)
+                return response
+        return None
+
+
+class AsyncLLMClient(BaseLLMClient):
+    """
+    基于openai.AsyncOpenAI的client，所有agent的请求在同一个event loop上并发。
+    AsyncOpenAI内部的连接池绑定在event loop上，所以请求时才按当前loop取共享的AsyncOpenAI，
+    loop结束前需要调用close_shared_async_clients()
+    """
+
+    def __init__(
+        self,
+        base_url="http://localhost:8000/v1",
+        api_key="llama",
+        model="llama",
+        enable_thinking=False,
+        max_try_time=3,
+        response_cache=None,
+        cassette=None,
+        cassette_agent=None,
+        retry_policy=None,
+        guided_decoding=None,
+        routing_policy="least_outstanding",
+        admission_controller=None,
+        stream=False,
+        request_timeout=DEFAULT_REQUEST_TIMEOUT,
+    ):
+        super().__init__(
+            base_url=base_url,
+            api_key=api_key,
+            model=model,
+            enable_thinking=enable_thinking,
+            max_try_time=max_try_time,
+            response_cache=response_cache,
+            cassette=cassette,
+            cassette_agent=cassette_agent,
+            retry_policy=retry_policy,
+            guided_decoding=guided_decoding,
+            routing_policy=routing_policy,
+            admission_controller=admission_controller,
+            stream=stream,
+            request_timeout=request_timeout,
+        )
+
+    async def get_response(self, message, response_format=None, choice_space=None):
+        request = self.build_request(message, response_format, choice_space)
+        if self.is_replaying:
+            return self.replay_response(request)
+        attempt = 0
+        # 约束解码请求被4xx拒绝时的异常，之后以普通请求重试
+        guided_error = None
+        while True:
+            if not self.circuit_breaker.allow_request():
+                return self.shed_request(request)
+            ticket = await self.admit_async(request)
+            endpoint = self.endpoint_pool.acquire()
+            start_time = time.time()
             try:
-                json_part = re.search(r"\{\s*[\s\S]*?\s*\}", response)
-                json_str = json_part.group(0)
-                response = json.loads(json_str)
-                if response_format:
-                    assert compare_dict_keys(response, response_format)
-                if choice_space:
-                    assert response["choice"] in choice_space
-            except Exception:
+                client = get_shared_async_client(endpoint.base_url, self.api_key, self.request_timeout)
+                if self.stream:
+                    content, usage = await self.stream_response(client, request, response_format, choice_space)
+                else:
+                    content, usage = self.read_response(await client.chat.completions.create(**request))
+            except Exception as e:
+                self.endpoint_pool.release(endpoint, time.time() - start_time, classify_error(e))
+                self.release_admission(ticket)
+                if guided_error is None and self.is_guided_client_error(request, e):
+                    guided_error = e
+                    self.record_guided_error(e)
+                    request = self.build_request(message)
+                    continue
+                if guided_error is not None:
+                    self.record_guided_retry(guided_error, e)
+                    guided_error = None
+                delay = self.handle_error(request, e, attempt)
+                if delay is None:
+                    return None
+                await asyncio.sleep(delay)
+                attempt += 1
+            else:
+                self.endpoint_pool.release(endpoint, time.time() - start_time)
+                self.release_admission(ticket, usage["total_tokens"])
+                self.circuit_breaker.record_success()
+                if guided_error is not None:
+                    self.record_guided_retry(guided_error)
+                elif self.is_guided_request(request):
+                    self.record_guided_success()
+                return self.record_response(request, content, usage)
+
+    async def stream_response(self, client, request, response_format=None, choice_space=None):
+        collector = StreamCollector(response_format, choice_space)
+        stream = await client.chat.completions.create(**request, **self.get_stream_kwargs())
+        try:
+            async for chunk in stream:
+                if collector.add(chunk):
+                    break
+        finally:
+            await stream.close()
+        return self.read_stream(request, collector)
+
+    async def generate(self, message, response_format=None, choice_space=None):
+        # sqlite的读写在毫秒级以内，直接在event loop线程里执行
+        cache_key, response = self.lookup_cache(message, response_format, choice_space)
+        if response is not None:
+            return response
+        try_time = 0
+        while try_time <= self.max_try_time:
+            raw_response = await self.get_response(message, response_format, choice_space)
+            if raw_response is None:
+                return None
+            response = self.parse_or_count(raw_response, response_format, choice_space)
+            if response is None:
                 try_time += 1
             else:
+                self.store_cache(cache_key, response)
                 return response
         return None
 
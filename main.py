@@ -1,6 +1,8 @@
 import argparse
+import asyncio
 import concurrent.futures
 import os
+import random
 import sys
 
 current_dir = os.path.abspath(__file__)
@@ -43,6 +45,11 @@ from task.create_task import (
 
 from utils.multi_task_support import apply_multi_task_support
 from utils.event_record_support import apply_event_record_support
+from utils.path_utils import get_pathfinding_cache
+from llm_client import close_shared_async_clients
+from utils.cassette import close_cassettes
+from utils.terrain_utils import build_terrain_index
+from utils.prefix_tracker import PrefixTracker
 
 import openai
 import os
@@ -237,6 +244,25 @@ def create_players(
     enable_llm_thinking,
     max_execute_step,
     max_verify_time,
+    incremental_state,
+    use_async_llm,
+    response_cache_path,
+    response_cache_max_mb,
+    cassette_path,
+    cassette_mode,
+    guided_decoding,
+    routing_policy,
+    max_concurrent_requests,
+    max_tokens_per_sec,
+    stream_responses,
+    request_timeout,
+    prompt_layout,
+    prefix_tracker,
+    serialization,
+    count_state_tokens,
+    prompt_token_budget,
+    decision_session,
+    session_max_turns,
     debug,
 ):
     players = []
@@ -257,6 +283,26 @@ def create_players(
             enable_llm_thinking=enable_llm_thinking,
             max_execute_step=max_execute_step,
             max_verify_time=max_verify_time,
+            incremental_state=incremental_state,
+            use_async_llm=use_async_llm,
+            response_cache_path=response_cache_path,
+            response_cache_max_mb=response_cache_max_mb,
+            cassette_path=cassette_path,
+            cassette_mode=cassette_mode,
+            agent_id=i + 1,
+            guided_decoding=guided_decoding,
+            routing_policy=routing_policy,
+            max_concurrent_requests=max_concurrent_requests,
+            max_tokens_per_sec=max_tokens_per_sec,
+            stream_responses=stream_responses,
+            request_timeout=request_timeout,
+            prompt_layout=prompt_layout,
+            prefix_tracker=prefix_tracker,
+            serialization=serialization,
+            count_state_tokens=count_state_tokens,
+            prompt_token_budget=prompt_token_budget,
+            decision_session=decision_session,
+            session_max_turns=session_max_turns,
             debug=debug,
         )
         players.append(player)
@@ -275,6 +321,97 @@ def collect_actions(players, alive_players, env, step):
     return {a: action_seq[i] for i, a in enumerate(alive_players)}
 
 
+async def collect_actions_async(players, alive_players, env, step):
+    action_seq = await asyncio.gather(
+        *[players[player_id - 1].act_async(env.obs[player_id], step) for player_id in alive_players]
+    )
+    return {a: action_seq[i] for i, a in enumerate(alive_players)}
+
+
+def build_state_section_stats(players, acted_players):
+    """
+    统计每个state section的累计重算/复用次数，以及本tick行动的player中重算该section的数量
+    """
+    section_stats = {}
+    for section in StateManager.sections:
+        section_stats[section] = {
+            "recomputed": sum(player.state_manager.section_stats[section]["recomputed"] for player in players),
+            "reused": sum(player.state_manager.section_stats[section]["reused"] for player in players),
+            "recomputed_this_tick": sum(
+                section in players[player_id - 1].state_manager.recomputed_sections for player_id in acted_players
+            ),
+        }
+    return section_stats
+
+
+def build_stream_stats(players):
+    """
+    汇总所有player流式请求的首token时间(ttft)和得到合法json的时间
+    """
+    timings = [timing for player in players for timing in player.llm_client.stream_timings]
+    ttft = [timing["time_to_first_token"] for timing in timings if timing["time_to_first_token"] is not None]
+    time_to_json = [timing["time_to_json"] for timing in timings if timing["time_to_json"] is not None]
+    return {
+        "requests": len(timings),
+        "early_stops": sum(timing["early_stop"] for timing in timings),
+        "mean_ttft": float(np.mean(ttft)) if ttft else None,
+        "p95_ttft": float(np.percentile(ttft, 95)) if ttft else None,
+        "mean_time_to_json": float(np.mean(time_to_json)) if time_to_json else None,
+        "p95_time_to_json": float(np.percentile(time_to_json, 95)) if time_to_json else None,
+    }
+
+
+def build_state_token_stats(players):
+    """
+    所有player的prompt中, 静态规则和各个状态部分的平均token数
+    """
+    prompts = sum(player.perceive_module.section_token_prompts for player in players)
+    if not prompts:
+        return {}
+    totals = {}
+    for player in players:
+        for section, tokens in player.perceive_module.section_token_totals.items():
+            totals[section] = totals.get(section, 0) + tokens
+    section_tokens = {section: tokens / prompts for section, tokens in totals.items()}
+    section_tokens["prompts"] = prompts
+    return section_tokens
+
+
+def build_prompt_budget_stats(players):
+    """
+    所有player的action/verify模块按token预算截断的次数和丢弃的条目数
+    """
+    budget_stats = {}
+    for module_name in ("action", "verify"):
+        totals = {}
+        for player in players:
+            module = getattr(player, f"{module_name}_module")
+            for key, value in module.budget_stats.items():
+                totals[key] = totals.get(key, 0) + value
+        budget_stats[module_name] = totals
+    return budget_stats
+
+
+def build_decision_session_stats(players):
+    """
+    所有player的多轮对话决策: 轮数、重置次数，以及发送的状态变化与完整状态的平均长度(完整状态只在count_state_tokens开启时统计)
+    """
+    totals = {}
+    for player in players:
+        for key, value in player.session.get_stats().items():
+            totals[key] = totals.get(key, 0) + value
+    state_updates = totals["state_updates"]
+    measured_updates = totals["measured_updates"]
+    return {
+        "turns": totals["turns"],
+        "resets": totals["resets"],
+        "full_state_updates": totals["full_state_updates"],
+        "state_updates": state_updates,
+        "mean_update_chars": totals["update_chars"] / state_updates if state_updates else None,
+        "mean_full_state_chars": totals["full_state_chars"] / measured_updates if measured_updates else None,
+    }
+
+
 def update_task_progress(task_progress, env, step):
     task_mean = {}
     for agent_id in env.agents:
@@ -315,6 +452,16 @@ def build_game_status(task_mean, step, start_time, end_time, terminated, truncat
     game_status["prompt_tokens"] = float(np.sum([player.token_usage["prompt_tokens"] for player in players]))
     game_status["completion_tokens"] = float(np.sum([player.token_usage["completion_tokens"] for player in players]))
     game_status["total_tokens"] = float(np.sum([player.token_usage["total_tokens"] for player in players]))
+    game_status["cache_hits"] = int(np.sum([player.token_usage["cache_hits"] for player in players]))
+    game_status["cache_misses"] = int(np.sum([player.token_usage["cache_misses"] for player in players]))
+    for key in ["transport_retries", "request_failures", "parse_failures", "shed_requests"]:
+        game_status[key] = int(np.sum([player.retry_stats[key] for player in players]))
+    game_status["circuit_breaker"] = players[0].llm_client.circuit_breaker.get_stats()
+    game_status["endpoints"] = players[0].llm_client.endpoint_pool.get_stats()
+    if players[0].llm_client.stream:
+        game_status["streaming"] = build_stream_stats(players)
+    if players[0].llm_client.admission_controller is not None:
+        game_status["admission"] = players[0].llm_client.admission_controller.get_stats()
 
     return game_status, all_agent_dead, game_end
 
@@ -341,6 +488,7 @@ def run_episode(
     model_name,
     horizon,
     replay_save_interval,
+    seed,
     run_task,
     use_information_reduction,
     allow_give_action,
@@ -348,6 +496,24 @@ def run_episode(
     enable_llm_thinking,
     max_execute_step,
     max_verify_time,
+    incremental_state,
+    use_async_llm,
+    response_cache_path,
+    response_cache_max_mb,
+    cassette_path,
+    cassette_mode,
+    guided_decoding,
+    routing_policy,
+    max_concurrent_requests,
+    max_tokens_per_sec,
+    stream_responses,
+    request_timeout,
+    prompt_layout,
+    serialization,
+    count_state_tokens,
+    prompt_token_budget,
+    decision_session,
+    session_max_turns,
     debug,
     run_survive,
     use_strategy,
@@ -358,7 +524,11 @@ def run_episode(
     paths = create_episode_paths(file_save_path, episode)
     map_config.PATH_MAPS = paths["map_path"]
 
-    env = nmmo.Env(config=map_config)
+    episode_seed = None if seed is None else seed + episode
+    if episode_seed is not None:
+        random.seed(episode_seed)
+        np.random.seed(episode_seed)
+    env = nmmo.Env(config=map_config, seed=episode_seed)
     event_manager = EventManager(player_num)
 
     reset_strategy_managers_for_episode(
@@ -373,8 +543,12 @@ def run_episode(
     env.tasks = build_env_tasks(goals, env)
     env.reset()
     env._map_task_to_agent()
+    # 每个episode只构建一次静态地形索引, 所有StateManager和ActionManager共享
+    build_terrain_index(env.realm)
 
     replay_helper = FileReplayHelper()
+    # 统计所有player各模块prompt的公共前缀长度, 衡量推理服务前缀缓存的可复用程度
+    prefix_tracker = PrefixTracker()
     players = create_players(
         player_num,
         paths["prompt_path"],
@@ -391,6 +565,25 @@ def run_episode(
         enable_llm_thinking,
         max_execute_step,
         max_verify_time,
+        incremental_state,
+        use_async_llm,
+        response_cache_path,
+        response_cache_max_mb,
+        cassette_path,
+        cassette_mode,
+        guided_decoding,
+        routing_policy,
+        max_concurrent_requests,
+        max_tokens_per_sec,
+        stream_responses,
+        request_timeout,
+        prompt_layout,
+        prefix_tracker,
+        serialization,
+        count_state_tokens,
+        prompt_token_budget,
+        decision_session,
+        session_max_turns,
         debug,
     )
 
@@ -401,9 +594,15 @@ def run_episode(
     env.realm.record_replay(replay_helper)
     replay_helper.reset()
 
+    # 异步模式下每个episode使用一个event loop, 所有player的LLM请求在这个loop上并发
+    loop = asyncio.new_event_loop() if use_async_llm else None
+
     start_time = time.time()
     for step in range(1, horizon + 1):  # 使用命令行参数中的步数
-        actions = collect_actions(players, alive_players, env, step)
+        if use_async_llm:
+            actions = loop.run_until_complete(collect_actions_async(players, alive_players, env, step))
+        else:
+            actions = collect_actions(players, alive_players, env, step)
         obs, rewards, terminated, truncated, infos = env.step(actions)
         current_events = env.realm.event_log.get_data(tick=env.realm.tick)
         record = event_manager.update_record(current_events)
@@ -425,8 +624,19 @@ def run_episode(
             players,
         )
 
+        game_status["state_sections"] = build_state_section_stats(players, alive_players)
+        game_status["prompt_prefix"] = prefix_tracker.get_stats()
+        if count_state_tokens:
+            game_status["state_tokens"] = build_state_token_stats(players)
+        if prompt_token_budget and any(budget is not None for budget in prompt_token_budget.values()):
+            game_status["prompt_budget"] = build_prompt_budget_stats(players)
+        if decision_session:
+            game_status["decision_session"] = build_decision_session_stats(players)
+        if cassette_mode:
+            game_status["cassette"] = players[0].llm_client.cassette.get_stats()
         alive_players = update_alive_players(terminated, players, env, step)
         game_status["alive_player_num"] = len(alive_players)
+        game_status["pathfinding_cache"] = get_pathfinding_cache(env.realm).get_stats()
 
         if all_agent_dead or game_end or (run_task and all_task_completed):
             if all_agent_dead:
@@ -455,6 +665,9 @@ def run_episode(
         pbar.update(1)
 
     replay_helper.save(f"{paths['replay_path']}/finish_{model_name}", compress=True)
+    if use_async_llm:
+        loop.run_until_complete(close_shared_async_clients())
+        loop.close()
 
 
 def main(args):
@@ -488,6 +701,7 @@ def main(args):
     model_name = config["agent"]["model_name"]
     enable_llm_thinking = config["agent"]["enable_llm_thinking"]
     replay_save_interval = config["experiment"]["replay_save_interval"]
+    seed = config["experiment"]["seed"]  # 固定随机种子, 回放录制的LLM回复时需要与录制时一致
     if "fog_onset" in config["env"]:
         fog_onset = config["env"]["fog_onset"]
         fog_speed = float(config["env"]["fog_speed"])
@@ -500,6 +714,26 @@ def main(args):
     use_strategy = config["agent"]["use_strategy"]  # 是否使用strategy
     use_information_reduction = config["agent"]["use_information_reduction"]  # 是否使用信息缩减
     max_verify_time = config["agent"]["max_verify_time"]  # 是否使用验证
+    incremental_state = config["agent"]["incremental_state"]  # 是否增量提取state
+    use_async_llm = config["agent"]["use_async_llm"]  # 是否在一个event loop上异步请求LLM
+    response_cache_path = config["agent"]["response_cache_path"]  # LLM回复缓存文件, 为空时不使用缓存
+    response_cache_max_mb = config["agent"]["response_cache_max_mb"]
+    cassette_path = config["agent"]["cassette_path"]  # 录制/回放LLM回复的文件
+    cassette_mode = config["agent"]["cassette_mode"]  # record/replay, 为空时不使用
+    # 缓存命中的请求不经过cassette，录制会缺少这些回复，回放时各请求的出现次数也会错位
+    assert not (response_cache_path and cassette_mode), "response_cache_path cannot be used together with cassette_mode"
+    guided_decoding = config["agent"]["guided_decoding"]  # 约束解码方式, 为空时不使用
+    routing_policy = config["agent"]["routing_policy"]  # 多个推理服务副本之间的路由方式
+    max_concurrent_requests = config["agent"]["max_concurrent_requests"]  # LLM并发请求数上限, 为空时不限制
+    max_tokens_per_sec = config["agent"]["max_tokens_per_sec"]  # LLM估计token/s上限, 为空时不限制
+    stream_responses = config["agent"]["stream_responses"]  # 是否流式请求LLM并在得到json后提前停止
+    request_timeout = config["agent"]["request_timeout"]  # 单次LLM请求的超时(秒)
+    prompt_layout = config["agent"]["prompt_layout"]  # prompt布局, prefix_cache把静态规则放在最前面
+    serialization = config["agent"]["serialization"]  # 状态描述的序列化profile: pretty/compact/tabular
+    count_state_tokens = config["agent"]["count_state_tokens"]  # 是否统计prompt中状态各部分的token数
+    prompt_token_budget = config["agent"]["prompt_token_budget"]  # 各模块prompt的token预算, 为空时不截断
+    decision_session = config["agent"]["decision_session"]  # 是否在多轮对话中决策, 每次只发送状态变化
+    session_max_turns = config["agent"]["session_max_turns"]  # 多轮对话达到该轮数后重置
     max_execute_step = config["agent"]["max_execute_step"]  # 最大执行步数
     share_strategy = config["agent"]["share_strategy"]  # 是否共享策略池
     file_save_path = build_file_save_path(exp_name, goal, pid, run_task)
@@ -551,6 +785,7 @@ def main(args):
                 model_name,
                 horizon,
                 replay_save_interval,
+                seed,
                 run_task,
                 use_information_reduction,
                 allow_give_action,
@@ -558,6 +793,24 @@ def main(args):
                 enable_llm_thinking,
                 max_execute_step,
                 max_verify_time,
+                incremental_state,
+                use_async_llm,
+                response_cache_path,
+                response_cache_max_mb,
+                cassette_path,
+                cassette_mode,
+                guided_decoding,
+                routing_policy,
+                max_concurrent_requests,
+                max_tokens_per_sec,
+                stream_responses,
+                request_timeout,
+                prompt_layout,
+                serialization,
+                count_state_tokens,
+                prompt_token_budget,
+                decision_session,
+                session_max_turns,
                 debug,
                 run_survive,
                 use_strategy,
@@ -566,6 +819,7 @@ def main(args):
                 pbar,
             )
     pbar.close()
+    close_cassettes()
 
 
 if __name__ == "__main__":
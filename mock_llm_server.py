@@ -0,0 +1,433 @@
+"""
+本地的OpenAI兼容推理服务(只实现/v1/chat/completions)，用于在没有GPU的机器上压测main.py。
+根据prompt中的回复格式和"# Available Actions"动作列表生成合法的json回复，
+可以配置延迟分布、生成速度、并发上限和错误注入，用来复现线上的过载情况。支持stream=True的SSE流式回复。
+
+    python mock_llm_server.py --port 8000 --latency_dist lognormal --latency_mean 0.5 --max_concurrency 16
+"""
+
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FORMAT_PATTERN = re.compile(r"in the following format:\s*")
+ACTION_PATTERN = re.compile(r"# Available Actions\s*")
+
+
+def estimate_tokens(text):
+    # 粗略估计: 英文平均每4个字符一个token
+    return max(1, len(text) // 4)
+
+
+def find_json_after(pattern, text):
+    """
+    返回text中最后一处pattern之后紧跟的json，找不到时返回None
+    """
+    decoder = json.JSONDecoder()
+    for match in reversed(list(pattern.finditer(text))):
+        try:
+            value, _ = decoder.raw_decode(text, match.end())
+        except ValueError:
+            continue
+        return value
+    return None
+
+
+class MockResponder:
+    """
+    根据请求的messages生成回复内容
+    """
+
+    def __init__(self, rng, yes_rate=0.5):
+        self.rng = rng
+        self.yes_rate = yes_rate
+
+    def fill_format(self, response_format, action_space):
+        response = {}
+        for key, value in response_format.items():
+            if isinstance(value, dict):
+                response[key] = self.fill_format(value, action_space)
+            elif key == "choice" and action_space:
+                response[key] = self.rng.choice(action_space)
+            elif key == "evaluation":
+                response[key] = "Yes" if self.rng.random() < self.yes_rate else "No"
+            else:
+                response[key] = f"Mock {key}."
+        return response
+
+    def fill_schema(self, schema):
+        response = {}
+        for key, value in schema.get("properties", {}).items():
+            if value.get("type") == "object":
+                response[key] = self.fill_schema(value)
+            elif "enum" in value:
+                response[key] = self.rng.choice(value["enum"])
+            elif key == "evaluation":
+                response[key] = "Yes" if self.rng.random() < self.yes_rate else "No"
+            else:
+                response[key] = f"Mock {key}."
+        return response
+
+    def respond(self, messages, guided_choice=None, json_schema=None):
+        """
+        guided_choice/json_schema是请求中的约束解码参数，有约束时按约束生成
+        """
+        if guided_choice:
+            return self.rng.choice(guided_choice)
+        if json_schema:
+            return json.dumps(self.fill_schema(json_schema), indent=4)
+        system_prompt = "\n".join(m["content"] for m in messages if m.get("role") == "system")
+        user_prompt = "\n".join(m["content"] for m in messages if m.get("role") != "system")
+        response_format = find_json_after(FORMAT_PATTERN, system_prompt)
+        action_space = find_json_after(ACTION_PATTERN, user_prompt)
+        if not isinstance(action_space, list):
+            action_space = None
+        if isinstance(response_format, dict):
+            return json.dumps(self.fill_format(response_format, action_space), indent=4)
+        # StrategyManager等不要求json的请求
+        return "# Strategy\nMock strategy."
+
+
+class LatencyModel:
+    """
+    单次请求的耗时 = 排队后的基础延迟(按分布采样) + prompt_tokens / prefill速度 + completion_tokens / 生成速度
+    """
+
+    def __init__(self, rng, dist, mean, std, prefill_tokens_per_sec, tokens_per_sec):
+        self.rng = rng
+        self.dist = dist
+        self.mean = mean
+        self.std = std
+        self.prefill_tokens_per_sec = prefill_tokens_per_sec
+        self.tokens_per_sec = tokens_per_sec
+
+    def sample_base(self):
+        if self.mean <= 0:
+            return 0.0
+        if self.dist == "fixed":
+            return self.mean
+        if self.dist == "uniform":
+            return self.rng.uniform(max(0.0, self.mean - self.std), self.mean + self.std)
+        if self.dist == "normal":
+            return max(0.0, self.rng.gauss(self.mean, self.std))
+        # lognormal: 参数换算成使均值和标准差与配置一致，长尾更接近真实的服务延迟
+        variance = self.std**2
+        sigma2 = math.log(1 + variance / self.mean**2)
+        mu = math.log(self.mean) - sigma2 / 2
+        return self.rng.lognormvariate(mu, sigma2**0.5)
+
+    def sample_prefill(self, prompt_tokens):
+        """
+        到生成第一个token为止的耗时
+        """
+        latency = self.sample_base()
+        if self.prefill_tokens_per_sec > 0:
+            latency += prompt_tokens / self.prefill_tokens_per_sec
+        return latency
+
+    def token_interval(self):
+        return 1.0 / self.tokens_per_sec if self.tokens_per_sec > 0 else 0.0
+
+    def sample(self, prompt_tokens, completion_tokens):
+        return self.sample_prefill(prompt_tokens) + completion_tokens * self.token_interval()
+
+
+class ServerStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {
+            "requests": 0,
+            "completed": 0,
+            "rejected": 0,
+            "server_error": 0,
+            "rate_limited": 0,
+            "timeout": 0,
+            "malformed": 0,
+            "cancelled": 0,
+        }
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.total_latency = 0.0
+
+    def add(self, key, value=1):
+        with self._lock:
+            self.counts[key] += value
+
+    def enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def leave(self, latency):
+        with self._lock:
+            self.in_flight -= 1
+            self.total_latency += latency
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.counts)
+            stats["in_flight"] = self.in_flight
+            stats["max_in_flight"] = self.max_in_flight
+            finished = self.counts["requests"] - self.counts["rejected"]
+            stats["mean_latency"] = self.total_latency / finished if finished else 0.0
+        return stats
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.args.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, status, message, headers=None):
+        self.send_json(status, {"error": {"message": message, "type": "mock_error", "code": status}}, headers)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self.send_json(200, {"object": "list", "data": [{"id": self.server.args.model, "object": "model"}]})
+        elif self.path.rstrip("/").endswith("/stats"):
+            self.send_json(200, self.server.stats.snapshot())
+        else:
+            self.send_error_json(404, f"Unknown path {self.path}")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error_json(404, f"Unknown path {self.path}")
+            return
+
+        server = self.server
+        args = server.args
+        stats = server.stats
+        stats.add("requests")
+
+        # 并发上限: 超过上限的请求排队，排队超过queue_timeout时返回503
+        if not server.slots.acquire(timeout=args.queue_timeout):
+            stats.add("rejected")
+            self.send_error_json(503, "Server overloaded", {"Retry-After": "1"})
+            return
+        start_time = time.time()
+        stats.enter()
+        try:
+            self.handle_completion(body)
+        finally:
+            stats.leave(time.time() - start_time)
+            server.slots.release()
+
+    def handle_completion(self, body):
+        server = self.server
+        args = server.args
+        stats = server.stats
+        guided_choice = body.get("guided_choice")
+        json_schema = body.get("guided_json")
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            json_schema = response_format["json_schema"]["schema"]
+        if args.disable_guided_decoding and (guided_choice or json_schema):
+            self.send_error_json(400, "Guided decoding is not supported")
+            return
+        with server.rng_lock:
+            error_roll = server.rng.random()
+            content = server.responder.respond(body.get("messages", []), guided_choice, json_schema)
+            # 约束解码的回复总是合法的
+            malformed = not (guided_choice or json_schema) and server.rng.random() < args.malformed_rate
+
+        # 错误注入，按顺序划分同一个随机数的区间
+        if error_roll < args.rate_limit_rate:
+            stats.add("rate_limited")
+            self.send_error_json(429, "Rate limit exceeded", {"Retry-After": "1"})
+            return
+        error_roll -= args.rate_limit_rate
+        if error_roll < args.error_rate:
+            stats.add("server_error")
+            self.send_error_json(500, "Injected server error")
+            return
+        error_roll -= args.error_rate
+        if error_roll < args.timeout_rate:
+            # 模拟卡住的请求: 长时间不回复，由client的超时处理
+            stats.add("timeout")
+            time.sleep(args.timeout_seconds)
+            self.close_connection = True
+            return
+
+        if malformed:
+            stats.add("malformed")
+            content = content.replace("{", "", 1)
+
+        if args.trailing_tokens > 0 and not guided_choice:
+            # 模拟模型在json之后继续输出解释文字
+            content += "\n\nExplanation:" + " because" * args.trailing_tokens
+
+        prompt_tokens = sum(estimate_tokens(m.get("content") or "") for m in body.get("messages", []))
+        if body.get("stream"):
+            self.send_stream(body, content, prompt_tokens)
+            return
+        completion_tokens = estimate_tokens(content)
+        with server.rng_lock:
+            latency = server.latency_model.sample(prompt_tokens, completion_tokens)
+        time.sleep(latency)
+
+        stats.add("completed")
+        self.send_json(
+            200,
+            {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", args.model),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            },
+        )
+
+
+    def write_event(self, data):
+        # chunked transfer encoding，每个事件一个chunk
+        event = f"data: {data}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(event):x}\r\n".encode("ascii") + event + b"\r\n")
+        self.wfile.flush()
+
+    def send_stream(self, body, content, prompt_tokens):
+        """
+        以SSE逐token(每4个字符)返回回复。client提前断开时停止生成，计入cancelled
+        """
+        server = self.server
+        stats = server.stats
+        stream_options = body.get("stream_options") or {}
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = body.get("model", server.args.model)
+        pieces = [content[i : i + 4] for i in range(0, len(content), 4)]
+
+        def build_chunk(delta, finish_reason=None, completion_tokens=None, with_choice=True):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if with_choice else [],
+            }
+            if completion_tokens is not None:
+                chunk["usage"] = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                }
+            return json.dumps(chunk)
+
+        with server.rng_lock:
+            prefill_latency = server.latency_model.sample_prefill(prompt_tokens)
+        token_interval = server.latency_model.token_interval()
+        continuous_usage = stream_options.get("continuous_usage_stats")
+        try:
+            time.sleep(prefill_latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i, piece in enumerate(pieces):
+                if i > 0:
+                    time.sleep(token_interval)
+                delta = {"role": "assistant", "content": piece} if i == 0 else {"content": piece}
+                self.write_event(build_chunk(delta, completion_tokens=i + 1 if continuous_usage else None))
+            self.write_event(build_chunk({}, "stop", completion_tokens=len(pieces) if continuous_usage else None))
+            if stream_options.get("include_usage"):
+                self.write_event(build_chunk({}, completion_tokens=len(pieces), with_choice=False))
+            self.write_event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            stats.add("cancelled")
+            self.close_connection = True
+            return
+        stats.add("completed")
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, args):
+        super().__init__((args.host, args.port), MockLLMHandler)
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.rng_lock = threading.Lock()
+        self.responder = MockResponder(self.rng, yes_rate=args.yes_rate)
+        self.latency_model = LatencyModel(
+            self.rng,
+            args.latency_dist,
+            args.latency_mean,
+            args.latency_std,
+            args.prefill_tokens_per_sec,
+            args.tokens_per_sec,
+        )
+        self.slots = threading.BoundedSemaphore(args.max_concurrency)
+        self.stats = ServerStats()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--model", type=str, default="llama")
+    parser.add_argument("--seed", type=int, default=None)
+    # 延迟
+    parser.add_argument("--latency_dist", type=str, default="lognormal", choices=["fixed", "uniform", "normal", "lognormal"])
+    parser.add_argument("--latency_mean", type=float, default=0.2, help="基础延迟均值(秒)")
+    parser.add_argument("--latency_std", type=float, default=0.1)
+    parser.add_argument("--prefill_tokens_per_sec", type=float, default=0, help="0表示不计prefill耗时")
+    parser.add_argument("--tokens_per_sec", type=float, default=50, help="单个请求的生成速度，0表示不计生成耗时")
+    # 过载
+    parser.add_argument("--max_concurrency", type=int, default=64, help="同时处理的请求数上限")
+    parser.add_argument("--queue_timeout", type=float, default=30, help="排队超过该时间返回503")
+    # 错误注入(比例)
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0, help="返回429的比例")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="返回500的比例")
+    parser.add_argument("--timeout_rate", type=float, default=0.0, help="不回复直到timeout_seconds的比例")
+    parser.add_argument("--timeout_seconds", type=float, default=60)
+    parser.add_argument("--malformed_rate", type=float, default=0.0, help="回复不合法json的比例")
+    parser.add_argument("--disable_guided_decoding", action="store_true", help="以400拒绝约束解码的请求")
+    parser.add_argument("--trailing_tokens", type=int, default=0, help="在json之后额外生成的token数")
+    parser.add_argument("--yes_rate", type=float, default=0.5, help="verify回复Yes的比例")
+    parser.add_argument("--verbose", action="store_true")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    server = MockLLMServer(args)
+    print(f"Mock LLM server listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats.snapshot(), indent=4))
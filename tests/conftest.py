@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tests import the top-level modules (bridge, utils, llm_client, ...) the same way main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
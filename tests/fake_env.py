@@ -0,0 +1,144 @@
+"""Small in-memory stand-ins for the nmmo env/realm/observation objects used by the tests.
+
+Only the attributes read by bridge/, utils/ and agent/ are provided. Maps are
+random but seeded, so every test run sees the same terrain.
+"""
+
+import types
+
+import numpy as np
+
+from constant import MATERIAL_NAME_TO_ID
+
+IMPASSABLE_IDS = {MATERIAL_NAME_TO_ID[name] for name in ("Void", "Water", "Stone", "Ocean", "Fish")}
+TERRAIN_IDS = [
+    MATERIAL_NAME_TO_ID[name]
+    for name in ("Grass", "Grass", "Grass", "Foliage", "Ore", "Tree", "Crystal", "Herb", "Water", "Stone", "Fish", "Ocean")
+]
+MAP_SIZE = 160
+MAP_BORDER = 16
+VIEW_RADIUS = 7
+
+AGENT_FIELDS = [
+    "id", "npc_type", "row", "col", "damage", "time_alive", "freeze", "item_level", "attacker_id",
+    "latest_combat_tick", "message", "gold", "health", "food", "water", "melee_level", "melee_exp",
+    "range_level", "range_exp", "mage_level", "mage_exp", "fishing_level", "fishing_exp",
+    "herbalism_level", "herbalism_exp", "prospecting_level", "prospecting_exp", "carving_level",
+    "carving_exp", "alchemy_level", "alchemy_exp",
+]  # fmt: skip
+
+
+class Config:
+    COMBAT_MELEE_REACH = 1
+    COMBAT_RANGE_REACH = 3
+    COMBAT_MAGE_REACH = 4
+    MAP_BORDER = MAP_BORDER
+    MAP_CENTER = MAP_SIZE - 2 * MAP_BORDER
+    MAP_SIZE = MAP_SIZE
+    DEATH_FOG_ONSET = 32
+    DEATH_FOG_FINAL_SIZE = 16
+    ITEM_SYSTEM_ENABLED = True
+    ITEM_INVENTORY_CAPACITY = 12
+    NPC_SYSTEM_ENABLED = True
+    COMBAT_SYSTEM_ENABLED = True
+    PROGRESSION_SYSTEM_ENABLED = True
+
+
+class Tile:
+    def __init__(self, material_id):
+        self.state = types.SimpleNamespace(index=material_id)
+
+
+class RealmMap:
+    def __init__(self, materials):
+        self.materials = materials
+        self.tiles = np.empty(materials.shape, dtype=object)
+        for r in range(materials.shape[0]):
+            for c in range(materials.shape[1]):
+                self.tiles[r, c] = Tile(int(materials[r, c]))
+        self.habitable_tiles = (~np.isin(materials, list(IMPASSABLE_IDS))).astype(np.int8)
+
+    def is_valid_pos(self, r, c):
+        return 0 <= r < self.materials.shape[0] and 0 <= c < self.materials.shape[1]
+
+    def set_material(self, pos, material_id):
+        """Harvest/respawn: only swaps between materials of the same passability."""
+        self.materials[pos] = material_id
+        self.tiles[pos].state.index = material_id
+
+
+def make_materials(rng, size=MAP_SIZE, border=MAP_BORDER):
+    materials = rng.choice(TERRAIN_IDS, size=(size, size))
+    materials[:border, :] = MATERIAL_NAME_TO_ID["Void"]
+    materials[-border:, :] = MATERIAL_NAME_TO_ID["Void"]
+    materials[:, :border] = MATERIAL_NAME_TO_ID["Void"]
+    materials[:, -border:] = MATERIAL_NAME_TO_ID["Void"]
+    return materials
+
+
+def make_env(seed=0):
+    rng = np.random.default_rng(seed)
+    realm_map = RealmMap(make_materials(rng))
+    fog_map = np.full((MAP_SIZE, MAP_SIZE), -float(MAP_SIZE), dtype=np.float16)
+    realm = types.SimpleNamespace(map=realm_map, tick=1, fog_map=fog_map)
+    return types.SimpleNamespace(config=Config(), realm=realm)
+
+
+class EntityArray:
+    def __init__(self, values):
+        self.values = values
+        self.ids = values[:, 0]
+
+    def __bool__(self):
+        return len(self.values) > 0
+
+
+def make_entity(entity_id, row, col, rng):
+    entity = np.zeros(len(AGENT_FIELDS), dtype=np.int64)
+    entity[0] = entity_id
+    entity[1] = 0 if entity_id > 0 else int(rng.integers(1, 4))
+    entity[2] = row
+    entity[3] = col
+    entity[4] = int(rng.integers(0, 30))
+    entity[12] = int(rng.integers(1, 101))
+    entity[15:31:2] = rng.integers(1, 5, size=8)
+    return entity
+
+
+def make_item(item_id, item_index, rng):
+    item = np.zeros(16, dtype=np.int64)
+    item[0] = item_id
+    item[1] = item_index
+    item[3] = int(rng.integers(1, 5))
+    item[5] = int(rng.integers(1, 20))
+    item[6:12] = rng.integers(0, 20, size=6)
+    item[14] = int(rng.random() < 0.5)
+    return item
+
+
+def make_obs(env, row, col, tick, entities, items, agent_in_combat=False):
+    """Observation of the agent (entities[0]) standing at (row, col)."""
+    realm_map = env.realm.map
+    tiles = np.array(
+        [
+            (r, c, realm_map.tiles[r, c].state.index)
+            for r in range(row - VIEW_RADIUS, row + VIEW_RADIUS + 1)
+            for c in range(col - VIEW_RADIUS, col + VIEW_RADIUS + 1)
+        ]
+    )
+    values = np.array(entities)
+    obs = types.SimpleNamespace(tiles=tiles, current_tick=tick, agent_in_combat=agent_in_combat)
+    obs.entities = EntityArray(values)
+    obs.agent = types.SimpleNamespace(**{key: int(value) for key, value in zip(AGENT_FIELDS, values[0])})
+    obs.inventory = EntityArray(np.array(items) if items else np.zeros((0, 16), dtype=np.int64))
+    return obs
+
+
+def find_open_position(env, rng):
+    """A habitable tile whose whole view window lies inside the map border."""
+    low = MAP_BORDER + VIEW_RADIUS
+    high = MAP_SIZE - MAP_BORDER - VIEW_RADIUS
+    while True:
+        pos = (int(rng.integers(low, high)), int(rng.integers(low, high)))
+        if env.realm.map.habitable_tiles[pos]:
+            return pos
@@ -0,0 +1,72 @@
+import asyncio
+import threading
+import time
+
+from utils.admission_control import AdmissionController
+
+
+def run_workers(controller, num_agents, requests_per_agent, tokens, hold=0.005):
+    peak = {"in_flight": 0}
+    peak_lock = threading.Lock()
+
+    def worker(agent_key):
+        for _ in range(requests_per_agent):
+            ticket = controller.acquire(agent_key, tokens)
+            with peak_lock:
+                peak["in_flight"] = max(peak["in_flight"], controller.in_flight)
+            time.sleep(hold)
+            controller.release(ticket, tokens)
+
+    threads = [threading.Thread(target=worker, args=(agent_key,), daemon=True) for agent_key in range(num_agents)]
+    for thread in threads:
+        thread.start()
+    deadline = time.time() + 10
+    for thread in threads:
+        thread.join(timeout=max(deadline - time.time(), 0))
+    assert not any(thread.is_alive() for thread in threads), "admission deadlocked"
+    return peak["in_flight"]
+
+
+def test_concurrency_and_token_limits_together():
+    # every request drains the bucket, so the waiters queued behind the full
+    # concurrency limit still have to wait for the refill after the slot frees
+    # up, and no later release() is coming to wake them
+    controller = AdmissionController(max_concurrency=1, tokens_per_second=20000, burst_seconds=0.05)
+    peak_in_flight = run_workers(controller, num_agents=6, requests_per_agent=3, tokens=1000)
+    stats = controller.get_stats()
+    assert peak_in_flight == 1
+    assert stats["admitted"] == 18
+    assert stats["queue_depth"] == 0
+    assert stats["in_flight"] == 0
+
+
+def test_concurrency_limit_only():
+    controller = AdmissionController(max_concurrency=3)
+    peak_in_flight = run_workers(controller, num_agents=8, requests_per_agent=5, tokens=100)
+    assert peak_in_flight <= 3
+    assert controller.get_stats()["admitted"] == 40
+
+
+def test_cancelled_async_waiter_leaves_the_queue():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1)
+        holder = await controller.acquire_async("a", 10)
+        cancelled = asyncio.create_task(controller.acquire_async("b", 10))
+        waiting = asyncio.create_task(controller.acquire_async("c", 10))
+        await asyncio.sleep(0.01)
+        assert controller.get_stats()["queue_depth"] == 2
+
+        cancelled.cancel()
+        await asyncio.sleep(0.01)
+        assert controller.get_stats()["queue_depth"] == 1
+        assert "b" not in controller._queues
+
+        controller.release(holder)
+        ticket = await asyncio.wait_for(waiting, timeout=1)
+        assert ticket.agent_key == "c"
+        controller.release(ticket)
+        stats = controller.get_stats()
+        assert stats["queue_depth"] == 0
+        assert stats["in_flight"] == 0
+
+    asyncio.run(scenario())
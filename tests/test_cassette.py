@@ -0,0 +1,23 @@
+from utils.cassette import Cassette
+
+REQUEST = {"model": "llama", "messages": [{"role": "user", "content": "Choose an action"}], "temperature": 0.1}
+
+
+def test_replay_does_not_depend_on_agent_order(tmp_path):
+    path = str(tmp_path / "cassette.jsonl")
+    cassette = Cassette(path, "record")
+    # two agents send the same prompt; agent 1 goes first while recording
+    cassette.record(REQUEST, "agent 1, first", agent=1)
+    cassette.record(REQUEST, "agent 2, first", agent=2)
+    cassette.record(REQUEST, "agent 2, second", agent=2)
+    cassette.record(REQUEST, None, agent=1)
+    cassette.close()
+
+    cassette = Cassette(path, "replay")
+    # the thread scheduling differs on replay
+    assert cassette.play(REQUEST, agent=2)["content"] == "agent 2, first"
+    assert cassette.play(REQUEST, agent=1)["content"] == "agent 1, first"
+    assert cassette.play(REQUEST, agent=1)["content"] is None
+    assert cassette.play(REQUEST, agent=2)["content"] == "agent 2, second"
+    assert cassette.play(REQUEST, agent=2) is None
+    assert cassette.get_stats() == {"mode": "replay", "hits": 4, "misses": 1}
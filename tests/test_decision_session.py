@@ -0,0 +1,88 @@
+import copy
+
+import numpy as np
+
+from agent.decision_session import DecisionSession
+from utils.state_diff import _keyed_rows, _row_key, diff_state
+
+
+def apply_patch(old, patch):
+    """Applies a diff_state patch following the rules given to the model in the session system prompt."""
+    result = dict(old)
+    for key, value in patch.items():
+        old_value = old.get(key)
+        if value is None:
+            result.pop(key, None)
+        elif isinstance(value, dict) and isinstance(old_value, dict):
+            result[key] = apply_patch(old_value, value)
+        elif isinstance(value, dict) and _keyed_rows(old_value) is not None:
+            result[key] = list(apply_patch(_keyed_rows(old_value), value).values())
+        else:
+            result[key] = value
+    return result
+
+
+def normalize(value):
+    """Keyed lists are compared as sets of rows: the patch does not carry their order."""
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items()}
+    if _keyed_rows(value) is not None:
+        return sorted((normalize(row) for row in value), key=_row_key)
+    return value
+
+
+def random_state(rng):
+    state = {"survive": {"health": int(rng.integers(0, 101)), "in_combat": bool(rng.random() < 0.5)}}
+    if rng.random() < 0.7:
+        state["survive"]["attacked_by"] = "NPC 3"
+    state["observation"] = {}
+    for area in ("center", "north", "east"):
+        area_info = {"reachable_tile_count": int(rng.integers(0, 25))}
+        names = rng.choice(["Tree", "Ore", "Water", "Grass", "Herb"], size=int(rng.integers(0, 4)), replace=False)
+        if len(names):
+            area_info["resources"] = [{"name": str(name), "count": int(rng.integers(1, 4))} for name in names]
+        state["observation"][area] = area_info
+    state["item"] = {
+        "items": [
+            {"id": int(item_id), "name": "Ration", "level": int(rng.integers(1, 3))}
+            for item_id in rng.choice(10, size=int(rng.integers(0, 5)), replace=False)
+        ],
+        "tags": [str(tag) for tag in rng.choice(["a", "b", "c"], size=int(rng.integers(0, 3)))],
+    }
+    return state
+
+
+def test_patch_round_trips_with_keyed_list_semantics():
+    rng = np.random.default_rng(0)
+    for _ in range(300):
+        old, new = random_state(rng), random_state(rng)
+        patch = diff_state(old, new)
+        assert normalize(apply_patch(old, patch)) == normalize(new)
+        assert diff_state(new, copy.deepcopy(new)) == {}
+
+
+def test_full_state_is_rendered_only_when_needed():
+    renders = []
+
+    def render_full_state():
+        renders.append(1)
+        return "full state"
+
+    session = DecisionSession("rules", max_turns=2)
+    rng = np.random.default_rng(1)
+    for tick in range(1, 6):
+        session.observe(tick, random_state(rng), render_full_state)
+        session.take_state_update()
+        session.build_messages("system", "user")
+        session.record_decision("Stay")
+    # the first tick and the tick after the reset at max_turns
+    assert len(renders) == 3
+    assert session.get_stats()["measured_updates"] == 0
+
+    renders.clear()
+    session = DecisionSession("rules", max_turns=32, measure_full_state=True)
+    for tick in range(1, 6):
+        session.observe(tick, random_state(rng), render_full_state)
+        session.take_state_update()
+    assert len(renders) == 5
+    assert session.get_stats()["measured_updates"] == 4
@@ -0,0 +1,29 @@
+from utils.endpoint_pool import EndpointPool, get_endpoint_pool
+
+
+def test_eject_and_readmit_are_recorded_in_stats():
+    pool = EndpointPool(["http://a/v1"], "key", eject_after=2, eject_time=0.0)
+    for _ in range(2):
+        endpoint = pool.acquire()
+        pool.release(endpoint, 0.1, "server_error")
+    stats = pool.get_stats()["http://a/v1"]
+    assert stats["state"] == "ejected"
+    assert stats["ejections"] == 1
+    assert [event["event"] for event in stats["events"]] == ["eject"]
+
+    # eject_time is 0, so the next request probes it again
+    endpoint = pool.acquire()
+    assert endpoint.state == "probing"
+    pool.release(endpoint, 0.05)
+    stats = pool.get_stats()["http://a/v1"]
+    assert stats["state"] == "healthy"
+    assert stats["readmissions"] == 1
+    assert [event["event"] for event in stats["events"]] == ["eject", "readmit"]
+
+
+def test_pools_are_shared_per_routing_policy():
+    least_outstanding = get_endpoint_pool("http://pool-test/v1", "key", policy="least_outstanding")
+    latency_weighted = get_endpoint_pool("http://pool-test/v1", "key", policy="latency_weighted")
+    assert least_outstanding is not latency_weighted
+    assert latency_weighted.policy == "latency_weighted"
+    assert get_endpoint_pool(["http://pool-test/v1"], "key", policy="latency_weighted") is latency_weighted
@@ -0,0 +1,46 @@
+import math
+
+import numpy as np
+
+from bridge.state_manager import StateManager
+from constant import AREA_SPACE
+from fake_env import MAP_SIZE, find_open_position, make_entity, make_env, make_obs
+from utils.path_utils import get_area
+
+FOG_VALUES = [-MAP_SIZE, -MAP_SIZE + 1e-3, -MAP_SIZE * (1 + 1e-10), -3.0, -1e-7, 0.0, 1e-7, 0.3, 0.5, 0.5001, 2.0]
+
+
+def baseline_fog_info(env, obs):
+    """get_fog_info before it was vectorized: one get_area and one classification per tile."""
+    fog_info = {
+        area: {"out_of_fog_count": 0, "on_the_edge_count": 0, "in_fog_count": 0, "in_safety_count": 0}
+        for area in AREA_SPACE
+    }
+    for tile in obs.tiles:
+        area = get_area(obs.tiles, tile[0], tile[1])
+        fog_value = float(env.realm.fog_map[tile[0], tile[1]])
+        if fog_value > 0.5:
+            fog_info[area]["in_fog_count"] += 1
+        elif math.isclose(fog_value, 0.0):
+            fog_info[area]["on_the_edge_count"] += 1
+        elif fog_value < 0:
+            if math.isclose(fog_value, -env.config.MAP_SIZE):
+                fog_info[area]["in_safety_count"] += 1
+            else:
+                fog_info[area]["out_of_fog_count"] += 1
+    return fog_info
+
+
+def test_vectorized_fog_matches_baseline():
+    for seed, dtype in [(0, np.float16), (1, np.float32), (2, np.float64)]:
+        env = make_env(seed)
+        rng = np.random.default_rng(seed)
+        state_manager = StateManager(env)
+        for tick in range(40, 100):
+            env.realm.tick = tick
+            env.realm.fog_map = rng.choice(FOG_VALUES, size=(MAP_SIZE, MAP_SIZE)).astype(dtype)
+            if rng.random() < 0.3:
+                env.realm.fog_map += rng.normal(0, 1, size=(MAP_SIZE, MAP_SIZE)).astype(dtype)
+            row, col = find_open_position(env, rng)
+            obs = make_obs(env, row, col, tick, [make_entity(1, row, col, rng)], [])
+            assert state_manager.get_fog_info(obs) == baseline_fog_info(env, obs)
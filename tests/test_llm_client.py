@@ -0,0 +1,43 @@
+import json
+import types
+
+from llm_client import StreamCollector
+
+RESPONSE_FORMAT = {"reason": "...", "choice": "..."}
+
+
+def make_chunk(content):
+    delta = types.SimpleNamespace(content=content)
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)], usage=None)
+
+
+def stream(text, piece_size, response_format=RESPONSE_FORMAT, choice_space=("A", "B")):
+    collector = StreamCollector(response_format, choice_space)
+    stopped = False
+    for i in range(0, len(text), piece_size):
+        if collector.add(make_chunk(text[i : i + piece_size])):
+            stopped = True
+            break
+    return collector, stopped
+
+
+def test_stream_skips_leading_non_matching_object():
+    text = '{"x": 1} then {"reason": "r", "choice": "A"} and {"reason": "late", "choice": "B"}'
+    for piece_size in (1, 3, 7, len(text)):
+        collector, stopped = stream(text, piece_size)
+        assert stopped
+        assert json.loads(collector.get_content()) == {"reason": "r", "choice": "A"}
+
+
+def test_stream_skips_object_with_invalid_choice():
+    text = 'Sure: {"reason": "a } in a string", "choice": "C"}\n{"reason": "r", "choice": "B"}'
+    collector, stopped = stream(text, 4)
+    assert stopped
+    assert json.loads(collector.get_content()) == {"reason": "r", "choice": "B"}
+
+
+def test_stream_without_valid_object_returns_everything():
+    text = 'no json here {"x": 1}'
+    collector, stopped = stream(text, 5)
+    assert not stopped
+    assert collector.get_content() == text
@@ -0,0 +1,59 @@
+import types
+
+import numpy as np
+
+from utils.path_utils import PathfindingCache, a_star_bounded, a_star_grid, bfs_bounded
+
+
+def make_realm_map(rng, size=40, blocked=0.3):
+    habitable = (rng.random((size, size)) >= blocked).astype(np.int8)
+    return types.SimpleNamespace(tiles=np.zeros((size, size)), habitable_tiles=habitable)
+
+
+def random_window(rng, size, radius=7):
+    r, c = (int(v) for v in rng.integers(0, size, size=2))
+    return (r, c), (r - radius, r + radius, c - radius, c + radius)
+
+
+def test_distance_field_matches_a_star():
+    rng = np.random.default_rng(0)
+    checked = 0
+    for _ in range(60):
+        realm_map = make_realm_map(rng, blocked=rng.choice([0.0, 0.15, 0.3, 0.4]))
+        start, bounds = random_window(rng, 40)
+        if rng.random() < 0.2:
+            bounds = None
+        field = bfs_bounded(realm_map, start, bounds=bounds)
+        for _ in range(80):
+            goal = (int(rng.integers(start[0] - 9, start[0] + 10)), int(rng.integers(start[1] - 9, start[1] + 10)))
+            expected = a_star_bounded(realm_map, start, goal, bounds)
+            assert field.query(goal) == expected, (start, goal, bounds)
+            assert a_star_grid(realm_map, start, goal, bounds) == expected
+            checked += expected[1] not in (0, float("inf"))
+    # most goals should have been reachable, non-trivial ones
+    assert checked > 1000
+
+
+def test_open_field_ties():
+    # with no obstacles every direction toward the goal ties on distance
+    realm_map = types.SimpleNamespace(tiles=np.zeros((30, 30)), habitable_tiles=np.ones((30, 30), dtype=np.int8))
+    start = (15, 15)
+    field = bfs_bounded(realm_map, start)
+    for r in range(1, 30):
+        for c in range(1, 30):
+            assert field.query((r, c)) == a_star_bounded(realm_map, start, (r, c))
+
+
+def test_pathfinding_cache_matches_a_star():
+    rng = np.random.default_rng(1)
+    realm_map = make_realm_map(rng, size=60)
+    realm = types.SimpleNamespace(map=realm_map, tick=1)
+    cache = PathfindingCache(realm)
+    for tick in range(1, 6):
+        realm.tick = tick
+        for _ in range(20):
+            start, bounds = random_window(rng, 60)
+            for _ in range(20):
+                goal = (int(rng.integers(bounds[0], bounds[1] + 1)), int(rng.integers(bounds[2], bounds[3] + 1)))
+                assert cache.query(start, goal, bounds=bounds) == a_star_bounded(realm_map, start, goal, bounds)
+    assert cache.hits > 0
@@ -0,0 +1,48 @@
+import itertools
+
+import numpy as np
+
+from agent.modules.perception_module import PerceptionModule
+from bridge.state_manager import StateManager
+from fake_env import Config, find_open_position, make_entity, make_env, make_item, make_obs
+from perception_baseline import PerceptionModule as BaselinePerceptionModule
+
+HORIZON = 1024
+
+
+def make_state_infos(seed, num_agents=6):
+    env = make_env(seed)
+    rng = np.random.default_rng(seed)
+    state_infos = []
+    for agent_id in range(1, num_agents + 1):
+        row, col = find_open_position(env, rng)
+        entities = [make_entity(agent_id, row, col, rng)]
+        for entity_id in rng.choice(list(range(-30, 0)) + list(range(20, 40)), size=int(rng.integers(0, 8)), replace=False):
+            entity = make_entity(int(entity_id), row + int(rng.integers(-7, 8)), col + int(rng.integers(-7, 8)), rng)
+            entity[8] = int(rng.choice([0, 0, agent_id, -5]))
+            entities.append(entity)
+        items = [make_item(100 + k, int(rng.integers(2, 18)), rng) for k in range(int(rng.integers(0, 12)))]
+        tick = int(rng.choice([1, 40]))
+        env.realm.tick = tick
+        if tick >= env.config.DEATH_FOG_ONSET:
+            env.realm.fog_map[row - 7 : row + 8, col - 7 : col + 8] = rng.choice([-160.0, -3.0, 0.0, 0.3, 2.0], size=(15, 15))
+        obs = make_obs(env, row, col, tick, entities, items, agent_in_combat=bool(rng.random() < 0.5))
+        state_infos.append((tick, StateManager(env).get_state_info(obs)))
+    return state_infos
+
+
+def test_perceive_matches_pre_change_output():
+    state_infos = [state for seed in range(3) for state in make_state_infos(seed)]
+    for npc, combat, progression in itertools.product([True, False], repeat=3):
+        config = Config()
+        config.NPC_SYSTEM_ENABLED = npc
+        config.COMBAT_SYSTEM_ENABLED = combat
+        config.PROGRESSION_SYSTEM_ENABLED = progression
+        perceive_module = PerceptionModule(config, None, None)
+        baseline_module = BaselinePerceptionModule(config, None, None)
+        assert perceive_module.perceive_static() == baseline_module.perceive_static()
+        for tick, state_info in state_infos:
+            assert perceive_module.perceive(state_info, tick, HORIZON) == baseline_module.perceive(state_info, tick, HORIZON)
+            assert perceive_module.perceive_dynamic(state_info, tick, HORIZON) == baseline_module.perceive_dynamic(
+                state_info, tick, HORIZON
+            )
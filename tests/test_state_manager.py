@@ -0,0 +1,67 @@
+import json
+
+import numpy as np
+
+from bridge.state_manager import StateManager
+from constant import MATERIAL_NAME_TO_ID
+from fake_env import make_entity, make_env, make_item, make_obs, find_open_position
+
+
+def dump_state(state_info):
+    """state_info as bytes; InventoryView is covered by the per-category lists."""
+    state = {key: value for key, value in state_info.items() if key != "inventory"}
+    return json.dumps(state, sort_keys=True, default=lambda value: value.item()).encode()
+
+
+def generate_ticks(env, seed, num_ticks=40):
+    """Observations of one agent where each section's inputs change on some ticks and not on others."""
+    rng = np.random.default_rng(seed)
+    realm_map = env.realm.map
+    row, col = find_open_position(env, rng)
+    entities = [make_entity(1, row, col, rng)]
+    for entity_id in (-3, -7, 4, 9):
+        entities.append(make_entity(entity_id, row + int(rng.integers(-7, 8)), col + int(rng.integers(-7, 8)), rng))
+    items = [make_item(100 + k, int(rng.integers(2, 18)), rng) for k in range(5)]
+
+    for tick in range(1, num_ticks + 1):
+        env.realm.tick = tick
+        event = rng.integers(0, 6)
+        if event == 0:
+            # agent moves to a passable neighbour
+            dr, dc = [(-1, 0), (0, -1), (1, 0), (0, 1)][int(rng.integers(0, 4))]
+            if realm_map.habitable_tiles[row + dr, col + dc]:
+                row, col = row + dr, col + dc
+                entities[0][2:4] = (row, col)
+        elif event == 1:
+            # an NPC moves or starts attacking
+            entity = entities[int(rng.integers(1, len(entities)))]
+            entity[2] += int(rng.integers(-1, 2))
+            entity[8] = int(rng.choice([0, 1, -3]))
+        elif event == 2:
+            # a tile in view is harvested
+            r, c = row + int(rng.integers(-7, 8)), col + int(rng.integers(-7, 8))
+            if realm_map.tiles[r, c].state.index == MATERIAL_NAME_TO_ID["Tree"]:
+                realm_map.set_material((r, c), MATERIAL_NAME_TO_ID["Stump"])
+        elif event == 3:
+            # an item is picked up, or a skill levels up
+            if rng.random() < 0.5:
+                items.append(make_item(100 + len(items), int(rng.integers(2, 18)), rng))
+            else:
+                entities[0][15] += 1
+        elif event == 4 and tick >= env.config.DEATH_FOG_ONSET:
+            env.realm.fog_map[row - 7 : row + 8, col - 7 : col + 8] += np.float16(0.25)
+        # event 5: nothing but the tick changes
+        visible = [entity.copy() for entity in entities if max(abs(entity[2] - row), abs(entity[3] - col)) <= 7]
+        yield make_obs(env, row, col, tick, visible, [item.copy() for item in items])
+
+
+def test_incremental_state_matches_full_extraction():
+    for seed in range(4):
+        env = make_env(seed)
+        full = StateManager(env)
+        incremental = StateManager(env, incremental=True)
+        for obs in generate_ticks(env, seed):
+            assert dump_state(incremental.get_state_info(obs)) == dump_state(full.get_state_info(obs))
+        # the comparison only means something if sections were actually reused
+        assert sum(stats["reused"] for stats in incremental.section_stats.values()) > 0
+        assert sum(stats["reused"] for stats in full.section_stats.values()) == 0
@@ -0,0 +1,34 @@
+import numpy as np
+
+from constant import MATERIAL_NAME_TO_ID
+from fake_env import make_env
+from utils.terrain_utils import build_terrain_index, get_material_ids
+
+WATER = MATERIAL_NAME_TO_ID["Water"]
+FISH = MATERIAL_NAME_TO_ID["Fish"]
+
+
+def naive_neighbor_has(realm_map, pos, material_id):
+    r, c = pos
+    for dr, dc in [(0, 1), (0, -1), (1, 0), (-1, 0)]:
+        if realm_map.is_valid_pos(r + dr, c + dc) and realm_map.tiles[r + dr, c + dc].state.index == material_id:
+            return True
+    return False
+
+
+def test_terrain_index_reads_tile_materials():
+    env = make_env(3)
+    realm_map = env.realm.map
+    assert not hasattr(realm_map, "repr")
+    assert np.array_equal(get_material_ids(realm_map), realm_map.materials)
+
+    terrain_index = build_terrain_index(env.realm)
+    rng = np.random.default_rng(3)
+    for _ in range(2000):
+        pos = tuple(int(v) for v in rng.integers(0, realm_map.materials.shape[0], size=2))
+        assert terrain_index.water_around[pos] == naive_neighbor_has(realm_map, pos, WATER)
+        assert terrain_index.fish_candidate_around[pos] == naive_neighbor_has(realm_map, pos, FISH)
+        assert terrain_index.is_impassable(pos) == (realm_map.habitable_tiles[pos] == 0)
+        if not terrain_index.may_have_water_or_fish_around(pos):
+            assert not naive_neighbor_has(realm_map, pos, WATER)
+            assert not naive_neighbor_has(realm_map, pos, FISH)
@@ -0,0 +1,225 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+from utils.endpoint_pool import normalize_base_urls
+
+# 估计一次请求会生成的token数，请求完成后按实际用量修正令牌桶
+EXPECTED_COMPLETION_TOKENS = 256
+# 等待中的请求最多隔这么久重新检查一次能否放行，令牌桶回填不会唤醒等待者
+MAX_WAIT_INTERVAL = 0.1
+
+
+def estimate_prompt_tokens(request):
+    """
+    粗略估计prompt的token数: 按每4个字符一个token
+    """
+    return sum(len(message.get("content") or "") for message in request["messages"]) // 4
+
+
+def estimate_request_tokens(request):
+    """
+    粗略估计一次请求消耗的token: prompt加上预期的生成长度
+    """
+    return estimate_prompt_tokens(request) + EXPECTED_COMPLETION_TOKENS
+
+
+class AdmissionTicket:
+    def __init__(self, agent_key, tokens, future=None):
+        self.agent_key = agent_key
+        self.tokens = tokens
+        self.enqueue_time = time.time()
+        self.granted = False
+        # 同步调用方等待event，异步调用方等待所在event loop上的future
+        self.event = threading.Event() if future is None else None
+        self.future = future
+
+
+class AdmissionController:
+    """
+    同一个后端的所有client共享的准入控制: 限制同时进行的请求数，并用令牌桶限制估计的token/s。
+    等待中的请求按agent分队列，各agent之间轮流放行，一个agent的多个请求(verify轮次、并发的use/destroy/give)
+    不会挤占其他agent。令牌桶允许欠账: 一个请求只要桶里的令牌达到min(估计token, 桶容量)就放行，
+    扣除估计值后可以为负，完成后再按实际用量修正
+    """
+
+    def __init__(self, max_concurrency=None, tokens_per_second=None, burst_seconds=2.0):
+        self.max_concurrency = max_concurrency
+        self.tokens_per_second = tokens_per_second
+        self.capacity = tokens_per_second * burst_seconds if tokens_per_second else None
+        self.available_tokens = self.capacity
+        self.last_refill = time.time()
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._agent_order = deque()
+
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.admitted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _refill(self):
+        if self.tokens_per_second is None:
+            return
+        now = time.time()
+        self.available_tokens = min(
+            self.capacity, self.available_tokens + (now - self.last_refill) * self.tokens_per_second
+        )
+        self.last_refill = now
+
+    def _enqueue(self, ticket):
+        queue = self._queues.get(ticket.agent_key)
+        if queue is None:
+            queue = self._queues[ticket.agent_key] = deque()
+            self._agent_order.append(ticket.agent_key)
+        queue.append(ticket)
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+    def _grant(self, ticket):
+        wait_time = time.time() - ticket.enqueue_time
+        self.admitted += 1
+        self.total_wait += wait_time
+        self.max_wait = max(self.max_wait, wait_time)
+        self.in_flight += 1
+        self.queue_depth -= 1
+        ticket.granted = True
+        if ticket.future is None:
+            ticket.event.set()
+        else:
+            loop = ticket.future.get_loop()
+            loop.call_soon_threadsafe(_resolve_future, ticket.future)
+
+    def _dispatch(self):
+        """
+        按轮询顺序放行队首的请求。返回因令牌不足需要等待的秒数，不需要按时间等待时返回None
+        """
+        self._refill()
+        while self._agent_order:
+            if self.max_concurrency is not None and self.in_flight >= self.max_concurrency:
+                return None
+            agent_key = self._agent_order[0]
+            queue = self._queues[agent_key]
+            ticket = queue[0]
+            if self.tokens_per_second is not None:
+                required_tokens = min(ticket.tokens, self.capacity)
+                if self.available_tokens < required_tokens:
+                    return (required_tokens - self.available_tokens) / self.tokens_per_second
+                self.available_tokens -= ticket.tokens
+            queue.popleft()
+            self._agent_order.popleft()
+            if queue:
+                self._agent_order.append(agent_key)
+            else:
+                del self._queues[agent_key]
+            self._grant(ticket)
+        return None
+
+    def _poll(self, ticket):
+        """
+        尝试放行，返回下一次检查前最多等待的秒数，已放行时返回None。
+        放行只由持有锁的_dispatch完成，等待超时后重新调用，令牌不足时不会因为没有release唤醒而一直等待
+        """
+        with self._lock:
+            if not ticket.granted:
+                delay = self._dispatch()
+        if ticket.granted:
+            return None
+        return MAX_WAIT_INTERVAL if delay is None else min(delay, MAX_WAIT_INTERVAL)
+
+    def _abandon(self, ticket):
+        """
+        等待被取消或中断: 未放行的ticket从队列中移除，已放行的归还并发数和令牌
+        """
+        with self._lock:
+            if not ticket.granted:
+                queue = self._queues[ticket.agent_key]
+                queue.remove(ticket)
+                if not queue:
+                    del self._queues[ticket.agent_key]
+                    self._agent_order.remove(ticket.agent_key)
+                self.queue_depth -= 1
+                # 队首被移除后后面的请求可能可以放行
+                self._dispatch()
+                return
+        self.release(ticket, 0)
+
+    def acquire(self, agent_key, tokens):
+        """
+        阻塞直到被放行，返回的ticket需要在请求结束后传给release
+        """
+        ticket = AdmissionTicket(agent_key, tokens)
+        with self._lock:
+            self._enqueue(ticket)
+        try:
+            timeout = self._poll(ticket)
+            while timeout is not None:
+                ticket.event.wait(timeout=timeout)
+                timeout = self._poll(ticket)
+        except BaseException:
+            self._abandon(ticket)
+            raise
+        return ticket
+
+    async def acquire_async(self, agent_key, tokens):
+        ticket = AdmissionTicket(agent_key, tokens, future=asyncio.get_running_loop().create_future())
+        with self._lock:
+            self._enqueue(ticket)
+        try:
+            timeout = self._poll(ticket)
+            while timeout is not None:
+                try:
+                    await asyncio.wait_for(asyncio.shield(ticket.future), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                timeout = self._poll(ticket)
+        except BaseException:
+            # 包括CancelledError: 被取消的请求不能留在队列中占住其他agent的轮次
+            self._abandon(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket, used_tokens=None):
+        with self._lock:
+            self.in_flight -= 1
+            if used_tokens is not None and self.tokens_per_second is not None:
+                self.available_tokens -= used_tokens - ticket.tokens
+            self._dispatch()
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "in_flight": self.in_flight,
+                "admitted": self.admitted,
+                "mean_wait": self.total_wait / self.admitted if self.admitted else 0.0,
+                "max_wait": self.max_wait,
+            }
+
+
+def _resolve_future(future):
+    if not future.done():
+        future.set_result(None)
+
+
+_admission_controller_lock = threading.Lock()
+_admission_controllers = {}
+
+
+def get_admission_controller(base_url, api_key, max_concurrency=None, tokens_per_second=None):
+    """
+    返回进程内按(副本列表, api_key)共享的AdmissionController，两个限制都为None时不做准入控制，返回None
+    """
+    if max_concurrency is None and tokens_per_second is None:
+        return None
+    key = (normalize_base_urls(base_url), api_key)
+    with _admission_controller_lock:
+        admission_controller = _admission_controllers.get(key)
+        if admission_controller is None:
+            admission_controller = AdmissionController(max_concurrency, tokens_per_second)
+            _admission_controllers[key] = admission_controller
+    return admission_controller
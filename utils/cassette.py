@@ -0,0 +1,107 @@
+import json
+import os
+import threading
+from collections import defaultdict
+
+from utils.response_cache import build_cache_key
+
+CASSETTE_MODES = ("record", "replay")
+
+
+class Cassette:
+    """
+    录制/回放LLM的原始回复，用于离线确定性地重跑main.py。
+    每条记录是一行json: {"agent", "key", "occurrence", "content", "usage"}。agent是发出请求的agent，key是请求内容的哈希，
+    occurrence是这个agent的同一个请求第几次出现(重试和相同prompt会重复出现)，回放时按(agent, key, occurrence)取回复。
+    occurrence按agent分别计数，多个agent并发发出相同的请求时，回放结果不受它们之间先后顺序的影响。
+    content为null表示录制时这次请求失败了，回放时同样返回失败，使重试次数保持一致
+    """
+
+    def __init__(self, path, mode):
+        assert mode in CASSETTE_MODES, f"Invalid cassette mode: {mode}"
+        self.path = path
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._occurrences = defaultdict(int)
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+        if mode == "replay":
+            with open(path, "r") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[(entry.get("agent"), entry["key"], entry["occurrence"])] = entry
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            # occurrence在每个进程中从0开始计数，重新录制时覆盖旧文件，避免新旧记录的(agent, key, occurrence)重复。
+            # 逐行flush，程序中途退出也不会丢失已经录制的部分
+            self._file = open(path, "w")
+
+    def _next_occurrence(self, agent, key):
+        occurrence = self._occurrences[(agent, key)]
+        self._occurrences[(agent, key)] += 1
+        return occurrence
+
+    def record(self, request, content, usage=None, agent=None):
+        key = build_cache_key(request)
+        with self._lock:
+            entry = {
+                "agent": agent,
+                "key": key,
+                "occurrence": self._next_occurrence(agent, key),
+                "content": content,
+                "usage": usage,
+            }
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def play(self, request, agent=None):
+        """
+        返回agent录制的{"content", "usage"}，没有录制过这个请求时返回None
+        """
+        key = build_cache_key(request)
+        with self._lock:
+            entry = self._entries.get((agent, key, self._next_occurrence(agent, key)))
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def get_stats(self):
+        return {"mode": self.mode, "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        if self.mode == "record":
+            self._file.close()
+
+
+_cassette_lock = threading.Lock()
+_cassettes = {}
+
+
+def get_cassette(path, mode):
+    """
+    返回进程内按路径共享的Cassette，所有agent写入/读取同一个文件
+    """
+    key = os.path.abspath(path)
+    with _cassette_lock:
+        cassette = _cassettes.get(key)
+        if cassette is None:
+            cassette = Cassette(path, mode)
+            _cassettes[key] = cassette
+    assert cassette.mode == mode, f"Cassette {path} is already opened in {cassette.mode} mode"
+    return cassette
+
+
+def close_cassettes():
+    """
+    关闭进程内所有共享的Cassette，在main结束时调用
+    """
+    with _cassette_lock:
+        cassettes = list(_cassettes.values())
+        _cassettes.clear()
+    for cassette in cassettes:
+        cassette.close()
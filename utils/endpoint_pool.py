@@ -0,0 +1,267 @@
+import random
+import threading
+import time
+from collections import deque
+
+import httpx
+
+from utils.retry_utils import RETRYABLE_ERRORS
+
+ROUTING_POLICIES = ("least_outstanding", "latency_weighted")
+# 每个副本在统计中保留的最近剔除/重新加入事件数
+MAX_ENDPOINT_EVENTS = 20
+
+
+class Endpoint:
+    """
+    一个推理服务副本的状态和统计。
+    healthy: 正常参与路由; ejected: 暂时剔除，ejected_until之后进入probing;
+    probing: 同时只放行一个请求，成功后重新加入(healthy)，失败则再次剔除
+    """
+
+    def __init__(self, base_url, latency_alpha=0.2):
+        self.base_url = base_url
+        self.latency_alpha = latency_alpha
+        self.state = "healthy"
+        self.outstanding = 0
+        self.ewma_latency = None
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.eject_count = 0
+        self.ejections = 0
+        self.readmissions = 0
+        # 最近的剔除/重新加入事件，随get_stats输出
+        self.events = deque(maxlen=MAX_ENDPOINT_EVENTS)
+        self.requests = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+
+    def is_available(self, now):
+        if self.state == "ejected" and now >= self.ejected_until:
+            self.state = "probing"
+        if self.state == "probing":
+            return self.outstanding == 0
+        return self.state == "healthy"
+
+    def update_latency(self, latency):
+        if self.ewma_latency is None:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency = self.latency_alpha * latency + (1 - self.latency_alpha) * self.ewma_latency
+
+    def get_stats(self):
+        return {
+            "state": self.state,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": self.errors / self.requests if self.requests else 0.0,
+            "mean_latency": self.latency_sum / (self.requests - self.errors) if self.requests > self.errors else None,
+            "ewma_latency": self.ewma_latency,
+            "eject_count": self.eject_count,
+            "ejections": self.ejections,
+            "readmissions": self.readmissions,
+            "events": list(self.events),
+        }
+
+
+class EndpointPool:
+    """
+    在多个OpenAI兼容的推理服务副本之间做负载均衡。
+    least_outstanding: 选择正在处理请求数最少的副本，相同时选择延迟更低的;
+    latency_weighted: 按 1 / (ewma延迟 * (1 + 正在处理的请求数)) 加权随机选择。
+    连续eject_after次请求失败，或者延迟超过其他副本中位数的slow_factor倍时剔除副本，
+    剔除时间从eject_time开始随连续剔除次数翻倍(不超过max_eject_time)，之后先放行一个探测请求再重新加入
+    """
+
+    def __init__(
+        self,
+        base_urls,
+        api_key,
+        policy="least_outstanding",
+        eject_after=3,
+        eject_time=10.0,
+        max_eject_time=120.0,
+        slow_factor=3.0,
+        min_latency_samples=10,
+        health_check_interval=5.0,
+    ):
+        assert policy in ROUTING_POLICIES, f"Invalid routing policy: {policy}"
+        self.endpoints = [Endpoint(base_url) for base_url in base_urls]
+        self.api_key = api_key
+        self.policy = policy
+        self.eject_after = eject_after
+        self.eject_time = eject_time
+        self.max_eject_time = max_eject_time
+        self.slow_factor = slow_factor
+        self.min_latency_samples = min_latency_samples
+        self.health_check_interval = health_check_interval
+        self._lock = threading.Lock()
+        self._health_check_thread = None
+
+    def acquire(self):
+        """
+        选择一个副本并计入正在处理的请求，请求结束后必须调用release
+        """
+        now = time.time()
+        with self._lock:
+            candidates = [endpoint for endpoint in self.endpoints if endpoint.is_available(now)]
+            if not candidates:
+                # 所有副本都被剔除时仍然选择最早恢复的一个，后端整体不可用由CircuitBreaker处理
+                candidates = [min(self.endpoints, key=lambda endpoint: endpoint.ejected_until)]
+            if len(candidates) == 1:
+                endpoint = candidates[0]
+            elif self.policy == "least_outstanding":
+                endpoint = min(
+                    candidates,
+                    key=lambda endpoint: (endpoint.outstanding, endpoint.ewma_latency or 0.0, random.random()),
+                )
+            else:
+                endpoint = self._choose_by_latency(candidates)
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+        return endpoint
+
+    def _choose_by_latency(self, candidates):
+        known_latency = [endpoint.ewma_latency for endpoint in candidates if endpoint.ewma_latency]
+        # 还没有延迟数据的副本按已知副本的平均延迟估计，使新副本也能分到请求
+        default_latency = sum(known_latency) / len(known_latency) if known_latency else 1.0
+        weights = [
+            1.0 / ((endpoint.ewma_latency or default_latency) * (1 + endpoint.outstanding)) for endpoint in candidates
+        ]
+        return random.choices(candidates, weights=weights)[0]
+
+    def release(self, endpoint, latency, error_type=None):
+        """
+        记录一次请求的结果。error_type为None表示成功，否则是classify_error的结果
+        """
+        with self._lock:
+            endpoint.outstanding -= 1
+            if error_type is None:
+                endpoint.latency_sum += latency
+                endpoint.update_latency(latency)
+                endpoint.consecutive_failures = 0
+                if endpoint.state == "probing":
+                    self._readmit(endpoint, latency)
+                elif endpoint.state == "healthy" and self._is_slow(endpoint):
+                    self._eject(endpoint)
+                return
+            endpoint.errors += 1
+            if error_type not in RETRYABLE_ERRORS:
+                return
+            endpoint.consecutive_failures += 1
+            # 剔除前已经发出的请求失败时不重复剔除
+            if endpoint.state == "probing" or (
+                endpoint.state == "healthy" and endpoint.consecutive_failures >= self.eject_after
+            ):
+                self._eject(endpoint)
+
+    def _is_slow(self, endpoint):
+        if endpoint.requests - endpoint.errors < self.min_latency_samples:
+            return False
+        others = [
+            other.ewma_latency
+            for other in self.endpoints
+            if other is not endpoint and other.state == "healthy" and other.ewma_latency is not None
+        ]
+        # 没有其他健康副本时不能因为慢而剔除
+        if not others:
+            return False
+        others.sort()
+        median_latency = others[len(others) // 2]
+        return endpoint.ewma_latency > self.slow_factor * median_latency
+
+    def _eject(self, endpoint):
+        eject_time = min(self.max_eject_time, self.eject_time * 2 ** min(endpoint.eject_count, 10))
+        if endpoint.state == "healthy":
+            endpoint.eject_count = 0
+            eject_time = self.eject_time
+        endpoint.state = "ejected"
+        endpoint.ejected_until = time.time() + eject_time
+        endpoint.eject_count += 1
+        endpoint.ejections += 1
+        endpoint.events.append({"time": time.time(), "event": "eject", "eject_time": eject_time})
+
+    def _readmit(self, endpoint, latency):
+        endpoint.state = "healthy"
+        endpoint.consecutive_failures = 0
+        # 用探测请求的延迟重新开始统计，避免旧的慢延迟使副本立即再次被剔除
+        endpoint.ewma_latency = latency
+        endpoint.readmissions += 1
+        endpoint.events.append({"time": time.time(), "event": "readmit", "latency": latency})
+
+    def check_health(self, timeout=2.0):
+        """
+        主动探测已到恢复时间的被剔除副本(GET /models)，失败时延长剔除时间
+        """
+        now = time.time()
+        with self._lock:
+            due_endpoints = [
+                endpoint
+                for endpoint in self.endpoints
+                if endpoint.state in ("ejected", "probing") and now >= endpoint.ejected_until and endpoint.outstanding == 0
+            ]
+        for endpoint in due_endpoints:
+            try:
+                response = httpx.get(
+                    f"{endpoint.base_url.rstrip('/')}/models",
+                    headers={"Authorization": f"Bearer {self.api_key}"},
+                    timeout=timeout,
+                )
+                healthy = response.status_code == 200
+            except httpx.HTTPError:
+                healthy = False
+            with self._lock:
+                if endpoint.state not in ("ejected", "probing") or endpoint.outstanding:
+                    continue
+                if healthy:
+                    endpoint.state = "probing"
+                else:
+                    self._eject(endpoint)
+
+    def start_health_check(self):
+        """
+        启动后台线程定期执行check_health，只有一个副本时不需要
+        """
+        if self._health_check_thread is not None or len(self.endpoints) < 2 or self.health_check_interval <= 0:
+            return
+
+        def run():
+            while True:
+                time.sleep(self.health_check_interval)
+                self.check_health()
+
+        self._health_check_thread = threading.Thread(target=run, name="endpoint-health-check", daemon=True)
+        self._health_check_thread.start()
+
+    def get_stats(self):
+        with self._lock:
+            return {endpoint.base_url: endpoint.get_stats() for endpoint in self.endpoints}
+
+
+_endpoint_pool_lock = threading.Lock()
+_endpoint_pools = {}
+
+
+def normalize_base_urls(base_url):
+    """
+    base_url可以是单个url或url列表，统一转换为tuple
+    """
+    if isinstance(base_url, str):
+        return (base_url,)
+    return tuple(base_url)
+
+
+def get_endpoint_pool(base_url, api_key, policy="least_outstanding"):
+    """
+    返回进程内按(副本列表, api_key, 路由方式)共享的EndpointPool
+    """
+    base_urls = normalize_base_urls(base_url)
+    key = (base_urls, api_key, policy)
+    with _endpoint_pool_lock:
+        endpoint_pool = _endpoint_pools.get(key)
+        if endpoint_pool is None:
+            endpoint_pool = EndpointPool(base_urls, api_key, policy=policy)
+            endpoint_pool.start_health_check()
+            _endpoint_pools[key] = endpoint_pool
+    return endpoint_pool
@@ -1,4 +1,6 @@
 import heapq
+import threading
+
 import numpy as np
 from nmmo.lib.utils import in_bounds
 
@@ -14,6 +16,9 @@ AREA_TABLE = {
     (2, 2): "southeast",
 }
 
+# area label used by AreaPartition: x_part * 3 + y_part
+AREA_NAMES = [AREA_TABLE[(label // 3, label % 3)] for label in range(9)]
+
 CUTOFF = 100
 
 
@@ -28,10 +33,8 @@ def adjacentPos(pos):
     return [(r - 1, c), (r, c - 1), (r + 1, c), (r, c + 1)]
 
 
-def which_part(start, end, x):
-    if not (start <= x <= end):
-        raise ValueError(f"x is not in the range [{start}, {end}]")
-
+def get_part_ends(start, end):
+    """Last coordinate of the first and second of the three parts of [start, end]."""
     n = end - start + 1
     base = n // 3
     remainder = n % 3
@@ -47,6 +50,14 @@ def which_part(start, end, x):
 
     b1_end = start + L1 - 1
     b2_end = b1_end + L2
+    return b1_end, b2_end
+
+
+def which_part(start, end, x):
+    if not (start <= x <= end):
+        raise ValueError(f"x is not in the range [{start}, {end}]")
+
+    b1_end, b2_end = get_part_ends(start, end)
 
     if x <= b1_end:
         return 0
@@ -115,6 +126,35 @@ def get_area(tiles, x, y):
     return AREA_TABLE[(x_part, y_part)]
 
 
+class AreaPartition:
+    """3×3 area partition of one observation, computed once from the which_part logic.
+
+    labels is an int array aligned with the tiles it was built from, and
+    AREA_NAMES[label] is the area get_area would return for that tile.
+    """
+
+    def __init__(self, tiles):
+        self.bounds = get_bounds(tiles)
+        min_r, max_r, min_c, max_c = self.bounds
+        self.row_ends = get_part_ends(min_r, max_r)
+        self.col_ends = get_part_ends(min_c, max_c)
+        x_part = np.searchsorted(self.row_ends, tiles[:, 0], side="left")
+        y_part = np.searchsorted(self.col_ends, tiles[:, 1], side="left")
+        self.labels = x_part * 3 + y_part
+        self.areas = [AREA_NAMES[label] for label in self.labels.tolist()]
+
+    def area_of(self, x, y):
+        """Area of any position in the window, same as get_area(tiles, x, y)."""
+        min_r, max_r, min_c, max_c = self.bounds
+        if not (min_r <= x <= max_r):
+            raise ValueError(f"x is not in the range [{min_r}, {max_r}]")
+        if not (min_c <= y <= max_c):
+            raise ValueError(f"y is not in the range [{min_c}, {max_c}]")
+        x_part = 0 if x <= self.row_ends[0] else 1 if x <= self.row_ends[1] else 2
+        y_part = 0 if y <= self.col_ends[0] else 1 if y <= self.col_ends[1] else 2
+        return AREA_TABLE[(x_part, y_part)]
+
+
 def a_star_bounded(realm_map, start, goal, bounds=None):
     """Bounded A* that returns the first direction and full path length.
 
@@ -188,3 +228,379 @@ def a_star_bounded(realm_map, start, goal, bounds=None):
     path_length = cost[goal]
     # realm_map.pathfinding_cache[cache_key] = (direction, path_length)
     return (direction, path_length)
+
+
+
+# Flat-index offsets are derived from these in the same order as adjacentPos,
+# so the array-backed search expands neighbours exactly like a_star_bounded.
+NEIGHBOR_STEPS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+
+
+class SearchWindow:
+    """Padded flat copy of the habitable tiles inside a bounded search window.
+
+    Cells outside the window (including the one-tile padding ring) are never
+    passable, so neighbour expansion needs no bounds checks.
+    """
+
+    def __init__(self, top, left, height, width, passable):
+        self.top = top
+        self.left = left
+        self.height = height
+        self.width = width
+        self.size = height * width
+        self.passable = passable
+        self.offsets = tuple(dr * width + dc for dr, dc in NEIGHBOR_STEPS)
+
+    def index(self, pos):
+        r = pos[0] - self.top
+        c = pos[1] - self.left
+        if r <= 0 or c <= 0 or r >= self.height - 1 or c >= self.width - 1:
+            return None
+        return int(r) * self.width + int(c)
+
+    def position(self, index):
+        r, c = divmod(index, self.width)
+        return (r + self.top, c + self.left)
+
+
+class DistanceField:
+    """Result of a full bounded BFS from one start position."""
+
+    def __init__(self, window, start, distance):
+        self.window = window
+        self.start = start
+        self._distance = distance
+
+    def __contains__(self, pos):
+        return self.get_distance(pos) != float("inf")
+
+    def get_distance(self, pos):
+        if self.window is None:
+            return float("inf")
+        index = self.window.index(pos)
+        if index is None or self._distance[index] < 0:
+            return float("inf")
+        return int(self._distance[index])
+
+    def get_direction(self, pos):
+        """First step of the path a_star_bounded returns from start to pos.
+
+        With the consistent l1 heuristic, a_star_bounded pops tiles in
+        (f, g, position) order and only replaces a parent by a strictly
+        shorter one, so the parent of every tile on its path is the neighbour
+        one step closer to start with the smallest (l1 to goal, position).
+        Walking those parents back from pos only needs the distances.
+        """
+        path_length = self.get_distance(pos)
+        if path_length == float("inf") or path_length == 0:
+            return (0, 0)
+        width = self.window.width
+        offsets = self.window.offsets
+        distance = memoryview(self._distance)
+        cur = self.window.index(pos)
+        gr, gc = divmod(cur, width)
+        for step_distance in range(path_length - 1, 0, -1):
+            best_key = None
+            for offset in offsets:
+                prev = cur + offset
+                if distance[prev] == step_distance:
+                    pr, pc = divmod(prev, width)
+                    key = (abs(gr - pr) + abs(gc - pc), prev)
+                    if best_key is None or key < best_key:
+                        best_key = key
+            cur = best_key[1]
+        cr, cc = self.window.position(cur)
+        return (cr - self.start[0], cc - self.start[1])
+
+    def query(self, goal):
+        """Same (direction, path_length) answer as a_star_bounded for this start and bounds."""
+        return (self.get_direction(goal), self.get_distance(goal))
+
+
+class GridSearch:
+    """Array-backed bounded search engine over a realm map's habitable tiles.
+
+    Positions are flat indices into a SearchWindow, and cost/parent bookkeeping
+    lives in preallocated int32 buffers that are reused (and only grown) across
+    queries together with one heap and one queue. Instances are not
+    thread-safe; get_grid_search() returns the one owned by the calling thread.
+    """
+
+    def __init__(self):
+        self._capacity = 0
+        self._cost = np.empty(0, dtype=np.int32)
+        self._parent = np.empty(0, dtype=np.int32)
+        self._heap = []
+        self._queue = []
+
+    def _reserve(self, size):
+        if size > self._capacity:
+            self._capacity = size
+            self._cost = np.empty(size, dtype=np.int32)
+            self._parent = np.empty(size, dtype=np.int32)
+        self._cost[:size] = -1
+        return memoryview(self._cost), memoryview(self._parent)
+
+    def load_window(self, realm_map, bounds=None):
+        """Build the padded search window, or None if no tile can be searched."""
+        num_rows, num_cols = realm_map.tiles.shape
+        # in_bounds() excludes row/col 0 and keeps everything below the shape
+        lo_r, hi_r, lo_c, hi_c = 1, num_rows - 1, 1, num_cols - 1
+        if bounds is not None:
+            min_r, max_r, min_c, max_c = (int(v) for v in bounds)
+            lo_r, hi_r = max(lo_r, min_r), min(hi_r, max_r)
+            lo_c, hi_c = max(lo_c, min_c), min(hi_c, max_c)
+        if lo_r > hi_r or lo_c > hi_c:
+            return None
+        passable = np.zeros((hi_r - lo_r + 3, hi_c - lo_c + 3), dtype=np.int8)
+        passable[1:-1, 1:-1] = realm_map.habitable_tiles[lo_r : hi_r + 1, lo_c : hi_c + 1] != 0
+        return SearchWindow(lo_r - 1, lo_c - 1, passable.shape[0], passable.shape[1], passable.tobytes())
+
+    def a_star(self, realm_map, start, goal, bounds=None):
+        """Drop-in replacement for a_star_bounded with identical results."""
+        window = self.load_window(realm_map, bounds)
+        if window is None:
+            return ((0, 0), float("inf"))
+        passable = window.passable
+        s = window.index(start)
+        g = window.index(goal)
+        if s is not None and not passable[s]:
+            s = None
+        if g is not None and not passable[g]:
+            g = None
+        if start == goal and s is not None:
+            return ((0, 0), 0)
+        if s is None or g is None:
+            return ((0, 0), float("inf"))
+
+        width = window.width
+        offsets = window.offsets
+        gr, gc = divmod(g, width)
+        cost, parent = self._reserve(window.size)
+        heap = self._heap
+        heap.clear()
+        push = heapq.heappush
+        pop = heapq.heappop
+
+        sr, sc = divmod(s, width)
+        cost[s] = 0
+        heap.append((abs(gr - sr) + abs(gc - sc), 0, s))
+        found = False
+        while heap:
+            _, cur_cost, cur = pop(heap)
+            if cur == g:
+                found = True
+                break
+            new_cost = cur_cost + 1
+            for offset in offsets:
+                nxt = cur + offset
+                if not passable[nxt]:
+                    continue
+                old_cost = cost[nxt]
+                if old_cost < 0 or new_cost < old_cost:
+                    cost[nxt] = new_cost
+                    parent[nxt] = cur
+                    nr, nc = divmod(nxt, width)
+                    push(heap, (new_cost + abs(gr - nr) + abs(gc - nc), new_cost, nxt))
+        heap.clear()
+        if not found:
+            return ((0, 0), float("inf"))
+
+        cur = g
+        while cur != s and parent[cur] != s:
+            cur = parent[cur]
+        cr, cc = divmod(cur, width)
+        return ((cr - sr, cc - sc), cost[g])
+
+    def bfs(self, realm_map, start, bounds=None):
+        """Full bounded BFS from start; returns a DistanceField over the window."""
+        window = self.load_window(realm_map, bounds)
+        if window is None:
+            return DistanceField(None, start, None)
+        passable = window.passable
+        s = window.index(start)
+        distance = np.full(window.size, -1, dtype=np.int32)
+        if s is None or not passable[s]:
+            return DistanceField(window, start, distance)
+
+        cost, _ = self._reserve(window.size)
+        queue = self._queue
+        queue.clear()
+        cost[s] = 0
+        queue.append(s)
+        offsets = window.offsets
+        head = 0
+        while head < len(queue):
+            cur = queue[head]
+            head += 1
+            new_cost = cost[cur] + 1
+            for offset in offsets:
+                nxt = cur + offset
+                if passable[nxt] and cost[nxt] < 0:
+                    cost[nxt] = new_cost
+                    queue.append(nxt)
+        queue.clear()
+        distance[:] = self._cost[: window.size]
+        return DistanceField(window, start, distance)
+
+    def nearest_step(self, realm_map, start, targets, bounds=None, directions=NEIGHBOR_STEPS):
+        """First step from start toward the nearest of several targets, in one expansion.
+
+        Runs a multi-source BFS outward from every target until it reaches
+        start. Among the neighbours of start that lie on a shortest path, the
+        first one in directions wins. start itself is never a target.
+        Returns (direction, path_length) like a_star_bounded.
+        """
+        window = self.load_window(realm_map, bounds)
+        if window is None:
+            return ((0, 0), float("inf"))
+        passable = window.passable
+        s = window.index(start)
+        if s is None or not passable[s]:
+            return ((0, 0), float("inf"))
+
+        cost, _ = self._reserve(window.size)
+        queue = self._queue
+        queue.clear()
+        for target in targets:
+            t = window.index(target)
+            if t is None or t == s or not passable[t] or cost[t] >= 0:
+                continue
+            cost[t] = 0
+            queue.append(t)
+
+        offsets = window.offsets
+        found = False
+        head = 0
+        while head < len(queue) and not found:
+            cur = queue[head]
+            head += 1
+            new_cost = cost[cur] + 1
+            for offset in offsets:
+                nxt = cur + offset
+                if passable[nxt] and cost[nxt] < 0:
+                    cost[nxt] = new_cost
+                    if nxt == s:
+                        found = True
+                        break
+                    queue.append(nxt)
+        queue.clear()
+        if not found:
+            return ((0, 0), float("inf"))
+
+        # BFS labels a whole layer before the next one, so every neighbour one
+        # step closer to a target is already known once start is reached
+        path_length = cost[s]
+        width = window.width
+        for dr, dc in directions:
+            nxt = s + dr * width + dc
+            if passable[nxt] and cost[nxt] == path_length - 1:
+                return ((dr, dc), path_length)
+        return ((0, 0), float("inf"))
+
+
+_thread_local = threading.local()
+
+
+def get_grid_search():
+    """Return the GridSearch engine owned by the calling thread."""
+    engine = getattr(_thread_local, "grid_search", None)
+    if engine is None:
+        engine = GridSearch()
+        _thread_local.grid_search = engine
+    return engine
+
+
+def a_star_grid(realm_map, start, goal, bounds=None):
+    """Array-backed bounded A* with the same arguments and results as a_star_bounded."""
+    return get_grid_search().a_star(realm_map, start, goal, bounds=bounds)
+
+
+def nearest_target_step(realm_map, start, targets, bounds=None, directions=NEIGHBOR_STEPS):
+    """(direction, path_length) toward the nearest reachable target; see GridSearch.nearest_step."""
+    return get_grid_search().nearest_step(realm_map, start, targets, bounds=bounds, directions=directions)
+
+
+def bfs_bounded(realm_map, start, bounds=None):
+    """Bounded BFS from start that returns the distance and first step to every reachable tile.
+
+    Uses the same search area as a_star_bounded, so for any goal the distance
+    equals the path_length returned by a_star_bounded(realm_map, start, goal, bounds).
+
+    Args:
+      realm_map: Map containing tiles and habitable_tiles.
+      start: (row, col) tuple.
+      bounds: Optional (min_r, max_r, min_c, max_c) inclusive search window.
+    Returns:
+      DistanceField: get_distance(pos) is the shortest path length from start
+      (inf when unreachable) and get_direction(pos) is the (dr, dc) first step
+      of the same shortest path a_star_bounded picks ((0, 0) for start or
+      unreachable tiles).
+    """
+    return get_grid_search().bfs(realm_map, start, bounds=bounds)
+
+
+class PathfindingCache:
+    """Tick-scoped cache of full search results shared by every manager of one realm.
+
+    Entries are keyed by (tick, start, bounds) and hold the DistanceField of a
+    bounded BFS, so any goal queried from an origin that was already searched
+    in the current tick is a lookup. The cache empties itself as soon as
+    realm.tick advances.
+    """
+
+    def __init__(self, realm):
+        self.realm = realm
+        self.tick = None
+        self._fields = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_distance_field(self, start, bounds=None):
+        tick = self.realm.tick
+        key = (
+            tick,
+            (int(start[0]), int(start[1])),
+            tuple(int(v) for v in bounds) if bounds is not None else None,
+        )
+        with self._lock:
+            if tick != self.tick:
+                self._fields = {}
+                self.tick = tick
+            field = self._fields.get(key)
+            if field is not None:
+                self.hits += 1
+                return field
+        field = bfs_bounded(self.realm.map, start, bounds=bounds)
+        with self._lock:
+            self.misses += 1
+            if tick == self.tick:
+                self._fields[key] = field
+        return field
+
+    def query(self, start, goal, bounds=None):
+        """(direction, path_length) from start to goal, answered from the cached field."""
+        return self.get_distance_field(start, bounds=bounds).query(goal)
+
+    def get_stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+_pathfinding_cache_lock = threading.Lock()
+
+
+def get_pathfinding_cache(realm):
+    """Return the PathfindingCache attached to realm, creating it on first use."""
+    with _pathfinding_cache_lock:
+        cache = getattr(realm, "search_cache", None)
+        if cache is None:
+            cache = PathfindingCache(realm)
+            realm.search_cache = cache
+    return cache
@@ -0,0 +1,60 @@
+import threading
+from collections import deque
+
+
+def common_prefix_length(a, b):
+    """
+    两个字符串的公共前缀长度。二分查找，每一步用切片比较(C实现)，避免逐字符的python循环
+    """
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[:mid] == b[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def render_messages(messages):
+    """
+    按chat template的顺序把messages拼成一个字符串，用来近似推理服务看到的token序列
+    """
+    return "".join(f"<{message['role']}>\n{message['content']}\n" for message in messages)
+
+
+class PrefixTracker:
+    """
+    统计每个模块的prompt与最近window个同模块prompt(来自任意agent)的最长公共前缀，
+    近似vLLM自动前缀缓存(automatic prefix caching)能复用的KV cache长度
+    """
+
+    def __init__(self, window=8):
+        self.window = window
+        self._lock = threading.Lock()
+        self._recent = {}
+        self._stats = {}
+
+    def observe(self, module, messages):
+        prompt = render_messages(messages)
+        with self._lock:
+            recent = self._recent.setdefault(module, deque(maxlen=self.window))
+            shared = max((common_prefix_length(prompt, other) for other in recent), default=0)
+            recent.append(prompt)
+            stats = self._stats.setdefault(module, {"prompts": 0, "prompt_chars": 0, "shared_prefix_chars": 0})
+            stats["prompts"] += 1
+            stats["prompt_chars"] += len(prompt)
+            stats["shared_prefix_chars"] += shared
+        return shared
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                module: {
+                    "prompts": stats["prompts"],
+                    "mean_prompt_chars": stats["prompt_chars"] / stats["prompts"],
+                    "mean_shared_prefix_chars": stats["shared_prefix_chars"] / stats["prompts"],
+                    "shared_prefix_ratio": stats["shared_prefix_chars"] / stats["prompt_chars"],
+                }
+                for module, stats in self._stats.items()
+            }
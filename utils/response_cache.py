@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# 每写入这么多次检查一次缓存大小，避免每次写入都统计整张表
+EVICTION_CHECK_INTERVAL = 64
+
+
+def build_cache_key(request, response_format=None, choice_space=None):
+    """
+    对请求内容做哈希。request是BaseLLMClient.build_request的结果，包含model、messages、temperature和enable_thinking
+    """
+    content = {
+        "request": request,
+        "response_format": response_format,
+        "choice_space": list(choice_space) if choice_space is not None else None,
+    }
+    data = json.dumps(content, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    基于sqlite的LLM回复缓存，按请求内容寻址。
+    使用WAL模式和busy_timeout，多个main.py进程可以同时读写同一个缓存文件；
+    总大小超过max_bytes时按最近访问时间淘汰最旧的条目，直到降到low_watermark * max_bytes以下
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, low_watermark=0.8, timeout=30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.low_watermark = low_watermark
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._put_count = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        connection = self._get_connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)")
+        connection.commit()
+
+    def _get_connection(self):
+        # sqlite连接不能跨线程使用，每个线程各自打开一个连接
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        connection = self._get_connection()
+        try:
+            row = connection.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            connection.commit()
+        except sqlite3.Error as e:
+            print(f"Response cache read failed: {e}")
+            return None
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        data = json.dumps(value, ensure_ascii=False)
+        connection = self._get_connection()
+        try:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, data, len(data), time.time()),
+            )
+            connection.commit()
+        except sqlite3.Error as e:
+            print(f"Response cache write failed: {e}")
+            return
+
+        with self._lock:
+            self._put_count += 1
+            should_evict = self._put_count % EVICTION_CHECK_INTERVAL == 0
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        connection = self._get_connection()
+        try:
+            total_size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total_size <= self.max_bytes:
+                return
+            target_size = self.max_bytes * self.low_watermark
+            removed_keys = []
+            for key, size in connection.execute("SELECT key, size FROM responses ORDER BY last_access"):
+                if total_size <= target_size:
+                    break
+                removed_keys.append((key,))
+                total_size -= size
+            connection.executemany("DELETE FROM responses WHERE key = ?", removed_keys)
+            connection.commit()
+        except sqlite3.Error as e:
+            print(f"Response cache eviction failed: {e}")
+
+    def get_stats(self):
+        connection = self._get_connection()
+        entries, total_size = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"entries": entries, "size": total_size}
+
+
+_response_cache_lock = threading.Lock()
+_response_caches = {}
+
+
+def get_response_cache(path, max_bytes=256 * 1024 * 1024):
+    """
+    返回进程内按路径共享的ResponseCache
+    """
+    key = os.path.abspath(path)
+    with _response_cache_lock:
+        cache = _response_caches.get(key)
+        if cache is None:
+            cache = ResponseCache(path, max_bytes=max_bytes)
+            _response_caches[key] = cache
+    return cache
@@ -0,0 +1,146 @@
+import random
+import threading
+import time
+
+import openai
+
+# 可以重试、并且说明后端不健康的错误类型
+RETRYABLE_ERRORS = ("rate_limit", "server_error", "timeout", "connection")
+
+
+def classify_error(error):
+    """
+    把openai的异常分为rate_limit(429)、server_error(5xx)、timeout、connection、client_error(其他4xx)和unknown
+    """
+    if isinstance(error, openai.RateLimitError):
+        return "rate_limit"
+    if isinstance(error, openai.APITimeoutError):
+        return "timeout"
+    if isinstance(error, openai.APIConnectionError):
+        return "connection"
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code >= 500:
+            return "server_error"
+        if error.status_code in (408, 429):
+            return "rate_limit" if error.status_code == 429 else "timeout"
+        return "client_error"
+    return "unknown"
+
+
+def get_retry_after(error):
+    """
+    读取429/503回复中的Retry-After(秒)，没有时返回None
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    指数退避 + full jitter: 第n次重试前等待uniform(0, min(max_delay, base_delay * 2^n))秒，
+    使同时失败的agent错开重试时间，不会同步地再次压垮server。server给出Retry-After时至少等待这么久
+    """
+
+    def __init__(self, max_retries=4, base_delay=0.5, max_delay=20.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def get_delay(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+class CircuitBreaker:
+    """
+    同一个后端的所有client共享的熔断器。
+    closed: 正常请求；连续failure_threshold次请求失败后进入open。
+    open: 拒绝所有请求(调用方退回随机/默认动作)；recovery_time秒后进入half_open。
+    half_open: 只放行一个探测请求，成功则回到closed，失败则重新open
+    """
+
+    def __init__(self, failure_threshold=8, recovery_time=10.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.open_count = 0
+        self.shed_count = 0
+
+    def _update_state(self):
+        if self.state == "open" and time.time() - self.opened_at >= self.recovery_time:
+            self.state = "half_open"
+            self.probe_in_flight = False
+
+    def is_open(self):
+        """
+        后端当前是否被判定为不健康(不消耗half_open的探测名额)
+        """
+        with self._lock:
+            self._update_state()
+            return self.state == "open" or (self.state == "half_open" and self.probe_in_flight)
+
+    def allow_request(self):
+        with self._lock:
+            self._update_state()
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            self.shed_count += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self.probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == "half_open" or (
+                self.state == "closed" and self.consecutive_failures >= self.failure_threshold
+            ):
+                self.state = "open"
+                self.opened_at = time.time()
+                self.open_count += 1
+            self.probe_in_flight = False
+
+    def get_stats(self):
+        with self._lock:
+            self._update_state()
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "open_count": self.open_count,
+                "shed_count": self.shed_count,
+            }
+
+
+_circuit_breaker_lock = threading.Lock()
+_circuit_breakers = {}
+
+
+def get_circuit_breaker(base_url, api_key):
+    """
+    返回进程内按(base_url, api_key)共享的CircuitBreaker
+    """
+    key = (base_url, api_key)
+    with _circuit_breaker_lock:
+        circuit_breaker = _circuit_breakers.get(key)
+        if circuit_breaker is None:
+            circuit_breaker = CircuitBreaker()
+            _circuit_breakers[key] = circuit_breaker
+    return circuit_breaker
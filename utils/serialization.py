@@ -0,0 +1,98 @@
+import json
+
+# pretty: json.dumps(indent=4); compact: 不带空白的json; tabular: 缩写key，同类对象的列表按表格逐行输出
+SERIALIZATION_PROFILES = ("pretty", "compact", "tabular")
+
+# tabular格式中使用的key缩写，说明放在prompt的静态部分
+KEY_ABBREVIATIONS = {
+    "in_combat": "combat",
+    "attacked_by": "attacker",
+    "attack_target": "target",
+    "map_coordinates": "pos",
+    "in_safety_zone": "safe",
+    "dist_to_safety_zone": "safe_dist",
+    "resource_at_current_location": "here",
+    "resources": "res",
+    "entities": "ent",
+    "is_resource": "is_res",
+    "passible": "pass",
+    "original_resource": "orig",
+    "combat_style": "style",
+    "out_of_fog_tile_count": "clear_n",
+    "in_fog_tile_count": "fog_n",
+    "on_the_edge_tile_count": "edge_n",
+    "visited_tile_count": "visited_n",
+    "passible_tile_count": "pass_n",
+    "reachable_tile_count": "reach_n",
+    "item_number": "items_n",
+    "is_equipped": "equip",
+    "melee_attack": "melee_atk",
+    "range_attack": "range_atk",
+    "mage_attack": "mage_atk",
+    "quantity": "qty",
+    "resource_restore": "res_restore",
+    "health_restore": "hp_restore",
+}
+
+
+def build_abbreviation_legend():
+    legend = ", ".join(f"{short}={key}" for key, short in KEY_ABBREVIATIONS.items())
+    return (
+        "The game state below uses a compact table format: nested objects are indented, lists of objects are written as "
+        "'key[count]: column|column|...' followed by one row per object ('-' means not applicable). "
+        f"Abbreviations: {legend}. "
+    )
+
+
+def _format_scalar(value):
+    if isinstance(value, bool) or value is None:
+        return json.dumps(value)
+    return str(value)
+
+
+def _is_table(value):
+    return isinstance(value, list) and value and all(isinstance(row, dict) for row in value)
+
+
+def _write_table(key, rows, indent, lines):
+    columns = []
+    for row in rows:
+        for column in row:
+            if column not in columns:
+                columns.append(column)
+    header = "|".join(KEY_ABBREVIATIONS.get(column, column) for column in columns)
+    lines.append(f"{indent}{key}[{len(rows)}]: {header}")
+    for row in rows:
+        lines.append(indent + "  " + "|".join(_format_scalar(row[column]) if column in row else "-" for column in columns))
+
+
+def _write_tabular(value, indent, lines):
+    for key, item in value.items():
+        short_key = KEY_ABBREVIATIONS.get(key, key)
+        if isinstance(item, dict):
+            if not item:
+                lines.append(f"{indent}{short_key}: -")
+                continue
+            lines.append(f"{indent}{short_key}:")
+            _write_tabular(item, indent + "  ", lines)
+        elif _is_table(item):
+            _write_table(short_key, item, indent, lines)
+        elif isinstance(item, list):
+            lines.append(f"{indent}{short_key}: " + (", ".join(_format_scalar(element) for element in item) or "-"))
+        else:
+            lines.append(f"{indent}{short_key}: {_format_scalar(item)}")
+
+
+def serialize(value, profile="pretty"):
+    """
+    按序列化profile把状态描述(dict)转换为prompt中的文本
+    """
+    if profile == "pretty":
+        return json.dumps(value, indent=4)
+    if profile == "compact":
+        return json.dumps(value, separators=(",", ":"))
+    if profile == "tabular":
+        lines = []
+        _write_tabular(value, "", lines)
+        return "\n".join(lines)
+    raise ValueError(f"Unsupported serialization profile: {profile}")
@@ -0,0 +1,48 @@
+def _row_key(row):
+    if "id" in row:
+        return str(row["id"])
+    return row.get("name")
+
+
+def _keyed_rows(value):
+    """
+    对象列表按id(物品)或name(资源、实体)转换为dict，无法唯一标识时返回None
+    """
+    if not isinstance(value, list) or not all(isinstance(row, dict) for row in value):
+        return None
+    rows = {}
+    for row in value:
+        key = _row_key(row)
+        if key is None or key in rows:
+            return None
+        rows[key] = row
+    return rows
+
+
+def diff_state(old, new):
+    """
+    两个状态描述之间的变化: 只包含变化的字段，删除的字段为None，dict递归比较。
+    与RFC 7386的merge patch不同，对象列表按id或name转换为{key: 对象}逐个对象比较，patch中只包含新增(完整对象)、
+    变化(变化的字段)和删除(None)的对象；不能逐个比较的列表整体替换。两者相同时返回{}
+    """
+    patch = {}
+    for key, new_value in new.items():
+        if key not in old:
+            patch[key] = new_value
+            continue
+        old_value = old[key]
+        if old_value == new_value:
+            continue
+        if isinstance(old_value, dict) and isinstance(new_value, dict):
+            patch[key] = diff_state(old_value, new_value)
+            continue
+        old_rows = _keyed_rows(old_value)
+        new_rows = _keyed_rows(new_value)
+        if old_rows is not None and new_rows is not None:
+            patch[key] = diff_state(old_rows, new_rows)
+        else:
+            patch[key] = new_value
+    for key in old:
+        if key not in new:
+            patch[key] = None
+    return patch
@@ -0,0 +1,116 @@
+import threading
+
+import numpy as np
+
+from constant import MATERIAL_NAME_TO_ID
+
+FOUR_DIRECTIONS = [(0, 1), (0, -1), (1, 0), (-1, 0)]
+
+
+def neighbor_any(mask):
+    """True where at least one of the four neighbours (inside the map) is True."""
+    around = np.zeros_like(mask)
+    around[:-1, :] |= mask[1:, :]
+    around[1:, :] |= mask[:-1, :]
+    around[:, :-1] |= mask[:, 1:]
+    around[:, 1:] |= mask[:, :-1]
+    return around
+
+
+def get_material_ids(realm_map):
+    """Current material id of every tile, read from tile.state.index like StateManager does."""
+    return np.array([[tile.state.index for tile in row] for row in realm_map.tiles], dtype=np.int32)
+
+
+def label_components(searchable):
+    """4-connected component labels of the searchable tiles; 0 marks tiles outside every component."""
+    num_rows, num_cols = searchable.shape
+    width = num_cols + 2
+    padded = np.zeros((num_rows + 2, width), dtype=np.int8)
+    padded[1:-1, 1:-1] = searchable
+    passable = padded.ravel().tolist()
+    labels = [0] * len(passable)
+    offsets = (-width, -1, width, 1)
+
+    num_labels = 0
+    for seed, is_passable in enumerate(passable):
+        if not is_passable or labels[seed]:
+            continue
+        num_labels += 1
+        labels[seed] = num_labels
+        stack = [seed]
+        while stack:
+            cur = stack.pop()
+            for offset in offsets:
+                nxt = cur + offset
+                if passable[nxt] and not labels[nxt]:
+                    labels[nxt] = num_labels
+                    stack.append(nxt)
+    return np.array(labels, dtype=np.int32).reshape(padded.shape)[1:-1, 1:-1]
+
+
+class TerrainIndex:
+    """Terrain facts that never change during an episode, built once after env.reset().
+
+    Harvesting only swaps a tile between materials of the same passability
+    (e.g. Tree -> Stump, Fish -> Ocean), so habitable_tiles is fixed for the
+    whole episode and everything here is derived from it and the tile
+    materials (tile.state.index) at the time the index is built:
+      impassable: bool map, the complement of habitable_tiles.
+      component: 4-connected component label of every tile that a bounded
+        search may enter (habitable and inside in_bounds), 0 elsewhere. Two
+        tiles can only be connected by a path if their labels are equal and
+        non-zero.
+      water_around: tiles with a Water neighbour. Water never depletes.
+      fish_candidate_around: tiles with a neighbour that holds Fish at reset.
+        Fish depletes to Ocean and respawns, so this is a necessary condition
+        only; the current material still has to be checked.
+    """
+
+    def __init__(self, realm_map):
+        habitable = realm_map.habitable_tiles != 0
+        self.impassable = ~habitable
+
+        # a_star_bounded/GridSearch never enter row 0 or column 0 (see in_bounds)
+        searchable = habitable.copy()
+        searchable[0, :] = False
+        searchable[:, 0] = False
+        self.component = label_components(searchable)
+
+        materials = get_material_ids(realm_map)
+        self.water_around = neighbor_any(materials == MATERIAL_NAME_TO_ID["Water"])
+        self.fish_candidate_around = neighbor_any(materials == MATERIAL_NAME_TO_ID["Fish"])
+
+    def is_impassable(self, pos):
+        return bool(self.impassable[pos[0], pos[1]])
+
+    def get_component(self, pos):
+        return int(self.component[pos[0], pos[1]])
+
+    def can_connect(self, start, goal):
+        """False when no path between start and goal exists anywhere on the map."""
+        label = self.component[start[0], start[1]]
+        return label != 0 and label == self.component[goal[0], goal[1]]
+
+    def may_have_water_or_fish_around(self, pos):
+        return bool(self.water_around[pos[0], pos[1]] or self.fish_candidate_around[pos[0], pos[1]])
+
+
+_terrain_index_lock = threading.Lock()
+
+
+def build_terrain_index(realm):
+    """(Re)build the TerrainIndex of realm; call once after every env.reset()."""
+    terrain_index = TerrainIndex(realm.map)
+    with _terrain_index_lock:
+        realm.terrain_index = terrain_index
+    return terrain_index
+
+
+def get_terrain_index(realm):
+    """Return the TerrainIndex shared by every manager of realm, building it on first use."""
+    with _terrain_index_lock:
+        terrain_index = getattr(realm, "terrain_index", None)
+    if terrain_index is None:
+        terrain_index = build_terrain_index(realm)
+    return terrain_index
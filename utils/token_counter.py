@@ -0,0 +1,34 @@
+import threading
+
+import tiktoken
+
+# llama等本地模型的tokenizer与OpenAI不同，cl100k_base的计数只作为近似，用来比较不同prompt格式的相对大小
+TOKENIZER_ENCODING = "cl100k_base"
+
+_encoding_lock = threading.Lock()
+_encoding = None
+_encoding_loaded = False
+
+
+def get_encoding():
+    """
+    加载tiktoken的编码，第一次使用时需要下载词表，离线等加载失败的情况返回None
+    """
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            try:
+                _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+            except Exception as e:
+                print(f"Failed to load tiktoken encoding {TOKENIZER_ENCODING}, estimate tokens by length: {e}")
+                _encoding = None
+            _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text):
+    encoding = get_encoding()
+    if encoding is None:
+        # 英文平均每4个字符一个token
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))